@@ -1,30 +1,64 @@
 # app.py
+import os
+import instrument
 import streamlit as st
-import pandas as pd
-from pathlib import Path
-from io import BytesIO
-import pytz
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # --- import từ các module khác ---
 from db import (
     init_db, 
-    get_pending_requests_for_dept, 
     get_leave_request_by_id, 
     approve_leave, 
-    get_requests_for_dept, 
-    get_audit_logs,
+    decide_leave_requests,
+    count_audit_logs,
+    compressed_audit_partitions,
+    get_user_by_username,
+    count_requests_for_dept,
     check_employee_overlap, 
     dept_overlap_count, 
-    create_leave_request, 
-    get_user_by_id
+    check_dept_capacity,
+    create_leave_request,
+    get_leave_balance,
+    dept_weekly_absences,
+    dept_monthly_usage,
+    dept_approval_latency,
+    log_audit,
+    pool_stats,
+    cache_stats,
+    audit_writer_stats,
+    close_pool
 )
-from auth import verify_user
-from utils import save_uploaded_file
-from notify import send_email
+from auth import (verify_user, LoginThrottled, issue_session_token, verify_session_token,
+                  revoke_session_tokens, client_ip as _client_ip, SESSION_TTL_SECONDS)
+from utils import save_uploaded_file, open_attachment, attachment_exists, attachment_name, local_date_to_utc
+from notify import start_outbox_worker, outbox_stats
+from conflicts import list_conflicts, conflicts_for_leave
+import duty
+
+# Đo đạc lần rerun này (chỉ khi HR_INSTRUMENT=1, xem instrument.py)
+instrument.begin_rerun(key=st.session_state.setdefault('_instrument_key', os.urandom(8).hex()))
+instrument.section("init")
 
-# Khởi tạo DB (chỉ gọi 1 lần an toàn)
+# Khởi tạo DB: chỉ chạy thật ở lần rerun đầu tiên của mỗi process (xem db.init_db)
 init_db()
+# Lịch trực (dùng để cảnh báo trùng ca); chỉ đọc lại CSV khi file đổi
+duty.ensure_loaded()
+
+# Worker gửi email nền (đặt HR_OUTBOX_WORKER=external nếu chạy `python notify.py` riêng)
+if os.environ.get("HR_OUTBOX_WORKER", "thread") == "thread":
+    start_outbox_worker()
+
+# Số liệu vận hành (pool, cache, hàng đợi email, audit writer) cho trang Chẩn đoán và /metrics
+def so_lieu_van_hanh():
+    return {'pool': pool_stats(), 'cache': cache_stats(), 'outbox': outbox_stats(),
+            'audit_writer': audit_writer_stats()}
+
+# Endpoint Prometheus (HR_INSTRUMENT=1 HR_METRICS_PORT=9464), mở một lần mỗi process
+if instrument.ENABLED and os.environ.get("HR_METRICS_PORT"):
+    instrument.serve_metrics(int(os.environ["HR_METRICS_PORT"]), so_lieu_van_hanh)
+
+# Tài khoản được xem trang Chẩn đoán (tên đăng nhập, cách nhau bởi dấu phẩy)
+ADMIN_USERS = {u.strip() for u in os.environ.get("HR_ADMIN_USERS", "admin").split(",") if u.strip()}
 
 # Cấu hình giao diện
 st.set_page_config(page_title="Quản lý phép - BV", layout="wide")
@@ -45,50 +79,149 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# IP người dùng để chặn brute-force theo IP; X-Forwarded-For chỉ được đọc khi
+# kết nối tới từ proxy trong HR_TRUSTED_PROXIES (xem auth.client_ip)
+def client_ip():
+    headers = getattr(st.context, "headers", None) or {}
+    return _client_ip(getattr(st.context, "ip_address", None), headers.get("X-Forwarded-For"))
+
+# Session token lưu trong cookie (không đặt trong URL: lộ qua lịch sử trình
+# duyệt, link chia sẻ, log proxy). Streamlit chỉ đọc được cookie nên cookie
+# được ghi bằng một đoạn script nhỏ trên trang.
+SESSION_COOKIE = "hr_session"
+
+def ghi_cookie_phien(token, max_age):
+    import json
+    script = f"""<script>
+      const secure = window.parent.location.protocol === "https:" ? "; Secure" : "";
+      window.parent.document.cookie = {json.dumps(SESSION_COOKIE)} + "=" + {json.dumps(token)}
+          + "; Max-Age={int(max_age)}; Path=/; SameSite=Strict" + secure;
+    </script>"""
+    if hasattr(st, "iframe"):
+        st.iframe(script, height=1)
+    else:   # Streamlit cũ
+        import streamlit.components.v1 as components
+        components.html(script, height=0)
+
 # --- simple login UI (session_state) ---
+instrument.section("login")
+# Phiên đã đăng nhập trước đó (tải lại trang) dùng lại session token trong
+# cookie, không phải kiểm tra bcrypt lại.
+if 'user' not in st.session_state:
+    token = st.context.cookies.get(SESSION_COOKIE)
+    user = verify_session_token(token) if token else None
+    if user:
+        st.session_state['user'] = user
+    elif token:
+        ghi_cookie_phien("", 0)     # hết hạn / đã đăng xuất: xóa cookie
+
 if 'user' not in st.session_state:
     st.sidebar.title("🔐 Đăng nhập")
     username = st.sidebar.text_input("Tên đăng nhập")
     password = st.sidebar.text_input("Mật khẩu", type="password")
     if st.sidebar.button("Đăng nhập"):
-        user = verify_user(username, password)
+        try:
+            user = verify_user(username, password, ip=client_ip())
+        except LoginThrottled as e:
+            st.sidebar.error(f"⏳ Đăng nhập tạm thời bị chặn. {e}")
+            st.stop()
         if user:
             st.session_state['user'] = user
+            log_audit('login', user['id'], 'user', user['id'], client_ip())
+            # cookie được ghi ở lần chạy kế tiếp (st.rerun() bỏ phần giao diện của lần này)
+            st.session_state['_session_cookie'] = issue_session_token(user)
             st.rerun()
         else:
             st.sidebar.error("❌ Sai tên đăng nhập hoặc mật khẩu")
     st.stop()
 
 
+# pandas chỉ cần từ đây trở đi: trang đăng nhập của worker mới khởi động không phải tải
+import pandas as pd
+from frames import audit_page, pending_requests, requests_page
+
 # Lấy thông tin user từ session
 user = st.session_state['user']
+instrument.annotate(user=user['username'])
+if '_session_cookie' in st.session_state:
+    ghi_cookie_phien(st.session_state.pop('_session_cookie'), SESSION_TTL_SECONDS)
+instrument.section("sidebar")
 
 # Sidebar thông tin user + logout
 with st.sidebar:
     st.write(f"👋 Xin chào **{user['name']}**")
     st.caption(f"Vai trò: {user['role']} | Khoa: {user['dept']}")
     if st.button("🚪 Đăng xuất"):
+        # thu hồi token phía server; cookie cũ bị xóa ở lần chạy kế tiếp
+        revoke_session_tokens(user['id'])
         st.session_state.clear()
         st.rerun()
 
 st.title("📄 Quản lý đơn nghỉ phép")
 
-# Tính ngày phép còn lại
+# Tính ngày phép còn lại (đọc từ sổ phép leave_balances)
 def tinh_ngay_phep_con_lai(user_id):
-    YEAR = datetime.now().year
-    TOTAL = 12
-    df_all = pd.DataFrame(get_requests_for_dept(user['dept']))
-    df_user = df_all[(df_all['employee_id'] == user_id) & (df_all['status'] == 'approved')]
-    df_user['start_date'] = pd.to_datetime(df_user['start_date'])
-    df_user = df_user[df_user['start_date'].dt.year == YEAR]
-    da_nghi = sum((pd.to_datetime(df_user['end_date']) - pd.to_datetime(df_user['start_date'])).dt.days + 1)
-    con_lai = TOTAL - da_nghi
-    return TOTAL, da_nghi, con_lai
+    balance = get_leave_balance(user_id, datetime.now().year)
+    return balance['entitlement'], balance['days_used'], balance['remaining']
+
+# Kiểm tra sức chứa cho một nhóm đơn sắp duyệt (tính cả các đơn trong cùng nhóm)
+def don_vuot_nguong(batch, max_allowed):
+    batch = batch.sort_values('start_date')
+    fits = check_dept_capacity(user['dept'], zip(batch['start_date'], batch['end_date']), max_allowed)
+    return [rid for rid, ok in zip(batch['id'], fits) if not ok]
+
+# File báo cáo chỉ tạo khi người dùng bấm tải (callable cho st.download_button) và
+# không cache: không giữ sẵn các file báo cáo đầy đủ trong bộ nhớ của process
+def xuat_bao_cao(dept, start_date, end_date, user_id, fmt):
+    # reports (và openpyxl khi xuất Excel) chỉ import khi có người tải báo cáo
+    from reports import export_requests_csv, export_requests_xlsx
+    export = export_requests_csv if fmt == "csv" else export_requests_xlsx
+    log_audit('export_report', user_id, 'report', None, f"{dept} {start_date}..{end_date} {fmt}")
+    with export(dept, start_date, end_date) as f:
+        return f.read()
+
+# Phân trang theo keyset cursor: lưu chồng cursor của các trang đã xem trong session
+def phan_trang(key, fetch_page, total):
+    page_size = st.selectbox("Số dòng / trang", [25, 50, 100, 200], index=1, key=f"{key}_size")
+    state = st.session_state.get(key)
+    if state is None or state['page_size'] != page_size:
+        state = st.session_state[key] = {'page_size': page_size, 'cursors': [None]}
+    rows, next_cursor = fetch_page(page_size=page_size, cursor=state['cursors'][-1])
+
+    page_no = len(state['cursors'])
+    col1, col2, col3 = st.columns([1, 3, 1])
+    with col1:
+        if st.button("◀ Trang trước", disabled=page_no == 1, key=f"{key}_prev"):
+            state['cursors'].pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Trang {page_no}/{max(1, -(-total // page_size))} — tổng {total} dòng")
+    with col3:
+        if st.button("Trang sau ▶", disabled=next_cursor is None, key=f"{key}_next"):
+            state['cursors'].append(next_cursor)
+            st.rerun()
+    return rows
+
+# Nhãn các thao tác trong audit log
+AUDIT_ACTIONS = {
+    'create_leave': "Nộp đơn",
+    'approve': "Duyệt đơn",
+    'reject': "Từ chối đơn",
+    'cancel': "Hủy đơn",
+    'login': "Đăng nhập",
+    'export_report': "Xuất báo cáo",
+    'bulk_import': "Nhập dữ liệu hàng loạt",
+}
 
 # Navigation menu (ẩn "Duyệt đơn" nếu là employee)
 menu_items = ["📝 Nộp đơn", "📊 Báo cáo / Xuất", "📜 Lịch sử thao tác"]
 if user['role'] == 'manager':
     menu_items.insert(1, "✅ Duyệt đơn")
+if user['role'] in ('manager', 'hr'):
+    menu_items.insert(-1, "🩺 Trùng lịch trực")
+    menu_items.insert(-1, "📈 Thống kê")
+if user['username'] in ADMIN_USERS:
+    menu_items.append("🛠️ Chẩn đoán")
 
 page = st.sidebar.radio("📌 Chọn chức năng", menu_items)
 
@@ -98,6 +231,9 @@ st.sidebar.markdown(f"**📆 Ngày phép trong năm:** {total_phep} ngày")
 st.sidebar.markdown(f"**✅ Đã nghỉ:** {da_nghi} ngày")
 st.sidebar.markdown(f"**🕒 Còn lại:** {con_lai} ngày")
 
+instrument.annotate(page=page)
+instrument.section("page " + page.split(" ", 1)[-1])
+
 # --- Trang Nộp đơn ---
 if page.startswith("📝"):
     st.header("📝 Nộp đơn nghỉ phép")
@@ -141,18 +277,62 @@ if page.startswith("📝"):
                 st.error("❌ Lỗi khi lưu file: " + str(e))
                 st.stop()
 
-        req_id = create_leave_request(user['id'], sd, ed, reason, attachment_path=attach_path)
+        req_id = create_leave_request(user['id'], sd, ed, reason, attachment_path=attach_path,
+                                      attachment_name=attachment.name if attachment else None)
         st.success(f"✅ Nộp đơn thành công. ID đơn: {req_id}")
 
 # --- Manager view ---
 elif page.startswith("✅"):
     st.header(f"📌 Đơn chờ duyệt - Khoa: {user['dept']}")
-    requests = get_pending_requests_for_dept(user['dept'])
-    if not requests:
+    if 'bulk_result' in st.session_state:
+        kind, text = st.session_state.pop('bulk_result')
+        getattr(st, kind)(text)
+    df = pending_requests(user['dept'])
+    if df.empty:
         st.info("Không có đơn chờ duyệt.")
+    elif st.toggle("☑️ Duyệt hàng loạt"):
+        editor = df[['id','employee_name','username','start_date','end_date','reason','created_at']].copy()
+        editor.insert(0, 'chon', False)
+        edited = st.data_editor(
+            editor,
+            hide_index=True,
+            use_container_width=True,
+            disabled=[c for c in editor.columns if c != 'chon'],
+            column_config={'chon': st.column_config.CheckboxColumn("Chọn")},
+            key="bulk_editor",
+        )
+        selected = df[df['id'].isin(edited.loc[edited['chon'], 'id'])]
+        st.caption(f"Đã chọn {len(selected)} / {len(df)} đơn.")
+
+        max_allowed_on_leave = st.number_input(
+            "Số tối đa đồng thời được nghỉ trong khoa",
+            min_value=1,
+            value=2
+        )
+        note_bulk = st.text_area("Ghi chú / lý do từ chối (áp dụng cho các đơn đã chọn)")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            approve_clicked = st.button("✅ Duyệt các đơn đã chọn", disabled=selected.empty)
+        with col2:
+            reject_clicked = st.button("❌ Từ chối các đơn đã chọn", disabled=selected.empty)
+
+        if approve_clicked:
+            over = don_vuot_nguong(selected, max_allowed_on_leave)
+            if over:
+                st.error(f"⚠️ Các đơn {', '.join(f'#{i}' for i in over)} sẽ làm số người nghỉ vượt ngưỡng ({max_allowed_on_leave}). Bỏ chọn rồi thử lại.")
+                st.stop()
+            changed = decide_leave_requests(selected['id'].tolist(), user['id'], approved=True,
+                                            note=note_bulk or "Duyệt bởi " + user['username'], notify=True)
+            st.session_state['bulk_result'] = ("success", f"Đã duyệt {len(changed)} đơn.")
+            st.rerun()
+
+        if reject_clicked:
+            changed = decide_leave_requests(selected['id'].tolist(), user['id'], approved=False,
+                                            note=note_bulk, notify=True)
+            st.session_state['bulk_result'] = ("warning", f"Đã từ chối {len(changed)} đơn.")
+            st.rerun()
     else:
-        df = pd.DataFrame(requests)
-        df['created_at'] = pd.to_datetime(df['created_at']).dt.tz_localize('UTC').dt.tz_convert('Asia/Ho_Chi_Minh')
         display = df[['id','employee_name','username','start_date','end_date','reason','created_at']]
         st.dataframe(display, use_container_width=True)
 
@@ -163,29 +343,27 @@ elif page.startswith("✅"):
             st.markdown(f"- **Người gửi:** {req['employee_id']}")
             st.markdown(f"- **Lý do:** {req['reason']}")
             st.markdown(f"- **Trạng thái:** {req['status']}")
-            if req.get('attachment_path'):
-                path = Path(req['attachment_path'])
-                if path.exists():
-                    with open(path, "rb") as f:
-                        st.download_button("📎 Tải tệp đính kèm", data=f.read(), file_name=path.name)
+            trung = conflicts_for_leave(req['employee_id'], req['start_date'], req['end_date'])
+            if not trung.empty:
+                ca = ", ".join(f"{r.date} ({r.department})" for r in trung.itertuples())
+                st.warning(f"🩺 Nhân viên này có lịch trực trong thời gian nghỉ: {ca}")
+            ref = req.get('attachment_path')
+            if attachment_exists(ref):
+                # chỉ mở file khi bấm tải, không đọc lại ở mỗi lần rerun
+                st.download_button("📎 Tải tệp đính kèm", data=lambda r=ref: open_attachment(r),
+                                   file_name=attachment_name(ref, req.get('attachment_name')))
 
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("✅ Duyệt"):
-                    approve_leave(req['id'], user['id'], approved=True, note="Duyệt bởi " + user['username'])
-                    emp = get_user_by_id(req['employee_id'])
-                    if emp and emp.get('email'):
-                        send_email(emp['email'], f"[Thông báo] Đơn #{req['id']} đã được duyệt", f"Xin chào {emp['name']}, đơn nghỉ phép của bạn đã được duyệt.")
+                    approve_leave(req['id'], user['id'], approved=True, note="Duyệt bởi " + user['username'], notify=True)
                     st.success("Đã duyệt đơn.")
                     st.rerun()
 
             with col2:
                 reason_reject = st.text_area("Lý do từ chối")
                 if st.button("❌ Từ chối"):
-                    approve_leave(req['id'], user['id'], approved=False, note=reason_reject)
-                    emp = get_user_by_id(req['employee_id'])
-                    if emp and emp.get('email'):
-                        send_email(emp['email'], f"[Thông báo] Đơn #{req['id']} bị từ chối", f"Xin chào {emp['name']}, đơn nghỉ phép của bạn đã bị từ chối.\nLý do: {reason_reject}")
+                    approve_leave(req['id'], user['id'], approved=False, note=reason_reject, notify=True)
                     st.warning("Đã từ chối đơn.")
                     st.rerun()
 
@@ -199,30 +377,201 @@ elif page.startswith("📊"):
     with col2:
         end = st.date_input("Đến ngày")
 
-    if st.button("⬇️ Tải báo cáo CSV"):
-        df = pd.DataFrame(get_requests_for_dept(dept, start_date=start.isoformat(), end_date=end.isoformat()))
-        df['created_at'] = pd.to_datetime(df['created_at']).dt.tz_localize('UTC').dt.tz_convert('Asia/Ho_Chi_Minh')
-        csv = df.to_csv(index=False).encode('utf-8')
-        st.download_button("Tải CSV", data=csv, file_name=f"report_{dept}_{start}_{end}.csv", mime="text/csv")
-
-    if st.button("⬇️ Tải báo cáo Excel"):
-        df = pd.DataFrame(get_requests_for_dept(dept, start_date=start.isoformat(), end_date=end.isoformat()))
-        df['created_at'] = pd.to_datetime(df['created_at']).dt.tz_localize('UTC').dt.tz_convert('Asia/Ho_Chi_Minh')
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='report')
-        st.download_button("Tải Excel", data=buffer.getvalue(),
+    sd, ed = start.isoformat(), end.isoformat()
+    st.subheader("Xem trước")
+    df = phan_trang(
+        f"report_{dept}_{sd}_{ed}",
+        lambda **kw: requests_page(dept, sd, ed, **kw),
+        count_requests_for_dept(dept, start_date=sd, end_date=ed),
+    )
+    if not df.empty:
+        st.dataframe(df, use_container_width=True)
+    else:
+        st.info("Không có đơn trong khoảng thời gian này.")
+
+    # tham số gắn vào callable lúc vẽ nút: file được tạo (và ghi audit) khi bấm tải
+    bao_cao = (dept, sd, ed, user['id'])
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("⬇️ Tải báo cáo CSV", data=lambda a=bao_cao: xuat_bao_cao(*a, fmt="csv"),
+                           file_name=f"report_{dept}_{start}_{end}.csv", mime="text/csv")
+    with col2:
+        st.download_button("⬇️ Tải báo cáo Excel", data=lambda a=bao_cao: xuat_bao_cao(*a, fmt="xlsx"),
                            file_name=f"report_{dept}_{start}_{end}.xlsx",
                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
+# --- Thống kê (đọc từ các bảng tổng hợp, không quét leave_requests) ---
+elif page.startswith("📈"):
+    st.header("📈 Thống kê nghỉ phép")
+    col1, col2 = st.columns(2)
+    with col1:
+        dept = user['dept'] if user['role'] != 'hr' else st.selectbox("Chọn khoa", options=["Khoa A","Khoa B","Khoa C"],
+                                                                     key="stats_dept")
+    with col2:
+        so_thang = st.slider("Số tháng gần nhất", min_value=3, max_value=24, value=12)
+    today = datetime.now().date()
+    end_month = today.strftime("%Y-%m")
+    start_month = (pd.Period(end_month, freq="M") - (so_thang - 1)).strftime("%Y-%m")
+
+    months = pd.DataFrame(dept_monthly_usage(dept, start_month, end_month)).set_index('month')
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Đơn đã nộp", int(months['submitted'].sum()))
+    c2.metric("Ngày nghỉ đã duyệt", int(months['days_used'].sum()))
+    c3.metric("Đơn được duyệt", int(months['approved'].sum()))
+    c4.metric("Đơn bị từ chối", int(months['rejected'].sum()))
+
+    st.subheader("Số ngày nghỉ theo tháng")
+    st.bar_chart(months[['days_used']].rename(columns={'days_used': 'Ngày nghỉ'}))
+    st.subheader("Đơn theo tháng")
+    st.line_chart(months[['submitted', 'approved', 'rejected']].rename(
+        columns={'submitted': 'Nộp', 'approved': 'Duyệt', 'rejected': 'Từ chối'}))
+
+    st.subheader("Nhân viên nghỉ theo tuần")
+    weeks = pd.DataFrame(dept_weekly_absences(dept, f"{start_month}-01", today.isoformat())).set_index('week')
+    st.line_chart(weeks.rename(columns={'person_days': 'Người-ngày nghỉ', 'peak': 'Nghỉ cùng lúc cao nhất'}))
+
+    st.subheader("Thời gian chờ duyệt")
+    latency = pd.DataFrame(dept_approval_latency(dept, start_month, end_month)).set_index('label')
+    st.bar_chart(latency[['approved', 'rejected']].rename(columns={'approved': 'Duyệt', 'rejected': 'Từ chối'}),
+                 sort=False)
+
+# --- Trùng lịch trực ---
+elif page.startswith("🩺"):
+    st.header("🩺 Lịch trực trùng ngày nghỉ phép đã duyệt")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        start = st.date_input("Từ ngày", value=datetime.now().date().replace(day=1), key="conflict_start")
+    with col2:
+        end = st.date_input("Đến ngày", key="conflict_end")
+    with col3:
+        khoa = st.selectbox("Khoa trực", options=["Tất cả"] + duty.departments())
+    rows = list_conflicts(start.isoformat(), end.isoformat(), None if khoa == "Tất cả" else khoa)
+    if rows:
+        df = pd.DataFrame(rows)
+        df['role'] = df['role'].map({'doctor': 'Bác sĩ', 'nurse': 'Điều dưỡng'})
+        st.dataframe(df.rename(columns={
+            'date': 'Ngày trực', 'department': 'Khoa trực', 'role': 'Vai trò', 'person': 'Tên trong lịch',
+            'request_id': 'Đơn #', 'leave_start': 'Nghỉ từ', 'leave_end': 'Nghỉ đến',
+            'employee_name': 'Nhân viên', 'employee_dept': 'Khoa',
+        }).drop(columns=['schedule_id']), use_container_width=True, hide_index=True)
+    else:
+        st.success("Không có ca trực nào trùng ngày nghỉ phép.")
+
 # --- Audit logs ---
 elif page.startswith("📜"):
     st.header("📜 Lịch sử thao tác")
-    logs = get_audit_logs(limit=500)
-    if logs:
-        df = pd.DataFrame(logs)
-        if 'created_at' in df.columns:
-            df['created_at'] = pd.to_datetime(df['created_at']).dt.tz_localize('UTC').dt.tz_convert('Asia/Ho_Chi_Minh')
-        st.dataframe(df, use_container_width=True)
+    with st.expander("🔎 Tìm kiếm", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            tu_khoa = st.text_input("Ghi chú có chứa", placeholder="vd. ốm, công tác")
+            hanh_dong = st.selectbox("Thao tác", ["Tất cả"] + list(AUDIT_ACTIONS),
+                                     format_func=lambda a: AUDIT_ACTIONS.get(a, a))
+        with col2:
+            nguoi = st.text_input("Người thao tác (tên đăng nhập)")
+            loai = st.selectbox("Đối tượng", ["Tất cả", "leave_request", "user", "report"])
+        with col3:
+            tu_ngay = st.date_input("Từ ngày", value=None, key="audit_from")
+            den_ngay = st.date_input("Đến ngày", value=None, key="audit_to")
+
+    bo_loc = {
+        'text': tu_khoa.strip() or None,
+        'action': None if hanh_dong == "Tất cả" else hanh_dong,
+        'obj_type': None if loai == "Tất cả" else loai,
+        'start': local_date_to_utc(tu_ngay),
+        'end': local_date_to_utc(den_ngay + timedelta(days=1)) if den_ngay else None,
+    }
+    if nguoi.strip():
+        nguoi_row = get_user_by_username(nguoi.strip())
+        if nguoi_row is None:
+            st.warning(f"Không có tài khoản '{nguoi.strip()}'.")
+            st.stop()
+        bo_loc['user_id'] = nguoi_row['id']
+
+    # tháng đã nén không đọc được trên trang này: báo rõ thay vì để số dòng "biến mất"
+    da_nen = compressed_audit_partitions(bo_loc['start'], bo_loc['end'])
+    if da_nen:
+        st.info(f"🗜️ {len(da_nen)} tháng audit đã nén ({sum(p['row_count'] for p in da_nen)} dòng) không có trong "
+                f"kết quả và tổng số dưới đây: {', '.join(p['month'] for p in da_nen)}. Giải nén để xem lại: "
+                f"`python manage.py audit-restore YYYY-MM`.")
+
+    logs = phan_trang(
+        "audit_logs_" + "|".join(f"{k}={v}" for k, v in sorted(bo_loc.items())),
+        lambda **kw: audit_page(**bo_loc, **kw),
+        count_audit_logs(**bo_loc),
+    )
+    if not logs.empty:
+        st.dataframe(logs, use_container_width=True)
     else:
-        st.info("Chưa có log.")
+        st.info("Chưa có log." if not any(bo_loc.values()) else "Không có log khớp điều kiện tìm kiếm.")
+
+# --- Chẩn đoán (chỉ tài khoản trong HR_ADMIN_USERS) ---
+elif page.startswith("🛠️"):
+    st.header("🛠️ Chẩn đoán hiệu năng")
+    so_lieu = so_lieu_van_hanh()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Kết nối DB đang dùng", f"{so_lieu['pool']['in_use']} / {so_lieu['pool']['open']}",
+              help=f"Phải chờ kết nối {so_lieu['pool']['waits']} lần")
+    c2.metric("Tỉ lệ trúng cache", f"{so_lieu['cache']['hit_rate']:.0%}")
+    c3.metric("Email chờ gửi", so_lieu['outbox']['depth'].get('queued', 0))
+    c4.metric("Audit log chờ ghi", so_lieu['audit_writer']['pending'])
+    with st.expander("Chi tiết pool / cache / outbox / audit writer"):
+        st.json(so_lieu)
+
+    bat = st.toggle("Bật đo đạc (SQL, span, từng lần rerun)", value=instrument.ENABLED)
+    if bat != instrument.ENABLED:
+        instrument.enable(bat)
+        close_pool()    # mở lại kết nối để dùng / bỏ cursor đo thời gian
+        st.rerun()
+    if not instrument.ENABLED:
+        st.info("Đo đạc đang tắt. Bật ở trên, hoặc chạy với HR_INSTRUMENT=1 để đo cả từng hàm db.py.")
+        st.stop()
+
+    reruns = instrument.recent_reruns()
+    st.subheader(f"Các lần rerun gần nhất ({len(reruns)})")
+    if reruns:
+        bang = pd.DataFrame([{
+            'Lúc': r['at'], 'Người dùng': r.get('user'), 'Trang': r.get('page'),
+            'Tổng (ms)': r['seconds'] * 1000, 'Số câu SQL': r['sql_calls'], 'SQL (ms)': r['sql_seconds'] * 1000,
+        } for r in reversed(reruns)])
+        st.dataframe(bang, use_container_width=True, hide_index=True)
+        chon = st.selectbox("Xem chi tiết lần rerun", options=range(len(reruns)),
+                            format_func=lambda i: f"{bang['Lúc'][i]} — {bang['Trang'][i]} ({bang['Tổng (ms)'][i]:.0f} ms)")
+        r = reruns[-1 - chon]
+        if r['sections']:
+            st.bar_chart(pd.DataFrame(r['sections']).assign(ms=lambda d: d['seconds'] * 1000)
+                         .set_index('name')[['ms']], sort=False)
+        if r['top_sql']:
+            st.dataframe(pd.DataFrame(r['top_sql']).assign(ms=lambda d: d['seconds'] * 1000)
+                         [['ms', 'count', 'rows', 'distinct_params', 'sql', 'fingerprint']],
+                         use_container_width=True, hide_index=True)
+
+    st.subheader("Câu SQL (gộp theo dấu vân tay)")
+    cau_sql = instrument.statement_stats()
+    if cau_sql:
+        df = pd.DataFrame(cau_sql)
+        df['avg_ms'] = df['seconds'] / df['count'] * 1000
+        df['max_ms'] = df['max'] * 1000
+        st.dataframe(df[['fingerprint', 'count', 'seconds', 'avg_ms', 'max_ms', 'rows', 'sql']],
+                     use_container_width=True, hide_index=True)
+
+    st.subheader("Span (hàm db.py, bcrypt, SMTP, đoạn trang)")
+    spans = instrument.span_stats()
+    if spans:
+        df = pd.DataFrame(spans)
+        df['avg_ms'] = df['seconds'] / df['count'] * 1000
+        df['max_ms'] = df['max'] * 1000
+        st.dataframe(df[['name', 'count', 'seconds', 'avg_ms', 'max_ms']], use_container_width=True, hide_index=True)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("⬇️ JSON lines", data=lambda: instrument.jsonl_text(so_lieu_van_hanh()),
+                           file_name="hr_metrics.jsonl", mime="application/x-ndjson")
+    with col2:
+        st.download_button("⬇️ Prometheus", data=lambda: instrument.prometheus_text(so_lieu_van_hanh()),
+                           file_name="hr_metrics.prom", mime="text/plain")
+    with col3:
+        if st.button("🧹 Xóa số liệu đã đo"):
+            instrument.reset()
+            st.rerun()
+
+instrument.end_rerun()
@@ -1,22 +1,195 @@
 # auth.py
-import bcrypt
-from db import get_user_by_username
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import instrument
+from db import (
+    get_user_by_username,
+    get_user_by_id,
+    update_password_hash,
+    login_locked_for,
+    record_login_failure,
+    clear_login_failures,
+    revoke_sessions,
+)
+
+# ----- chính sách băm mật khẩu -----
+# Đổi BCRYPT_ROUNDS thì hash cũ được băm lại với cost mới ở lần đăng nhập kế tiếp.
+BCRYPT_ROUNDS = int(os.environ.get("HR_BCRYPT_ROUNDS", "12"))
+
+# bcrypt chạy trên pool thread có giới hạn (bcrypt nhả GIL) để giờ giao ca
+# không chiếm hết CPU; quá AUTH_MAX_PENDING yêu cầu đang chờ thì báo bận.
+AUTH_MAX_WORKERS = int(os.environ.get("HR_AUTH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+AUTH_MAX_PENDING = int(os.environ.get("HR_AUTH_MAX_PENDING", str(AUTH_MAX_WORKERS * 8)))
+AUTH_WAIT_SECONDS = 10
+
+# ----- chặn đăng nhập sai liên tiếp -----
+USER_MAX_FAILURES = 5
+IP_MAX_FAILURES = 100          # nhiều nhân viên có thể dùng chung một IP (NAT bệnh viện)
+FAILURE_WINDOW_SECONDS = 15 * 60
+LOCKOUT_SECONDS = 15 * 60
+
+SESSION_TTL_SECONDS = int(os.environ.get("HR_SESSION_TTL", str(12 * 3600)))
+
+# Reverse proxy được tin (IP hoặc dải CIDR, cách nhau bởi dấu phẩy). Chỉ khi
+# kết nối tới từ các địa chỉ này mới đọc X-Forwarded-For.
+TRUSTED_PROXIES = [ipaddress.ip_network(p.strip(), strict=False)
+                   for p in os.environ.get("HR_TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+_executor = ThreadPoolExecutor(max_workers=AUTH_MAX_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(AUTH_MAX_PENDING)
+
+
+class LoginThrottled(Exception):
+    """Đăng nhập bị tạm chặn (sai quá nhiều lần hoặc hệ thống đang quá tải)."""
+
+    def __init__(self, retry_after, message=None):
+        super().__init__(message or f"Thử lại sau {int(retry_after) + 1} giây.")
+        self.retry_after = retry_after
+
+
+def _run_bcrypt(fn, *args):
+    if not _slots.acquire(timeout=AUTH_WAIT_SECONDS):
+        raise LoginThrottled(AUTH_WAIT_SECONDS, "Hệ thống đang bận, vui lòng thử lại.")
+    try:
+        return _executor.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+# bcrypt chỉ import khi thật sự băm / kiểm tra (trang đăng nhập), không ở mỗi worker khởi động
+@instrument.timed("auth.bcrypt_hash")
+def _hash(plain, rounds=None):
+    import bcrypt
+    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)).decode()
+
+@instrument.timed("auth.bcrypt_check")
+def _check(plain, stored):
+    import bcrypt
+    return bcrypt.checkpw(plain, stored)
+
+def _hash_cost(stored):
+    # định dạng bcrypt: $2b$<cost>$<salt+hash>
+    try:
+        return int(stored.split("$")[2])
+    except (IndexError, ValueError):
+        return None
 
 def hash_password(plain):
-    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt()).decode()
+    return _run_bcrypt(_hash, plain)
+
+def _public_user(row):
+    return {"id": row['id'], "username": row['username'], "name": row['name'], "role": row['role'], "dept": row['dept'], "email": row.get('email')}
+
+def verify_user(username, password, ip=None):
+    keys = [f"user:{username}"] + ([f"ip:{ip}"] if ip else [])
+    now = time.time()
+    locked = login_locked_for(keys, now)
+    if locked:
+        raise LoginThrottled(locked)
 
-def verify_user(username, password):
     row = get_user_by_username(username)
-    if not row:
-        return None
-    stored = row.get('password_hash')
-    if stored is None:
-        return None
+    stored = row.get('password_hash') if row else None
     # stored string -> bytes
     try:
         stored_b = stored.encode()
     except Exception:
         stored_b = stored
-    if bcrypt.checkpw(password.encode(), stored_b):
-        return {"id": row['id'], "username": row['username'], "name": row['name'], "role": row['role'], "dept": row['dept'], "email": row.get('email')}
+    if stored_b and _run_bcrypt(_check, password.encode(), stored_b):
+        clear_login_failures(keys[0])
+        if _hash_cost(stored) != BCRYPT_ROUNDS:
+            update_password_hash(row['id'], hash_password(password))
+        return _public_user(row)
+
+    record_login_failure(keys[0], now, USER_MAX_FAILURES, FAILURE_WINDOW_SECONDS, LOCKOUT_SECONDS)
+    if ip:
+        record_login_failure(keys[1], now, IP_MAX_FAILURES, FAILURE_WINDOW_SECONDS, LOCKOUT_SECONDS)
     return None
+
+def _trusted(addr, proxies):
+    try:
+        ip = ipaddress.ip_address(addr)
+    except ValueError:
+        return False
+    return any(ip in net for net in proxies)
+
+def client_ip(peer, forwarded=None, proxies=None):
+    """
+    IP người dùng để chặn brute-force. `peer` là địa chỉ kết nối tới, `forwarded`
+    là header X-Forwarded-For. Header chỉ được đọc khi peer là proxy tin cậy;
+    khi đó lấy hop ngoài cùng bên phải không phải proxy tin cậy (các hop bên
+    trái do client tự ghi, không tin được).
+    """
+    proxies = TRUSTED_PROXIES if proxies is None else proxies
+    if not forwarded or not peer or not _trusted(peer, proxies):
+        return peer
+    hops = [h.strip() for h in forwarded.split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop, proxies):
+            return hop
+    return hops[0] if hops else peer
+
+# ----- session token -----
+# Token dạng <payload base64>.<HMAC-SHA256>, payload gồm user id, hạn dùng,
+# dấu vân tay của password hash (đổi mật khẩu thì token cũ hết hiệu lực) và
+# thế hệ session của user (đăng xuất -> revoke_session_tokens -> token cũ hết hiệu lực).
+_fallback_secret = secrets.token_bytes(32)
+
+def _session_secret():
+    secret = os.environ.get("HR_SESSION_SECRET")
+    if not secret:
+        try:
+            import streamlit as st
+            secret = st.secrets.get("auth", {}).get("session_secret")
+        except Exception:
+            secret = None
+    # không cấu hình: token chỉ dùng được trong process hiện tại
+    return secret.encode() if secret else _fallback_secret
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _fingerprint(password_hash):
+    return hashlib.sha256((password_hash or "").encode()).hexdigest()[:16]
+
+def _sign(payload):
+    return _b64(hmac.new(_session_secret(), payload.encode(), hashlib.sha256).digest())
+
+def issue_session_token(user, ttl=SESSION_TTL_SECONDS):
+    row = get_user_by_id(user['id'])
+    payload = _b64(json.dumps({"uid": user['id'], "exp": int(time.time() + ttl),
+                               "pw": _fingerprint(row and row.get('password_hash')),
+                               "gen": (row or {}).get('session_gen', 0)}).encode())
+    return f"{payload}.{_sign(payload)}"
+
+def verify_session_token(token):
+    """Trả về thông tin user nếu token hợp lệ, None nếu sai chữ ký / hết hạn."""
+    try:
+        payload, sig = token.split(".", 1)
+        if not hmac.compare_digest(sig, _sign(payload)):
+            return None
+        data = json.loads(_unb64(payload))
+    except (ValueError, TypeError):
+        return None
+    if data.get("exp", 0) < time.time():
+        return None
+    row = get_user_by_id(data.get("uid"))
+    if not row or not hmac.compare_digest(data.get("pw", ""), _fingerprint(row.get('password_hash'))):
+        return None
+    if data.get("gen") != row.get('session_gen', 0):
+        return None
+    return _public_user(row)
+
+def revoke_session_tokens(user_id):
+    """Đăng xuất: mọi token đã cấp cho user không còn dùng được."""
+    revoke_sessions(user_id)
@@ -0,0 +1,327 @@
+# backends.py
+# Backend cơ sở dữ liệu cho db.py, chọn bằng HR_DATABASE_URL:
+#
+#   (không đặt)                 SQLite tại db.DB_PATH — một máy, như trước.
+#   sqlite:///data/hr.db        SQLite tại đường dẫn cho sẵn (sqlite:////... nếu tuyệt đối).
+#   sqlite+tcp://host:7433      SQLite qua mạng: db_server.py trên máy giữ file
+#                               hr.db, nhiều replica app (nhiều máy) kết nối tới.
+#
+# Mọi backend trả về kết nối có cùng giao diện với sqlite3.Connection mà db.py
+# dùng (execute / executemany / cursor / commit / rollback / in_transaction,
+# dòng đọc được theo tên cột và chỉ số, lỗi là các lớp sqlite3.Error) nên pool,
+# transaction() và toàn bộ SQL trong db.py dùng chung cho mọi backend.
+# Kết nối sqlite+tcp dùng multiprocessing.connection (pickle + xác thực HMAC
+# bằng HR_DATABASE_KEY); mỗi kết nối phía client ứng với một kết nối SQLite
+# riêng trên máy chủ nên transaction, PRAGMA data_version (cache của db.py) và
+# ATTACH hoạt động như khi chạy cục bộ.
+import builtins
+import os
+import sqlite3
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import instrument
+
+CACHE_SIZE_KB = 16 * 1024           # page cache cho mỗi kết nối
+MMAP_SIZE = 128 * 1024 * 1024       # đọc file DB qua mmap
+
+# số dòng máy chủ gửi kèm kết quả execute; phần còn lại lấy thêm theo lô
+PREFETCH_ROWS = 500
+DEFAULT_PORT = 7433
+
+
+class SQLiteBackend:
+    """SQLite trên file cục bộ."""
+
+    local = True
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @property
+    def db_path(self):
+        return self.path
+
+    def connect(self, timeout=30, row_factory=sqlite3.Row):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=timeout,
+                               factory=instrument.connection_factory())
+        conn.row_factory = row_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        return conn
+
+    def __str__(self):
+        return f"sqlite:///{self.path}"
+
+
+class RemoteBackend:
+    """SQLite trên máy khác, qua db_server.py."""
+
+    local = False
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._db_path = None
+
+    @property
+    def db_path(self):
+        """Đường dẫn hr.db trên máy chủ (dùng cho ATTACH file archive audit)."""
+        if self._db_path is None:
+            conn = self.connect()
+            conn.close()
+        return self._db_path
+
+    def connect(self, timeout=30):
+        from multiprocessing.connection import Client, AuthenticationError
+        try:
+            channel = Client(self.address, authkey=self.authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise sqlite3.OperationalError(f"Không kết nối được db_server {self}: {e}") from e
+        conn = RemoteConnection(channel)
+        info = conn._call({"op": "hello", "timeout": timeout})
+        self._db_path = Path(info["db_path"])
+        return conn
+
+    def __str__(self):
+        return f"sqlite+tcp://{self.address[0]}:{self.address[1]}"
+
+
+def from_url(url):
+    """Backend theo URL (xem đầu file). Khóa sqlite+tcp lấy từ HR_DATABASE_KEY."""
+    parts = urlsplit(url)
+    if parts.scheme == "sqlite" and url.startswith("sqlite:///") and len(url) > len("sqlite:///"):
+        # như SQLAlchemy: sqlite:///tương/đối, sqlite:////tuyệt/đối
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if parts.scheme == "sqlite+tcp":
+        key = os.environ.get("HR_DATABASE_KEY")
+        if not key:
+            raise ValueError("sqlite+tcp cần HR_DATABASE_KEY (khóa chung giữa app và db_server.py).")
+        return RemoteBackend((parts.hostname or "127.0.0.1", parts.port or DEFAULT_PORT), key.encode())
+    raise ValueError(f"Không hỗ trợ HR_DATABASE_URL={url!r} (sqlite:///đường/dẫn hoặc sqlite+tcp://host:port).")
+
+
+# ---- phía client của sqlite+tcp ----
+class Row:
+    """Dòng kết quả giống sqlite3.Row: đọc theo chỉ số hoặc tên cột (không phân biệt hoa thường)."""
+
+    __slots__ = ("_values", "_index")
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def keys(self):
+        return list(self._index["names"])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index["lookup"][key.lower()]
+            except KeyError:
+                raise IndexError("No item with that key") from None
+        return self._values[key]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __eq__(self, other):
+        return isinstance(other, Row) and self.keys() == other.keys() and self._values == other._values
+
+    def __hash__(self):
+        return hash((tuple(self._index["names"]), self._values))
+
+    def __repr__(self):
+        return f"<Row {dict(zip(self._index['names'], self._values))}>"
+
+
+def _index(description):
+    names = [d[0] for d in description]
+    lookup = {}
+    for i, name in enumerate(names):
+        lookup.setdefault(name.lower(), i)
+    return {"names": names, "lookup": lookup}
+
+
+def _raise(name, args):
+    exc = getattr(sqlite3, name, None)
+    if not (isinstance(exc, type) and issubclass(exc, Exception)):
+        exc = getattr(builtins, name, None)
+        if not (isinstance(exc, type) and issubclass(exc, Exception)):
+            exc = sqlite3.Error
+    raise exc(*args)
+
+
+def _params(parameters):
+    # tham số tên (:name) giữ nguyên dict, còn lại gửi dạng tuple
+    return dict(parameters) if isinstance(parameters, dict) else tuple(parameters)
+
+
+class RemoteCursor:
+    arraysize = 1
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._id = None
+        self._rows = []
+        self._pos = 0
+        self._done = True
+        self._index = None
+        self._key = None
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, sql, parameters=()):
+        self._discard()
+        t0 = time.perf_counter()
+        reply = self._conn._call({"op": "execute", "sql": sql, "params": _params(parameters)})
+        self._load(reply)
+        if instrument.ENABLED:
+            self._key = instrument.record_sql(sql, parameters, time.perf_counter() - t0,
+                                              max(self.rowcount, 0) + len(self._rows))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._discard()
+        t0 = time.perf_counter()
+        reply = self._conn._call({"op": "executemany", "sql": sql,
+                                  "params": [_params(p) for p in seq_of_parameters]})
+        self._load(reply)
+        if instrument.ENABLED:
+            self._key = instrument.record_sql(sql, None, time.perf_counter() - t0, max(self.rowcount, 0),
+                                              many=True)
+        return self
+
+    def _load(self, reply):
+        self._id = reply["cursor"]
+        self.description = reply["description"]
+        self._index = _index(self.description) if self.description else None
+        self._rows, self._pos, self._done = reply["rows"], 0, reply["done"]
+        self.rowcount, self.lastrowid = reply["rowcount"], reply["lastrowid"]
+
+    def _more(self):
+        if self._done:
+            return False
+        t0 = time.perf_counter()
+        reply = self._conn._call({"op": "fetch", "cursor": self._id, "size": PREFETCH_ROWS})
+        self._rows, self._pos, self._done = reply["rows"], 0, reply["done"]
+        if self._done:
+            self._id = None
+        if instrument.ENABLED:
+            instrument.record_fetch(self._key, time.perf_counter() - t0, len(self._rows))
+        return bool(self._rows)
+
+    def _discard(self):
+        # cursor chưa đọc hết: báo máy chủ đóng ở lần gọi kế tiếp
+        if self._id is not None and not self._done:
+            self._conn._closed_cursors.append(self._id)
+        self._id = None
+
+    def fetchone(self):
+        if self._pos >= len(self._rows) and not self._more():
+            return None
+        row = self._rows[self._pos]
+        self._pos += 1
+        return Row(self._index, row)
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        out = []
+        while len(out) < size:
+            row = self.fetchone()
+            if row is None:
+                break
+            out.append(row)
+        return out
+
+    def fetchall(self):
+        out = []
+        while True:
+            out.extend(Row(self._index, r) for r in self._rows[self._pos:])
+            self._pos = len(self._rows)
+            if not self._more():
+                return out
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._discard()
+        self._rows, self._done = [], True
+
+
+class RemoteConnection:
+    """Kết nối tới db_server.py, cùng giao diện với sqlite3.Connection mà db.py dùng."""
+
+    def __init__(self, channel):
+        self._channel = channel
+        self._in_transaction = False
+        self._broken = False
+        self._closed_cursors = []
+        self.row_factory = Row
+
+    def _call(self, request):
+        if self._broken:
+            raise sqlite3.OperationalError("Kết nối tới db_server đã hỏng.")
+        if self._closed_cursors:
+            request["close"], self._closed_cursors = self._closed_cursors, []
+        try:
+            self._channel.send(request)
+            reply = self._channel.recv()
+        except (OSError, EOFError) as e:
+            self._broken = True
+            raise sqlite3.OperationalError(f"Mất kết nối tới db_server: {e}") from e
+        self._in_transaction = reply.get("in_transaction", self._in_transaction)
+        if "error" in reply:
+            _raise(*reply["error"])
+        return reply
+
+    @property
+    def in_transaction(self):
+        if self._broken:
+            # để db._release bỏ kết nối này thay vì trả lại pool
+            raise sqlite3.OperationalError("Kết nối tới db_server đã hỏng.")
+        return self._in_transaction
+
+    def cursor(self):
+        return RemoteCursor(self)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        self._call({"op": "commit"})
+        if instrument.ENABLED:
+            instrument.record_span("sqlite.commit", time.perf_counter() - t0)
+
+    def rollback(self):
+        self._call({"op": "rollback"})
+
+    def set_trace_callback(self, callback):
+        raise sqlite3.NotSupportedError("set_trace_callback chỉ dùng được với SQLite cục bộ.")
+
+    def close(self):
+        if not self._broken:
+            try:
+                self._channel.send({"op": "close"})
+            except OSError:
+                pass
+        self._channel.close()
+        self._broken = True
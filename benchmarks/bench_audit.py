@@ -0,0 +1,83 @@
+# benchmarks/bench_audit.py
+# So sánh ghi audit từng dòng (mỗi dòng một transaction + commit) với
+# AuditWriter (gom lô, group commit), nhiều thread ghi đồng thời, trên DB tạm:
+#
+#     python benchmarks/bench_audit.py --threads 8 --events 5000
+#
+# In số sự kiện / giây của mỗi cách, cỡ lô và độ trễ commit của AuditWriter;
+# --save ghi vào benchmarks/results.jsonl (xem results.py).
+import argparse
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import results as bench_results
+
+
+def run(db, threads, events, durable):
+    per_thread = events // threads
+
+    def worker(t):
+        for i in range(per_thread):
+            db.log_audit("bench", t, "bench", i, f"thread {t} event {i}", durable=durable)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(worker, range(threads)))
+    db.flush_audit_logs()
+    elapsed = time.perf_counter() - t0
+    return per_thread * threads, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo tốc độ ghi audit")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--events", type=int, default=5000, help="tổng số sự kiện mỗi lượt đo")
+    parser.add_argument("--flush-rows", type=int, default=None)
+    parser.add_argument("--flush-seconds", type=float, default=None)
+    parser.add_argument("--save", action="store_true", help="ghi kết quả vào results.jsonl")
+    parser.add_argument("--label", default=None)
+    args = parser.parse_args()
+
+    import db
+
+    if args.flush_rows:
+        db._audit_writer.flush_rows = args.flush_rows
+    if args.flush_seconds:
+        db._audit_writer.flush_seconds = args.flush_seconds
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_pool()
+        db.DB_PATH = Path(tmp) / "bench_audit.db"
+        db.init_db()
+
+        results = {}
+        for name, durable in (("từng dòng", True), ("group commit", False)):
+            n, elapsed = run(db, args.threads, args.events, durable)
+            results[name] = n / elapsed
+            print(f"{name:<14} {n} sự kiện trong {elapsed:.2f}s  -> {n / elapsed:,.0f} sự kiện/s")
+
+        stats = db.audit_writer_stats()
+        print(f"\nAuditWriter: {stats['flushes']} lần commit, lô trung bình {stats.get('avg_batch', 0):.0f} "
+              f"(lớn nhất {stats['max_batch']}), commit p50 {stats.get('flush_p50', 0) * 1000:.1f} ms, "
+              f"p99 {stats.get('flush_p99', 0) * 1000:.1f} ms")
+        print(f"Tăng tốc: x{results['group commit'] / results['từng dòng']:.1f}")
+        assert db.count_audit_logs() == 2 * (args.events // args.threads) * args.threads
+        db.close_pool()
+
+    if args.save:
+        metrics = {"per_row": {"n": args.events, "events_per_sec": results["từng dòng"]},
+                   "group_commit": {"n": args.events, "events_per_sec": results["group commit"],
+                                    "flush_p50_ms": stats.get("flush_p50", 0) * 1000,
+                                    "flush_p99_ms": stats.get("flush_p99", 0) * 1000},
+                   "speedup": {"n": args.events, "speedup": results["group commit"] / results["từng dòng"]}}
+        bench_results.save("audit", {"threads": args.threads, "events": args.events}, metrics, label=args.label)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# benchmarks/bench_db.py
+# Đo trực tiếp các hàm của db.py trên một bệnh viện giả lập (synthetic.py),
+# cache truy vấn tắt để mọi lời gọi chạm tới SQLite:
+#
+#     python benchmarks/bench_db.py --staff 3000 --years 5 --repeat 300 --save
+#
+# In p50 / p99 và số lời gọi / giây của từng hàm; --save ghi vào
+# benchmarks/results.jsonl để so sánh giữa các phiên bản (results.py compare).
+import argparse
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import results
+import synthetic
+
+
+def measure(fn, repeat):
+    latencies = []
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+    return results.summarize(latencies, time.perf_counter() - t0)
+
+
+def cases(db, departments, rng):
+    """Danh sách (tên, hàm(i)) — các thao tác đọc trước, ghi sau."""
+    import conflicts
+    import duty
+
+    with db.connection() as conn:
+        employees = [tuple(r) for r in conn.execute("SELECT id, dept FROM users WHERE role = 'employee'")]
+        managers = {r["dept"]: r["id"] for r in conn.execute("SELECT id, dept FROM users WHERE role = 'manager'")}
+    today = date.today()
+    month = today.strftime("%Y-%m")
+    year_ago = (today - timedelta(days=365)).strftime("%Y-%m")
+
+    def dept():
+        return synthetic.department_name(rng.randrange(departments))
+
+    def some_range(ahead=0):
+        start = today + timedelta(days=rng.randrange(-365, 30) + ahead)
+        return start.isoformat(), (start + timedelta(days=rng.randint(0, 4))).isoformat()
+
+    created = []
+
+    def create(i):
+        emp, _ = rng.choice(employees)
+        created.append(db.create_leave_request(emp, *some_range(ahead=400), "bench"))
+
+    def approve(i):
+        if not created:
+            create(i)
+        db.decide_leave_requests([created[i % len(created)]], managers[dept()] if managers else 1, notify=True)
+
+    return [
+        ("get_pending_requests_for_dept", lambda i: db.get_pending_requests_for_dept(dept())),
+        ("get_requests_page_for_dept", lambda i: db.get_requests_page_for_dept(dept(), page_size=50)),
+        ("count_requests_for_dept", lambda i: db.count_requests_for_dept(dept(), status="approved")),
+        ("check_employee_overlap", lambda i: db.check_employee_overlap(rng.choice(employees)[0], *some_range())),
+        ("dept_overlap_count", lambda i: db.dept_overlap_count(dept(), *some_range())),
+        ("check_dept_capacity", lambda i: db.check_dept_capacity(dept(), [some_range() for _ in range(5)], 3)),
+        ("get_leave_balance", lambda i: db.get_leave_balance(rng.choice(employees)[0], today.year)),
+        ("dept_monthly_usage", lambda i: db.dept_monthly_usage(dept(), year_ago, month)),
+        ("dept_approval_latency", lambda i: db.dept_approval_latency(dept(), year_ago, month)),
+        ("dept_weekly_absences", lambda i: db.dept_weekly_absences(dept(), f"{year_ago}-01", today.isoformat())),
+        ("get_audit_logs_page", lambda i: db.get_audit_logs_page(page_size=100)),
+        ("search_audit_logs", lambda i: db.search_audit_logs(text=rng.choice(synthetic.REASONS), page_size=50)),
+        ("count_audit_logs", lambda i: db.count_audit_logs(action="login")),
+        ("duty.query_schedule", lambda i: duty.query_schedule(today.isoformat(), name=rng.choice(synthetic.TEN))),
+        ("conflicts.list_conflicts", lambda i: conflicts.list_conflicts(today.isoformat(),
+                                                                       (today + timedelta(days=30)).isoformat())),
+        ("create_leave_request", create),
+        ("decide_leave_requests(notify)", approve),
+        ("log_audit(durable)", lambda i: db.log_audit("bench", 1, "bench", i, "durable", durable=True)),
+        ("log_audit(buffered)", lambda i: db.log_audit("bench", 1, "bench", i, "buffered")),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo các hàm db.py trên dữ liệu giả lập")
+    synthetic.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=200, help="số lần gọi mỗi hàm")
+    parser.add_argument("--only", default=None, help="chỉ đo các hàm có tên chứa chuỗi này")
+    parser.add_argument("--save", action="store_true", help="ghi kết quả vào results.jsonl")
+    parser.add_argument("--label", default=None, help="nhãn phiên bản khi --save (mặc định: commit)")
+    args = parser.parse_args()
+
+    import db
+
+    metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_pool()
+        db.CACHE_ENABLED = False
+        db.DB_PATH = Path(tmp) / "bench_db.db"
+        db.init_db()
+        synthetic.generate(**synthetic.options(args))
+        rng = random.Random(args.seed)
+        for name, fn in cases(db, args.departments, rng):
+            if args.only and args.only not in name:
+                continue
+            metrics[name] = measure(fn, args.repeat)
+            print(results.format_metric(name, metrics[name]))
+        db.flush_audit_logs()
+        db.close_pool()
+
+    if args.save:
+        params = {**synthetic.options(args), "repeat": args.repeat}
+        record = results.save("db", params, metrics, label=args.label)
+        print(f"Đã lưu vào {results.RESULTS_FILE} (label {record['label']}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/bench_login.py
+# Đo số lượt đăng nhập / giây (tổng và trên mỗi core) qua auth.verify_user
+# với nhiều "phiên" đăng nhập đồng thời, trên một DB tạm:
+#
+#     python benchmarks/bench_login.py --rounds 12 --sessions 32 --logins 200
+#
+# Số worker bcrypt lấy theo HR_AUTH_WORKERS (xem auth.py); --save ghi kết quả
+# vào benchmarks/results.jsonl (xem results.py).
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    parser.add_argument("--sessions", type=int, default=32, help="số phiên đăng nhập đồng thời")
+    parser.add_argument("--logins", type=int, default=200, help="tổng số lượt đăng nhập")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--save", action="store_true", help="ghi kết quả vào results.jsonl")
+    parser.add_argument("--label", default=None)
+    args = parser.parse_args()
+
+    os.environ["HR_BCRYPT_ROUNDS"] = str(args.rounds)
+    import db
+    import auth
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_pool()
+        db.DB_PATH = Path(tmp) / "bench_login.db"
+        db.init_db()
+        pw_hash = auth.hash_password("benchpass")
+        for i in range(args.users):
+            db.create_user(f"nurse{i}", f"Điều dưỡng {i}", "employee", "Khoa A", pw_hash)
+
+        def login(i):
+            t0 = time.perf_counter()
+            assert auth.verify_user(f"nurse{i % args.users}", "benchpass", ip=f"10.0.0.{i % 250}")
+            return time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            latencies = sorted(pool.map(login, range(args.logins)))
+        elapsed = time.perf_counter() - t0
+        db.close_pool()
+
+    cores = min(auth.AUTH_MAX_WORKERS, os.cpu_count() or 1)
+    rate = args.logins / elapsed
+    print(f"bcrypt cost={args.rounds} workers={auth.AUTH_MAX_WORKERS} sessions={args.sessions}")
+    print(f"{args.logins} lượt trong {elapsed:.2f}s: {rate:.1f} lượt/s, {rate / cores:.1f} lượt/s/core")
+    print(f"latency p50={results.percentile(latencies, 0.50) * 1000:.0f}ms "
+          f"p99={results.percentile(latencies, 0.99) * 1000:.0f}ms")
+    if args.save:
+        metrics = {"verify_user": {**results.summarize(latencies, elapsed), "per_core_per_sec": rate / cores}}
+        results.save("login", {"rounds": args.rounds, "sessions": args.sessions, "logins": args.logins},
+                      metrics, label=args.label)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/bench_startup.py
+# Đo chi phí khởi động của một worker Streamlit mới: thời gian import từng
+# module (python -X importtime, mỗi lần một process mới) và thời gian chạy
+# app.py / lich_truc.py lần đầu và các lần rerun qua streamlit AppTest:
+#
+#     python benchmarks/bench_startup.py --repeat 5 --save
+#
+# Mỗi phép đo chạy trong process riêng nên là "khởi động lạnh" (trừ cache đĩa
+# của hệ điều hành). Với app.py in thêm các thư viện nặng đã được tải sau
+# trang đăng nhập để phát hiện import sớm trở lại.
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import results
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = ["streamlit", "pandas", "openpyxl", "bcrypt", "smtplib", "instrument", "db", "utils", "auth",
+           "notify", "duty", "conflicts", "reports", "bulk_import"]
+
+# thư viện chỉ nên được tải bởi trang cần tới chúng
+HEAVY = ["pandas", "bcrypt", "openpyxl", "smtplib", "reports"]
+
+_SETUP = """
+import sys
+import db
+from pathlib import Path
+db.DB_PATH = Path(sys.argv[1])
+db.init_db()
+import duty
+duty.ensure_loaded()
+with db.transaction() as conn:
+    conn.execute("INSERT OR IGNORE INTO users(username, name, role, dept, password_hash)"
+                 " VALUES('bench', 'Bench', 'manager', 'Khoa A', 'x')")
+"""
+
+# chạy trong process mới: thời gian (giây) mỗi bước, in ra dạng JSON
+_RUN = """
+import json, os, sys, time
+from pathlib import Path
+os.environ["HR_OUTBOX_WORKER"] = "external"
+script, db_path, logged_in = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+from streamlit.testing.v1 import AppTest
+import db       # thời gian import db đo riêng ở trên
+db.DB_PATH = Path(db_path)
+timings = {}
+at = AppTest.from_file(script, default_timeout=120)
+if logged_in:
+    at.session_state["user"] = db.get_user_by_username("bench")
+t0 = time.perf_counter()
+at.run()
+timings["first_run"] = time.perf_counter() - t0
+loaded = [m for m in %r if m in sys.modules]
+t0 = time.perf_counter()
+at.run()
+timings["rerun"] = time.perf_counter() - t0
+errors = [str(e.value) for e in at.exception]
+print(json.dumps({"timings": timings, "loaded": loaded, "errors": errors}))
+""" % (HEAVY,)
+
+
+def import_time(module):
+    """Thời gian (giây) import module trong một process mới, gồm cả các module nó kéo theo."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, text=True, cwd=ROOT, check=True)
+    lines = [line for line in out.stderr.splitlines() if line.startswith("import time:")]
+    # dòng cuối là module được import; cột 2 là thời gian cộng dồn (µs)
+    return int(lines[-1].split("|")[1]) / 1e6
+
+
+def run_script(script, db_path, logged_in):
+    out = subprocess.run([sys.executable, "-c", _RUN, script, str(db_path), "1" if logged_in else "0"],
+                         capture_output=True, text=True, cwd=ROOT, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo thời gian import / khởi động app.py")
+    parser.add_argument("--repeat", type=int, default=5, help="số process mới cho mỗi phép đo")
+    parser.add_argument("--only", default=None, help="chỉ đo các mục có tên chứa chuỗi này")
+    parser.add_argument("--save", action="store_true", help="ghi kết quả vào results.jsonl")
+    parser.add_argument("--label", default=None, help="nhãn phiên bản khi --save (mặc định: commit)")
+    args = parser.parse_args()
+
+    metrics = {}
+
+    def report(name, latencies):
+        metrics[name] = results.summarize(latencies)
+        metrics[name].pop("ops_per_sec", None)
+        print(results.format_metric(name, metrics[name]))
+
+    for module in MODULES:
+        name = f"import {module}"
+        if not args.only or args.only in name:
+            report(name, [import_time(module) for _ in range(args.repeat)])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench_startup.db"
+        subprocess.run([sys.executable, "-c", _SETUP, str(db_path)], cwd=ROOT, check=True)
+        for script, logged_in, label in [("app.py", False, "app.py (đăng nhập)"),
+                                         ("app.py", True, "app.py (đã đăng nhập)"),
+                                         ("lich_truc.py", False, "lich_truc.py")]:
+            if args.only and args.only not in label:
+                continue
+            runs = [run_script(script, db_path, logged_in) for _ in range(args.repeat)]
+            for run in runs:
+                if run["errors"]:
+                    print(f"⚠️ {label}: {run['errors'][0]}")
+            for step in ("first_run", "rerun"):
+                report(f"{label} {step}", [r["timings"][step] for r in runs])
+            print(f"{'':<32} đã tải: {', '.join(runs[-1]['loaded']) or '-'}")
+
+    if args.save:
+        params = {"repeat": args.repeat}
+        record = results.save("startup", params, metrics, label=args.label)
+        print(f"Đã lưu vào {results.RESULTS_FILE} (label {record['label']}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# benchmarks/bench_workflow.py
+# Tải đầu-cuối cho luồng nghỉ phép: nhiều phiên đồng thời lặp lại
+#   nộp đơn (kiểm tra trùng đơn + ngưỡng khoa, tạo đơn) -> trưởng khoa duyệt
+#   (kèm email) -> OutboxWorker gửi email tới một SMTP sink cục bộ,
+# trên bệnh viện giả lập (synthetic.py):
+#
+#     python benchmarks/bench_workflow.py --sessions 32 --flows 2000 --save
+#
+# In p50 / p99 của từng bước, thời gian từ lúc duyệt tới lúc email tới sink,
+# và số luồng / giây; --save ghi vào benchmarks/results.jsonl.
+import argparse
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import results
+import synthetic
+from smtp_sink import SMTPSink
+
+_REQUEST_ID = re.compile(r"#(\d+)")
+
+
+def run_flows(db, args, employees, managers):
+    timings = {"submit": [], "approve": [], "flow": []}
+    approved_at, blocked = {}, [0]
+    lock = threading.Lock()
+    today = date.today()
+
+    def flow(i):
+        rng = random.Random(args.seed * 100_003 + i)
+        emp, dept = rng.choice(employees)
+        start = today + timedelta(days=rng.randrange(30, 395))
+        sd, ed = start.isoformat(), (start + timedelta(days=rng.randint(0, 3))).isoformat()
+        t0 = time.perf_counter()
+        if db.check_employee_overlap(emp, sd, ed) or not db.check_dept_capacity(dept, [(sd, ed)], args.max_allowed)[0]:
+            with lock:
+                blocked[0] += 1
+            return
+        request_id = db.create_leave_request(emp, sd, ed, "bench")
+        t1 = time.perf_counter()
+        if args.think_ms:
+            time.sleep(rng.random() * args.think_ms / 1000)
+        t2 = time.perf_counter()
+        db.decide_leave_requests([request_id], managers[dept], note="bench", notify=True)
+        t3 = time.perf_counter()
+        with lock:
+            approved_at[request_id] = time.monotonic()
+            timings["submit"].append(t1 - t0)
+            timings["approve"].append(t3 - t2)
+            timings["flow"].append((t1 - t0) + (t3 - t2))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        list(pool.map(flow, range(args.flows)))
+    return timings, approved_at, blocked[0], time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo tải luồng nộp đơn -> duyệt -> email")
+    synthetic.add_arguments(parser)
+    parser.set_defaults(staff=500, years=1, audit_rows=20_000)
+    parser.add_argument("--sessions", type=int, default=16, help="số phiên đồng thời")
+    parser.add_argument("--flows", type=int, default=1000, help="tổng số đơn nộp")
+    parser.add_argument("--max-allowed", type=int, default=5, help="ngưỡng nghỉ đồng thời mỗi khoa")
+    parser.add_argument("--think-ms", type=float, default=0, help="thời gian 'suy nghĩ' tối đa giữa nộp và duyệt")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="giây chờ email cuối cùng tới sink")
+    parser.add_argument("--save", action="store_true", help="ghi kết quả vào results.jsonl")
+    parser.add_argument("--label", default=None)
+    args = parser.parse_args()
+
+    import db
+    import notify
+
+    sink = SMTPSink().start()
+    notify._smtp_config = sink.config   # thay st.secrets["smtp"]
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_pool()
+        db.DB_PATH = Path(tmp) / "bench_workflow.db"
+        db.init_db()
+        synthetic.generate(**synthetic.options(args))
+        with db.connection() as conn:
+            employees = [tuple(r) for r in conn.execute("SELECT id, dept FROM users WHERE role = 'employee'")]
+            managers = {r["dept"]: r["id"] for r in conn.execute("SELECT id, dept FROM users WHERE role = 'manager'")}
+
+        worker = notify.OutboxWorker(poll_seconds=0.05)
+        worker.start()
+        timings, approved_at, blocked, elapsed = run_flows(db, args, employees, managers)
+
+        deadline = time.monotonic() + args.drain_timeout
+        while len(sink.messages) < len(approved_at) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        worker.stop()
+        worker.join()
+        db.flush_audit_logs()
+        db.close_pool()
+    sink.stop()
+
+    delivered = {}
+    for received, headers in sink.messages:
+        match = _REQUEST_ID.search(headers["Subject"] or "")
+        if match:
+            delivered[int(match.group(1))] = received
+    notify_latencies = [max(0.0, delivered[rid] - t) for rid, t in approved_at.items() if rid in delivered]
+
+    metrics = {name: results.summarize(values, elapsed) for name, values in timings.items()}
+    metrics["notify_delivery"] = results.summarize(notify_latencies)
+    metrics["notify_delivery"].pop("ops_per_sec", None)
+    metrics["throughput"] = {"n": len(approved_at), "flows_per_sec": len(approved_at) / elapsed,
+                             "emails_per_sec": len(notify_latencies) / elapsed, "blocked": blocked}
+
+    print(f"{args.sessions} phiên, {args.flows} lượt nộp trong {elapsed:.2f}s "
+          f"({len(approved_at)} đơn được duyệt, {blocked} bị chặn bởi kiểm tra trùng / ngưỡng)")
+    for name in ("submit", "approve", "flow", "notify_delivery"):
+        print(results.format_metric(name, metrics[name]))
+    print(f"{metrics['throughput']['flows_per_sec']:,.1f} luồng/s, "
+          f"{len(notify_latencies)}/{len(approved_at)} email tới sink")
+    if len(notify_latencies) < len(approved_at):
+        print(f"⚠️ {len(approved_at) - len(notify_latencies)} email chưa tới sink sau {args.drain_timeout:g}s.")
+
+    if args.save:
+        params = {**synthetic.options(args), "sessions": args.sessions, "flows": args.flows,
+                  "max_allowed": args.max_allowed, "think_ms": args.think_ms}
+        record = results.save("workflow", params, metrics, label=args.label)
+        print(f"Đã lưu vào {results.RESULTS_FILE} (label {record['label']}).")
+
+
+if __name__ == "__main__":
+    main()
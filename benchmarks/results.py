@@ -0,0 +1,157 @@
+# benchmarks/results.py
+# Lưu kết quả đo của các bench_*.py vào benchmarks/results.jsonl (mỗi lượt đo
+# một dòng JSON: bench, label, commit, thời điểm, tham số, số liệu) và so sánh
+# hai phiên bản để phát hiện chậm đi:
+#
+#     python benchmarks/results.py list
+#     python benchmarks/results.py compare                      # 2 lượt gần nhất mỗi bench
+#     python benchmarks/results.py compare --base a1b2c3d --head before-refactor --threshold 15
+#
+# compare thoát với mã 1 nếu có số liệu xấu đi quá --threshold phần trăm.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+RESULTS_FILE = Path(os.environ.get("HR_BENCH_RESULTS", Path(__file__).resolve().parent / "results.jsonl"))
+
+# số liệu càng lớn càng tốt (còn lại: độ trễ, càng nhỏ càng tốt)
+HIGHER_IS_BETTER = ("per_sec", "speedup")
+
+
+def percentile(values, q):
+    """Phân vị q (0..1) theo hạng gần nhất; values không cần sắp xếp trước."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(latencies, elapsed=None):
+    """Tóm tắt danh sách độ trễ (giây): n, p50 / p99 / max (ms), ops_per_sec."""
+    stats = {"n": len(latencies),
+             "p50_ms": percentile(latencies, 0.50) * 1000,
+             "p99_ms": percentile(latencies, 0.99) * 1000,
+             "max_ms": max(latencies, default=0) * 1000}
+    total = elapsed if elapsed is not None else sum(latencies)
+    if total:
+        stats["ops_per_sec"] = len(latencies) / total
+    return stats
+
+
+def format_metric(name, stats):
+    line = f"{name:<32} n={stats['n']:<6} p50={stats['p50_ms']:8.2f}ms p99={stats['p99_ms']:8.2f}ms"
+    if "ops_per_sec" in stats:
+        line += f"  {stats['ops_per_sec']:10,.0f}/s"
+    return line
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).resolve().parent, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def save(bench, params, metrics, label=None, path=None):
+    """Ghi một lượt đo (metrics: {tên: dict số liệu}) vào file JSONL, trả về bản ghi."""
+    commit = _git_revision()
+    record = {
+        "bench": bench,
+        "label": label or commit or "local",
+        "commit": commit,
+        "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "metrics": metrics,
+    }
+    path = Path(path or RESULTS_FILE)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return record
+
+
+def load(path=None):
+    path = Path(path or RESULTS_FILE)
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _pick(records, label):
+    matches = [r for r in records if label is None or label in (r["label"], r["commit"])]
+    return matches[-1] if matches else None
+
+
+def compare(base, head, threshold):
+    """
+    So sánh số liệu của hai bản ghi cùng bench. Trả về danh sách dòng mô tả và
+    danh sách các số liệu xấu đi quá threshold (%).
+    """
+    lines, regressions = [], []
+    for name, new in head["metrics"].items():
+        old = base["metrics"].get(name)
+        if not old:
+            continue
+        for key, value in new.items():
+            if key == "n" or not isinstance(value, (int, float)) or not old.get(key):
+                continue
+            change = (value - old[key]) / old[key] * 100
+            worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+            mark = "  ⚠️" if worse > threshold else ""
+            lines.append(f"  {name:<32} {key:<12} {old[key]:12,.2f} -> {value:12,.2f}  {change:+7.1f}%{mark}")
+            if mark:
+                regressions.append((name, key, change))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Xem / so sánh kết quả benchmark")
+    parser.add_argument("--file", default=None, help=f"mặc định {RESULTS_FILE}")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list")
+    p = sub.add_parser("compare")
+    p.add_argument("--bench", default=None, help="chỉ so sánh bench này")
+    p.add_argument("--base", default=None, help="label / commit gốc (mặc định: lượt trước lượt mới nhất)")
+    p.add_argument("--head", default=None, help="label / commit mới (mặc định: lượt mới nhất)")
+    p.add_argument("--threshold", type=float, default=10.0, help="phần trăm xấu đi được bỏ qua")
+    args = parser.parse_args(argv)
+
+    records = load(args.file)
+    if args.command == "list":
+        for r in records:
+            print(f"{r['at']}  {r['bench']:<10} {r['label']:<14} {r['commit'] or '-':<10} {json.dumps(r['params'])}")
+        return 0
+
+    failed = False
+    for bench in sorted({r["bench"] for r in records if args.bench in (None, r["bench"])}):
+        runs = [r for r in records if r["bench"] == bench]
+        head = _pick(runs, args.head)
+        if head is None:
+            continue
+        earlier = runs[:runs.index(head)]
+        base = _pick(earlier if args.base is None else runs, args.base)
+        if base is None or base is head:
+            print(f"{bench}: chưa có lượt đo để so sánh.")
+            continue
+        print(f"{bench}: {base['label']} ({base['at']}) -> {head['label']} ({head['at']})")
+        lines, regressions = compare(base, head, args.threshold)
+        print("\n".join(lines))
+        failed = failed or bool(regressions)
+    if failed:
+        print(f"\n❌ Có số liệu xấu đi quá {args.threshold:g}%.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# benchmarks/smtp_sink.py
+# Máy chủ SMTP tối giản chạy cục bộ: nhận mọi email rồi bỏ đi (hoặc in ra),
+# dùng thay máy chủ thật khi đo tải / chạy thử email thông báo:
+#
+#     python benchmarks/smtp_sink.py --port 1025
+#
+# rồi khai báo trong .streamlit/secrets.toml:
+#     [smtp]
+#     host = "127.0.0.1"
+#     port = 1025
+#     starttls = false
+#     from = "hr@bv.local"
+import argparse
+import socketserver
+import threading
+import time
+from email import policy
+from email.parser import BytesHeaderParser
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self._reply("220 smtp-sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self._reply("250-smtp-sink")
+                self._reply("250 8BITMIME")
+            elif command == b"DATA":
+                self._reply("354 end with <CRLF>.<CRLF>")
+                lines = []
+                while (data := self.rfile.readline()) not in (b".\r\n", b".\n", b""):
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                self.server.received(b"".join(lines))
+                self._reply("250 OK")
+            elif command == b"QUIT":
+                self._reply("221 bye")
+                return
+            else:   # HELO, MAIL, RCPT, RSET, NOOP...
+                self._reply("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    SMTP sink chạy trên thread nền. Mỗi email nhận được ghi lại
+    (thời điểm monotonic, header) vào self.messages, rồi gọi on_message nếu có.
+    port=0: hệ điều hành chọn cổng trống (xem self.port).
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, on_message=None):
+        super().__init__((host, port), _Handler)
+        self.port = self.server_address[1]
+        self.on_message = on_message
+        self.messages = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def received(self, raw):
+        headers = BytesHeaderParser(policy=policy.default).parsebytes(raw)
+        with self._lock:
+            self.messages.append((time.monotonic(), headers))
+        if self.on_message:
+            self.on_message(headers)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def config(self, sender="hr@bv.local"):
+        """Cấu hình dạng st.secrets["smtp"] trỏ tới sink này."""
+        return {"host": "127.0.0.1", "port": self.port, "starttls": False, "from": sender}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SMTP sink cục bộ")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--quiet", action="store_true", help="không in từng email")
+    args = parser.parse_args()
+
+    def show(headers):
+        if not args.quiet:
+            print(f"{headers['To']}: {headers['Subject']}")
+
+    sink = SMTPSink(port=args.port, on_message=show)
+    print(f"SMTP sink đang nghe 127.0.0.1:{sink.port} (Ctrl+C để dừng).")
+    try:
+        sink.serve_forever()
+    except KeyboardInterrupt:
+        sink.server_close()
+        print(f"Đã nhận {len(sink.messages)} email.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# benchmarks/synthetic.py
+# Sinh dữ liệu bệnh viện giả lập vào DB đang cấu hình (db.DB_PATH): N khoa,
+# M nhân viên, Y năm lịch sử nghỉ phép + audit log, lịch trực quanh hôm nay.
+# Dùng cho bench_db.py / bench_workflow.py, hoặc chạy riêng để có DB thử:
+#
+#     python benchmarks/synthetic.py --db /tmp/hr_big.db --departments 30 --staff 3000 --years 5
+#
+# Lịch sử nghỉ phép và lịch trực đi qua bulk_import (sổ phép, dept_occupancy,
+# bảng thống kê được tính như dữ liệu thật); nhân viên dùng chung một hash
+# mật khẩu để khỏi băm bcrypt M lần.
+import argparse
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+PASSWORD = "benchpass"
+REASONS = ["Việc riêng", "Ốm", "Khám bệnh", "Nghỉ phép năm", "Con ốm", "Đi học", "Việc gia đình"]
+HO = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Vũ", "Đặng", "Bùi", "Đỗ", "Ngô"]
+TEN = ["An", "Bình", "Chi", "Dũng", "Hà", "Hưng", "Lan", "Minh", "Nam", "Phương", "Quân", "Thảo", "Trang", "Tú"]
+AUDIT_ACTIONS = ["login", "login", "login", "export_report", "create_leave", "approve"]
+
+
+def department_name(i):
+    return f"Khoa {i + 1:02d}"
+
+
+def generate(departments=20, staff=2000, years=3, leaves_per_year=6, audit_rows=200_000,
+             duty_days=90, rounds=4, seed=42, report=print):
+    """
+    Sinh dữ liệu vào DB hiện tại (đã init_db). Mỗi khoa có một trưởng khoa
+    (mgrNN), thêm 2 tài khoản hr; còn lại là employee. Trả về dict số dòng đã
+    sinh và thời gian.
+    """
+    import bcrypt
+    import bulk_import
+    import db
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    today = date.today()
+    pw_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=rounds)).decode()
+
+    users = [(f"mgr{d:02d}", f"Trưởng {department_name(d)}", "manager", department_name(d)) for d in range(departments)]
+    users += [(f"hr{i}", f"Nhân sự {i}", "hr", department_name(0)) for i in range(2)]
+    users += [(f"nv{i:05d}", f"{rng.choice(HO)} {rng.choice(TEN)} {i}", "employee", department_name(i % departments))
+              for i in range(max(0, staff - len(users)))]
+    with db.transaction() as conn:
+        conn.executemany("""
+          INSERT INTO users(username, name, role, dept, email, password_hash) VALUES(?,?,?,?,?,?)
+          ON CONFLICT(username) DO NOTHING
+        """, [(u, n, r, d, f"{u}@bv.local", pw_hash) for u, n, r, d in users])
+        db.bump_data_versions(conn, {db.USERS_SCOPE} | {u[3] for u in users})
+
+    first_day = today - timedelta(days=365 * years)
+
+    def leaves():
+        for username, _, role, _ in users:
+            if role != "employee":
+                continue
+            for _ in range(rng.randint(0, 2 * leaves_per_year) * years):
+                start = first_day + timedelta(days=rng.randrange(365 * years))
+                end = start + timedelta(days=rng.choice((0, 0, 1, 1, 2, 4, 6)))
+                created = datetime.combine(start, datetime.min.time()) - timedelta(hours=rng.randint(24, 24 * 30))
+                status = rng.choices(("approved", "rejected", "cancelled", "pending"), (80, 8, 7, 5))[0]
+                decided = created + timedelta(minutes=rng.expovariate(1 / 600))
+                yield {"username": username, "start_date": start.isoformat(), "end_date": end.isoformat(),
+                       "reason": rng.choice(REASONS), "status": status,
+                       "created_at": created.isoformat(sep=" ", timespec="seconds"),
+                       "approved_at": decided.isoformat() if status in ("approved", "rejected") else "",
+                       "approver": f"mgr{int(username[2:]) % departments:02d}" if status != "pending" else ""}
+
+    leave_stats = bulk_import.import_leaves(leaves(), report=None)
+
+    # audit: rải đều trong Y năm, ghi thẳng theo lô (trigger FTS vẫn chạy)
+    span = (today - first_day).total_seconds()
+    origin = datetime.combine(first_day, datetime.min.time())
+    for offset in range(0, audit_rows, 50_000):
+        batch = []
+        for _ in range(min(50_000, audit_rows - offset)):
+            action = rng.choice(AUDIT_ACTIONS)
+            user_id = rng.randint(1, len(users))
+            ts = origin + timedelta(seconds=rng.random() * span)
+            note = f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}" if action == "login" else rng.choice(REASONS)
+            batch.append((action, user_id, "user" if action == "login" else "leave_request", user_id, note,
+                          ts.isoformat()))
+        with db.transaction() as conn:
+            conn.executemany(db._AUDIT_INSERT_SQL, batch)
+
+    by_dept = {}
+    for username, name, role, dept in users:
+        by_dept.setdefault(dept, []).append(name)
+
+    def roster():
+        for day in range(-duty_days, duty_days):
+            for dept, names in by_dept.items():
+                yield {"date": (today + timedelta(days=day)).isoformat(), "department": dept,
+                       "doctor": rng.choice(names), "nurse": rng.choice(names)}
+
+    duty_stats = bulk_import.import_duty(roster(), report=None)
+    summary = {"users": len(users), "leaves": leave_stats["inserted"] + leave_stats["updated"],
+               "audit": audit_rows, "duty": duty_stats["rows"], "seconds": time.perf_counter() - started}
+    if report:
+        report(f"Sinh {summary['users']:,} nhân viên, {summary['leaves']:,} đơn, {summary['audit']:,} dòng audit, "
+               f"{summary['duty']:,} ca trực trong {summary['seconds']:.1f}s")
+    return summary
+
+
+def add_arguments(parser):
+    parser.add_argument("--departments", type=int, default=20)
+    parser.add_argument("--staff", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--audit-rows", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def options(args):
+    return {"departments": args.departments, "staff": args.staff, "years": args.years,
+            "audit_rows": args.audit_rows, "seed": args.seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu bệnh viện giả lập")
+    parser.add_argument("--db", required=True, help="đường dẫn file SQLite sẽ tạo / ghi thêm")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    import db
+
+    db.close_pool()
+    db.DB_PATH = Path(args.db)
+    db.init_db()
+    generate(**options(args))
+    db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# bulk_import.py
+# Nhập hàng loạt nhân viên, lịch sử nghỉ phép và lịch trực từ CSV / XLSX
+# (python manage.py import ...). File được đọc dần từng dòng (openpyxl chế độ
+# read_only với XLSX), kiểm tra hợp lệ, ghi theo lô bằng executemany.
+# Nhập lại cùng file chỉ cập nhật (upsert), không tạo bản ghi trùng:
+#   users:  khóa username; mật khẩu chỉ băm cho tài khoản mới (hoặc khi
+#           reset_passwords=True), bcrypt chạy song song trên pool process
+#           (chỉ tạo khi có mật khẩu cần băm).
+#   leaves: khóa (nhân viên, start_date, end_date); ghi trong một transaction,
+#           index của leave_requests được xóa trước và tạo lại sau khi ghi,
+#           các bảng dẫn xuất (sổ phép, dept_occupancy, thống kê) tính lại.
+#   duty:   khóa (date, department) như duty.sync_csv nhưng không xóa dòng cũ.
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime
+from itertools import islice
+from pathlib import Path
+
+from db import (connection, transaction, USERS_SCOPE, ALL_DATES, bump_data_versions, insert_audit,
+                mark_conflicts_dirty, rebuild_summaries)
+
+ROLES = ("employee", "manager", "hr")
+LEAVE_STATUSES = ("pending", "approved", "rejected", "cancelled")
+
+USER_COLUMNS = ("username", "name", "role", "dept", "email", "password")
+LEAVE_COLUMNS = ("username", "start_date", "end_date", "reason", "status", "created_at", "approved_at", "approver")
+DUTY_COLUMNS = ("date", "department", "doctor", "nurse")
+
+BATCH_SIZE = 5000
+HASH_WORKERS = os.cpu_count() or 2
+
+
+# ---- đọc file ----
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ") if value.time() != datetime.min.time() else value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def read_rows(path):
+    """
+    Đọc dần file .csv (UTF-8, dòng đầu là tên cột) hoặc .xlsx (sheet đầu tiên).
+    Sinh (số dòng, dict tên cột -> chuỗi đã strip).
+    """
+    if Path(path).suffix.lower() in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = [_cell(v).lower() for v in next(rows, ())]
+            for line, values in enumerate(rows, start=2):
+                if any(v is not None for v in values):
+                    yield line, dict(zip(header, map(_cell, values)))
+        finally:
+            wb.close()
+        return
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [(c or "").strip().lower() for c in reader.fieldnames or []]
+        for row in reader:
+            yield reader.line_num, {k: (v or "").strip() for k, v in row.items() if k}
+
+
+def _numbered(rows):
+    # chấp nhận cả list dict (seed_data.py) lẫn kết quả read_rows
+    for i, row in enumerate(rows, start=1):
+        yield row if isinstance(row, tuple) else (i, row)
+
+
+def _batches(rows, size):
+    it = iter(rows)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def _iso_date(value):
+    return date.fromisoformat(value[:10]).isoformat()
+
+
+class _Progress:
+    """In số dòng đã xử lý và tốc độ sau mỗi lô."""
+
+    def __init__(self, label, report):
+        self.label, self.report = label, report
+        self.started = time.perf_counter()
+        self.rows = 0
+
+    def add(self, n):
+        self.rows += n
+        if self.report:
+            self.report(f"{self.label}: {self.rows:,} dòng ({self.rate():,.0f} dòng/s)")
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def rate(self):
+        return self.rows / max(self.elapsed(), 1e-9)
+
+
+def _stats(progress, **counts):
+    return {"rows": progress.rows, "seconds": progress.elapsed(), "rows_per_sec": progress.rate(), **counts}
+
+
+@contextmanager
+def _deferred_indexes(conn, table):
+    """Xóa các index (không phải UNIQUE / PK) của bảng, tạo lại khi ra khỏi khối."""
+    indexes = conn.execute("""
+      SELECT name, sql FROM sqlite_master
+      WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%'
+    """, (table,)).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+    yield
+    for _, sql in indexes:
+        conn.execute(sql)
+
+
+# ---- nhân viên ----
+def _hash_password(plain):
+    from auth import _hash
+
+    return _hash(plain)
+
+
+def _validate_user(row, existing):
+    username = row.get("username", "")
+    if not username:
+        return "thiếu username"
+    if row.get("role", "") not in ROLES:
+        return f"role '{row.get('role', '')}' không hợp lệ (employee / manager / hr)"
+    if not row.get("dept"):
+        return "thiếu dept"
+    if username not in existing and not row.get("password"):
+        return "tài khoản mới cần cột password"
+    return None
+
+
+def import_users(rows, workers=HASH_WORKERS, batch_size=1000, reset_passwords=False, report=print):
+    """
+    Thêm / cập nhật nhân viên (cột USER_COLUMNS). Tài khoản đã có giữ nguyên
+    mật khẩu trừ khi reset_passwords=True. Trả về dict thống kê kèm `errors`:
+    danh sách (số dòng, lỗi) của các dòng bị bỏ qua.
+    """
+    with connection() as conn:
+        existing = {r["username"]: (r["name"], r["dept"]) for r in conn.execute("SELECT username, name, dept FROM users")}
+    progress = _Progress("users", report)
+    errors, seen = [], set()
+    inserted = updated = 0
+    moved = renamed = False
+    pool = None  # chỉ tạo process khi thật sự có mật khẩu cần băm
+    try:
+        for batch in _batches(_numbered(rows), batch_size):
+            valid = []
+            for line, row in batch:
+                error = _validate_user(row, existing)
+                if error is None and row["username"] in seen:
+                    error = "username trùng với dòng trước trong file"
+                if error:
+                    errors.append((line, error))
+                    continue
+                seen.add(row["username"])
+                valid.append(row)
+            to_hash = [r for r in valid if r.get("password") and (reset_passwords or r["username"] not in existing)]
+            if to_hash and pool is None:
+                pool = ProcessPoolExecutor(max_workers=workers)
+            hashes = dict(zip((r["username"] for r in to_hash),
+                              pool.map(_hash_password, [r["password"] for r in to_hash],
+                                       chunksize=max(1, len(to_hash) // (workers * 4))))) if to_hash else {}
+            depts = set()
+            for r in valid:
+                old = existing.get(r["username"])
+                if old:
+                    updated += 1
+                    moved = moved or old[1] != r["dept"]
+                    renamed = renamed or old[0] != r.get("name")
+                    depts.add(old[1])
+                else:
+                    inserted += 1
+                depts.add(r["dept"])
+            with transaction() as conn:
+                conn.executemany("""
+                  INSERT INTO users(username, name, role, dept, email, password_hash) VALUES(?,?,?,?,?,?)
+                  ON CONFLICT(username) DO UPDATE SET name = excluded.name, role = excluded.role,
+                    dept = excluded.dept, email = excluded.email,
+                    password_hash = COALESCE(excluded.password_hash, password_hash)
+                """, [(r["username"], r.get("name"), r["role"], r["dept"], r.get("email") or None,
+                       hashes.get(r["username"])) for r in valid])
+                bump_data_versions(conn, depts | {USERS_SCOPE})
+            for r in valid:
+                existing[r["username"]] = (r.get("name"), r["dept"])
+            progress.add(len(batch))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    with transaction() as conn:
+        if moved:
+            # chuyển khoa: số liệu theo khoa phải tính lại
+            rebuild_summaries(conn, balances=False)
+        if moved or renamed:
+            # lịch trực đối chiếu theo tên / khoa
+            mark_conflicts_dirty(conn, [ALL_DATES])
+        insert_audit(conn, [("bulk_import", None, "user", None,
+                             f"{inserted} nhân viên mới, {updated} nhân viên cập nhật")])
+    return _stats(progress, inserted=inserted, updated=updated, errors=errors)
+
+
+# ---- lịch sử nghỉ phép ----
+def _parse_leave(row, users):
+    user = users.get(row.get("username", ""))
+    if user is None:
+        return None, f"không có nhân viên '{row.get('username', '')}'"
+    try:
+        start, end = _iso_date(row.get("start_date", "")), _iso_date(row.get("end_date", ""))
+    except ValueError:
+        return None, "start_date / end_date phải có dạng YYYY-MM-DD"
+    if end < start:
+        return None, "end_date trước start_date"
+    status = row.get("status") or "approved"
+    if status not in LEAVE_STATUSES:
+        return None, f"status '{status}' không hợp lệ"
+    approver = None
+    if row.get("approver"):
+        approver = users.get(row["approver"])
+        if approver is None:
+            return None, f"không có người duyệt '{row['approver']}'"
+    try:
+        created_at = datetime.fromisoformat(row.get("created_at") or start).isoformat(sep=" ")
+        approved_at = datetime.fromisoformat(row["approved_at"]).isoformat() if row.get("approved_at") else None
+    except ValueError:
+        return None, "created_at / approved_at không đúng định dạng ISO"
+    return (user[0], start, end, row.get("reason") or None, status,
+            approver and approver[0], approved_at, created_at), None
+
+
+def import_leaves(rows, batch_size=BATCH_SIZE, defer_indexes=True, report=print):
+    """
+    Nhập lịch sử nghỉ phép (cột LEAVE_COLUMNS; status mặc định 'approved',
+    created_at mặc định là start_date). Đơn đã có cùng (nhân viên, start_date,
+    end_date) được cập nhật. Toàn bộ file ghi trong một transaction; sau đó
+    sổ phép, dept_occupancy và bảng thống kê được tính lại.
+    """
+    progress = _Progress("leaves", report)
+    errors, seen = [], set()
+    inserted = updated = 0
+    with transaction() as conn:
+        users = {r["username"]: (r["id"], r["dept"]) for r in conn.execute("SELECT id, username, dept FROM users")}
+        existing = {(r[1], r[2], r[3]): r[0] for r in conn.execute(
+            "SELECT id, employee_id, start_date, end_date FROM leave_requests ORDER BY id")}
+        depts = set()
+        with _deferred_indexes(conn, "leave_requests") if defer_indexes else nullcontext():
+            for batch in _batches(_numbered(rows), batch_size):
+                new, changed = [], []
+                for line, row in batch:
+                    values, error = _parse_leave(row, users)
+                    if error is None and values[:3] in seen:
+                        error = "trùng nhân viên / start_date / end_date với dòng trước trong file"
+                    if error:
+                        errors.append((line, error))
+                        continue
+                    seen.add(values[:3])
+                    depts.add(users[row["username"]][1])
+                    if values[:3] in existing:
+                        changed.append((*values[3:7], existing[values[:3]]))
+                    else:
+                        new.append(values)
+                conn.executemany("""
+                  INSERT INTO leave_requests(employee_id, start_date, end_date, reason, status,
+                                             approver_id, approved_at, created_at)
+                  VALUES(?,?,?,?,?,?,?,?)
+                """, new)
+                conn.executemany("UPDATE leave_requests SET reason=?, status=?, approver_id=?, approved_at=? "
+                                 "WHERE id=?", changed)
+                inserted += len(new)
+                updated += len(changed)
+                progress.add(len(batch))
+        rebuild_summaries(conn)
+        mark_conflicts_dirty(conn, [ALL_DATES])
+        bump_data_versions(conn, depts)
+        insert_audit(conn, [("bulk_import", None, "leave_request", None,
+                             f"{inserted} đơn mới, {updated} đơn cập nhật")])
+    return _stats(progress, inserted=inserted, updated=updated, errors=errors)
+
+
+# ---- lịch trực ----
+def import_duty(rows, batch_size=BATCH_SIZE, report=print):
+    """
+    Thêm / cập nhật lịch trực (cột DUTY_COLUMNS) theo (date, department), mỗi
+    lô một transaction. Khác duty.sync_csv: không xóa các ca không có trong file.
+    """
+    from duty import DUTY_SCOPE, upsert_rows
+
+    progress = _Progress("duty", report)
+    errors = []
+    for batch in _batches(_numbered(rows), batch_size):
+        valid = []
+        for line, row in batch:
+            try:
+                day = _iso_date(row.get("date", ""))
+            except ValueError:
+                errors.append((line, "date phải có dạng YYYY-MM-DD"))
+                continue
+            if not row.get("department"):
+                errors.append((line, "thiếu department"))
+                continue
+            valid.append((day, row["department"], row.get("doctor", ""), row.get("nurse", "")))
+        if valid:
+            with transaction() as conn:
+                upsert_rows(conn, valid)
+                bump_data_versions(conn, [DUTY_SCOPE])
+                mark_conflicts_dirty(conn, [(min(r[0] for r in valid), max(r[0] for r in valid))])
+        progress.add(len(batch))
+    return _stats(progress, errors=errors)
+
+
+IMPORTERS = {"users": import_users, "leaves": import_leaves, "duty": import_duty}
@@ -0,0 +1,307 @@
+# check_backends.py
+# Chạy cùng một quy trình nghiệp vụ (người dùng, tạo / duyệt / từ chối / hủy
+# đơn, số dư phép, sức chứa khoa, rollup, audit, outbox, lịch trực / xung đột,
+# tệp đính kèm ở cả hai nơi lưu blob, nhân viên chưa có khoa) trên từng backend
+# của HR_DATABASE_URL: SQLite cục bộ và sqlite+tcp qua một db_server.py tạm.
+# Kết quả mỗi bước phải giống nhau giữa các backend; thêm một lần init_db trên
+# hr.db cũ chưa migration. Thoát với mã 1 nếu có bước lỗi / lệch:
+#
+#     python check_backends.py
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+
+import db
+import utils
+
+ROOT = Path(__file__).resolve().parent
+SERVER_KEY = "check-backends"
+
+# trường phụ thuộc thời điểm chạy / đường dẫn tạm, bỏ qua khi so sánh
+VOLATILE = {"created_at", "timestamp", "approved_at", "attachment_path", "next_attempt_at"}
+
+
+def _plain(value):
+    """Đưa kết quả về dạng so sánh được giữa các backend (Row -> dict, bỏ trường thời gian)."""
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if hasattr(value, "keys"):
+        return {k: _plain(value[k]) for k in value.keys() if k not in VOLATILE}
+    return value
+
+
+class _Upload(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def workflow(tmp):
+    """Các bước (tên, hàm) — hàm trả về giá trị để so sánh giữa các backend."""
+    ids = {}
+
+    def users():
+        db.create_user("mgr", "Trưởng khoa", "manager", "Khoa A", "x", email="mgr@bv.local")
+        db.create_user("emp", "Bác sĩ An", "employee", "Khoa A", "x", email="emp@bv.local")
+        db.create_user("emp2", "Điều dưỡng Bình", "employee", "Khoa A", "x")
+        ids.update({u: db.get_user_by_username(u)["id"] for u in ("mgr", "emp", "emp2")})
+        return [db.get_user_by_id(ids[u]) for u in ("mgr", "emp", "emp2")]
+
+    def duplicate_user():
+        try:
+            db.create_user("emp", "Trùng", "employee", "Khoa A", "x")
+        except Exception as e:
+            return type(e).__name__
+        return "không lỗi"
+
+    def attachments():
+        out = []
+        for store in ("local", "db"):
+            utils.BLOB_STORE = store
+            ref = utils.save_uploaded_file(_Upload("giay.pdf", b"%PDF-1.4 " + store.encode()), "emp")
+            again = utils.save_uploaded_file(_Upload("giay.pdf", b"%PDF-1.4 " + store.encode()), "emp")
+            ids[f"ref_{store}"] = ref
+            out.append((store, ref == again, utils.attachment_exists(ref), utils.attachment_name(ref),
+                        utils.read_attachment(ref)))
+        utils.BLOB_STORE = "local"
+        return out
+
+    def create_requests():
+        ids["r1"] = db.create_leave_request(ids["emp"], "2025-03-03", "2025-03-05", "Việc riêng",
+                                            attachment_path=ids["ref_db"])
+        ids["r2"] = db.create_leave_request(ids["emp2"], "2025-03-04", "2025-03-04", "Khám bệnh",
+                                            attachment_path=ids["ref_local"])
+        ids["r3"] = db.create_leave_request(ids["emp"], "2025-04-01", "2025-04-02", "Về quê")
+        return [db.get_leave_request_by_id(ids[r]) for r in ("r1", "r2", "r3")]
+
+    def pending():
+        return db.get_pending_requests_for_dept("Khoa A")
+
+    def overlap_and_capacity():
+        return (db.check_employee_overlap(ids["emp"], "2025-03-01", "2025-03-31"),
+                db.dept_overlap_count("Khoa A", "2025-03-01", "2025-03-31"),
+                db.dept_peak_absences("Khoa A", [("2025-03-01", "2025-03-31")]),
+                db.check_dept_capacity("Khoa A", [("2025-03-04", "2025-03-04")], 1))
+
+    def decide():
+        db.approve_leave(ids["r1"], ids["mgr"], note="ok")
+        db.decide_leave_requests([ids["r2"]], ids["mgr"], approved=False, note="thiếu người", notify=True)
+        db.cancel_leave_request(ids["r3"], ids["emp"])
+        return [db.get_leave_request_by_id(ids[r])["status"] for r in ("r1", "r2", "r3")]
+
+    def balances():
+        return [db.get_leave_balance(ids[u], 2025) for u in ("emp", "emp2")]
+
+    def dept_reports():
+        return (db.get_requests_for_dept("Khoa A", status="approved"),
+                db.count_requests_for_dept("Khoa A"),
+                db.dept_weekly_absences("Khoa A", "2025-03-01", "2025-04-30"),
+                db.dept_monthly_usage("Khoa A", "2025-01", "2025-06"))
+
+    def paging():
+        rows, cursor = db.get_requests_page_for_dept("Khoa A", page_size=2)
+        more, _ = db.get_requests_page_for_dept("Khoa A", page_size=2, cursor=cursor)
+        return [r["id"] for r in rows + more], [len(chunk) for chunk in db.iter_requests_for_dept("Khoa A", chunk_size=2)]
+
+    def big_result():
+        # nhiều hơn số dòng gửi kèm execute của sqlite+tcp: phải lấy thêm theo lô
+        with db.connection() as conn:
+            sql = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 1234) SELECT x FROM n"
+            first = conn.execute(sql).fetchmany(3)
+            return [r[0] for r in first], sum(r["x"] for r in conn.execute(sql).fetchall())
+
+    def rollback():
+        try:
+            with db.transaction() as conn:
+                conn.execute("UPDATE users SET name = 'đổi' WHERE id = ?", (ids["emp"],))
+                conn.execute("INSERT INTO users(username) VALUES('mgr')")
+        except Exception as e:
+            return type(e).__name__, db.get_user_by_id(ids["emp"])["name"]
+        return "không lỗi"
+
+    def concurrent_writers():
+        errors = []
+
+        def write(n):
+            try:
+                for i in range(10):
+                    db.create_leave_request(ids["emp2"], f"2025-{5 + n:02d}-{i + 1:02d}",
+                                            f"2025-{5 + n:02d}-{i + 1:02d}", f"luồng {n}")
+            except Exception as e:
+                errors.append(repr(e))
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return errors, db.count_requests_for_dept("Khoa A", status="pending")
+
+    def integrity():
+        return db.verify_leave_balances(), db.verify_dept_occupancy(), db.verify_rollups()
+
+    def audit():
+        db.log_audit("export_report", ids["mgr"], "report", None, "Khoa A", durable=True)
+        rows, _ = db.search_audit_logs(text="thiếu người", page_size=10)
+        return (sorted(r["action"] for r in db.get_audit_logs(limit=100)), rows,
+                db.count_audit_logs(user_id=ids["mgr"]))
+
+    def outbox():
+        batch = db.claim_outbox_batch(10)
+        db.mark_emails_sent([m["id"] for m in batch])
+        return [(m["to_email"], m["subject"]) for m in batch], db.outbox_depth()
+
+    def duty_and_conflicts():
+        import conflicts
+        import duty
+        csv_path = Path(tmp) / "duty.csv"
+        csv_path.write_text("date,department,doctor,nurse\n"
+                            "2025-03-03,Khoa Cấp cứu,Bác sĩ An,Điều dưỡng Bình\n"
+                            "2025-03-04,Khoa Nội,Bác sĩ Cường,Điều dưỡng Bình\n", encoding="utf-8")
+        duty.sync_csv(csv_path)
+        schedule = duty.query_schedule("2025-03-01", "2025-03-31", name="bình")
+        return (duty.departments(), schedule.astype(str).values.tolist(),
+                conflicts.list_conflicts("2025-03-01", "2025-03-31"),
+                conflicts.conflicts_for_leave(ids["emp2"], "2025-03-01", "2025-03-31").astype(str).values.tolist())
+
+    def no_department():
+        # nhân viên chưa được xếp khoa (dept NULL) vẫn nộp / được duyệt / bị từ chối đơn
+        db.create_user("moi", "Nhân viên mới", "employee", None, "x")
+        ids["moi"] = db.get_user_by_username("moi")["id"]
+        first = db.create_leave_request(ids["moi"], "2025-06-02", "2025-06-03", "Việc riêng")
+        second = db.create_leave_request(ids["moi"], "2025-06-10", "2025-06-10", "Khám bệnh")
+        db.approve_leave(first, ids["mgr"])
+        db.approve_leave(second, ids["mgr"], approved=False)
+        return ([db.get_leave_request_by_id(r)["status"] for r in (first, second)],
+                db.get_leave_balance(ids["moi"], 2025),
+                db.verify_leave_balances(), db.verify_dept_occupancy(), db.verify_rollups())
+
+    def maintenance():
+        # lệnh bảo trì file archive audit chỉ chạy trên máy giữ hr.db
+        try:
+            db.archive_audit_logs(hot_months=0)
+        except RuntimeError:
+            return "cần DB cục bộ"
+        return "chạy được"
+
+    return [("tạo người dùng", users), ("username trùng", duplicate_user), ("tệp đính kèm", attachments),
+            ("tạo đơn", create_requests), ("đơn chờ duyệt", pending), ("trùng lịch / sức chứa", overlap_and_capacity),
+            ("duyệt / từ chối / hủy", decide), ("số dư phép", balances), ("báo cáo khoa", dept_reports),
+            ("phân trang", paging), ("kết quả lớn", big_result), ("rollback", rollback),
+            ("ghi đồng thời", concurrent_writers), ("kiểm tra bảng tổng hợp", integrity), ("audit", audit),
+            ("outbox", outbox), ("lịch trực / xung đột", duty_and_conflicts),
+            ("nhân viên chưa có khoa", no_department), ("bảo trì", maintenance)]
+
+
+def run(label, url, db_path, tmp):
+    """Chạy workflow trên một backend, trả về {bước: kết quả hoặc lỗi}."""
+    print(f"\n== {label} ({url or db_path})")
+    db.close_pool()
+    db.clear_cache()
+    db.DATABASE_URL = url
+    db.DB_PATH = Path(db_path)
+    utils.UPLOAD_DIR = Path(tmp) / f"uploads_{label}"
+    utils.BLOB_DIR = utils.UPLOAD_DIR / "blobs"
+    db.init_db()
+    results = {}
+    for name, step in workflow(tmp):
+        try:
+            results[name] = ("ok", _plain(step()))
+        except Exception:
+            results[name] = ("lỗi", traceback.format_exc(limit=3))
+    db.flush_audit_logs()
+    db.close_pool()
+    return results
+
+
+def check_upgrade(tmp):
+    """
+    init_db trên một hr.db cũ (user_version 0, chưa có bảng dẫn xuất) có đơn
+    đã duyệt của nhân viên chưa có khoa: các migration tính lại bảng dẫn xuất
+    phải chạy hết và khớp với leave_requests.
+    """
+    path = Path(tmp) / "legacy.db"
+    conn = sqlite3.connect(path)
+    try:
+        db._create_tables(conn)
+        conn.executemany("INSERT INTO users(username, name, role, dept) VALUES(?,?,?,?)",
+                         [("cu", "Nhân viên cũ", "employee", "Khoa A"), ("moi", "Nhân viên mới", "employee", None)])
+        conn.executemany("""
+          INSERT INTO leave_requests(employee_id, start_date, end_date, status, created_at, approved_at)
+          VALUES(?,?,?,'approved','2025-01-02 08:00:00','2025-01-02T09:00:00')
+        """, [(1, "2025-01-06", "2025-01-07"), (2, "2025-01-06", "2025-01-08")])
+        conn.commit()
+    finally:
+        conn.close()
+    db.close_pool()
+    db.clear_cache()
+    db.DATABASE_URL = None
+    db.DB_PATH = path
+    try:
+        db.init_db()
+        with db.connection() as conn:
+            version = db.schema_version(conn)
+        return (version == db.SCHEMA_VERSION and not db.verify_leave_balances()
+                and not db.verify_dept_occupancy() and not db.verify_rollups())
+    except Exception:
+        traceback.print_exc(limit=3)
+        return False
+    finally:
+        db.close_pool()
+
+
+def start_server(db_path):
+    """db_server.py trên db_path, cổng ngẫu nhiên. Trả về (process, 'host:port')."""
+    env = dict(os.environ, HR_DATABASE_KEY=SERVER_KEY)
+    proc = subprocess.Popen([sys.executable, str(ROOT / "db_server.py"), "--db", str(db_path),
+                             "--listen", "127.0.0.1:0"], stdout=subprocess.PIPE, text=True, env=env)
+    line = proc.stdout.readline()
+    if "đang nghe" not in line:
+        proc.kill()
+        raise SystemExit(f"❌ db_server.py không khởi động được: {line!r}")
+    return proc, line.split("đang nghe", 1)[1].split()[0]
+
+
+def main():
+    os.environ["HR_DATABASE_KEY"] = SERVER_KEY
+    with tempfile.TemporaryDirectory() as tmp:
+        local = run("sqlite", None, Path(tmp) / "local.db", tmp)
+        proc, address = start_server(Path(tmp) / "remote.db")
+        try:
+            remote = run("sqlite+tcp", f"sqlite+tcp://{address}", Path(tmp) / "unused.db", tmp)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        upgraded = check_upgrade(tmp)
+
+    failures = 0
+    for name, expected in local.items():
+        got = remote[name]
+        if name == "bảo trì":
+            ok = expected == ("ok", "chạy được") and got == ("ok", "cần DB cục bộ")
+        else:
+            ok = expected[0] == "ok" and got == expected
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {name}")
+        if not ok:
+            for label, result in (("sqlite", expected), ("sqlite+tcp", got)):
+                print(f"      {label}: {str(result[1])[:600]}")
+
+    failures += not upgraded
+    print(f"{'✅' if upgraded else '❌'} nâng cấp hr.db cũ (init_db)")
+
+    if failures:
+        print(f"\n❌ {failures} bước lỗi hoặc khác nhau giữa các backend.")
+        sys.exit(1)
+    print(f"\n✅ {len(local)} bước cho cùng kết quả trên sqlite và sqlite+tcp.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# check_query_plans.py
+# Chạy các helper trong db.py trên một DB tạm, bắt lại câu SQL thực thi và
+# EXPLAIN QUERY PLAN từng câu. Thoát với mã 1 nếu có truy vấn quét toàn bảng
+# (SCAN <bảng> không dùng index) — chạy sau mỗi lần sửa db.py:
+#
+#     python check_query_plans.py
+import re
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import db
+
+# bảng nhỏ / bảng được phép quét toàn bộ (nếu có)
+# duty_conflict_dirty: hàng đợi vài dòng, luôn được đọc hết rồi xóa
+# attachments, blobs: chỉ lệnh gc-uploads đọc toàn bộ
+# audit_partitions: mỗi tháng một dòng; sqlite_master: danh mục schema
+# audit_fts_config: bảng cấu hình nội bộ của FTS5, SQLite tự đọc lại sau khi schema đổi
+ALLOWED_SCANS = {"duty_conflict_dirty", "attachments", "blobs", "audit_partitions", "sqlite_master",
+                 "audit_fts_config"}
+
+# schema của các file archive audit chỉ tồn tại trong lúc ATTACH; bảng trong đó
+# có cùng index với audit_logs nên kiểm tra câu tương ứng trên main là đủ
+ATTACHED_SCHEMAS = re.compile(r"\b(audit_part|arch)['\"]?\.")
+
+FULL_SCAN = re.compile(r"^SCAN (?:\w+\.)?(\w+)(?![\w.])(?! USING| VIRTUAL)")
+
+
+def exercise_queries():
+    """Gọi lần lượt các truy vấn của db.py với dữ liệu mẫu."""
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO users(username,name,role,dept,email,password_hash) VALUES(?,?,?,?,?,?)",
+            [("mgr", "Trưởng khoa", "manager", "Khoa A", "mgr@bv.local", "x"),
+             ("emp", "Bác sĩ A", "employee", "Khoa A", "emp@bv.local", "x")])
+        conn.commit()
+    mgr = db.get_user_by_username("mgr")
+    emp = db.get_user_by_id(2)
+    req_id = db.create_leave_request(emp["id"], "2025-01-02", "2025-01-03", "Việc riêng")
+    db.get_leave_request_by_id(req_id)
+    db.get_pending_requests_for_dept("Khoa A")
+    db.get_requests_for_dept("Khoa A")
+    db.get_requests_for_dept("Khoa A", status="approved", start_date="2025-01-01", end_date="2025-01-31")
+    db.check_employee_overlap(emp["id"], "2025-01-01", "2025-01-05")
+    db.dept_overlap_count("Khoa A", "2025-01-01", "2025-01-05")
+    db.approve_leave(req_id, mgr["id"], approved=True, note="ok")
+    other_id = db.create_leave_request(emp["id"], "2025-02-02", "2025-02-03", "Khám bệnh",
+                                       attachment_path="uploads/blobs/ab/ab.pdf")
+    db.referenced_attachments()
+    db.put_blob("ab.pdf", b"%PDF")
+    db.blob_exists("ab.pdf")
+    db.get_blob("ab.pdf")
+    db.list_blobs("9999-12-31")
+    db.delete_blobs(["ab.pdf"])
+    db.decide_leave_requests([req_id, other_id], mgr["id"], approved=False, note="bulk", notify=True)
+    db.enqueue_emails([("emp@bv.local", "Thử", "Nội dung")])
+    batch = db.claim_outbox_batch(10)
+    db.mark_emails_sent([batch[0]["id"]])
+    db.mark_email_failed(batch[1]["id"], "timeout", retry_in=30)
+    db.release_emails([batch[1]["id"]], "disconnected", 30)
+    db.outbox_depth()
+    db.get_leave_balance(emp["id"], 2025)
+    db.dept_peak_absences("Khoa A", [("2025-01-01", "2025-01-05"), ("2025-02-01", "2025-02-05")])
+    db.check_dept_capacity("Khoa A", [("2025-01-01", "2025-01-05")], 2)
+    db.cancel_leave_request(req_id, emp["id"])
+    db.dept_weekly_absences("Khoa A", "2025-01-01", "2025-03-31")
+    db.dept_monthly_usage("Khoa A", "2024-04", "2025-03")
+    db.dept_approval_latency("Khoa A", "2024-04", "2025-03")
+    db.log_audit("login", emp["id"], "user", emp["id"], "10.0.0.1")
+    db.log_audit("export_report", mgr["id"], "report", None, "Khoa A", durable=True)
+    db.get_audit_logs(limit=50)
+    db.search_audit_logs(text="bulk ok", action="reject", user_id=mgr["id"], start="2000-01-01", page_size=10)
+    db.search_audit_logs(obj_type="leave_request", page_size=10)
+    db.count_audit_logs(text="bulk", user_id=mgr["id"])
+    db.archive_audit_logs(hot_months=0, now=datetime(2100, 1, 1))
+    db.get_audit_logs(limit=50, start="2000-01-01", end="2100-01-01")
+    db.search_audit_logs(text="bulk", action="reject", start="2000-01-01", page_size=10)
+    rows, cursor = db.get_audit_logs_page(page_size=1, start="2000-01-01")
+    db.count_audit_logs(start="2000-01-01", end="2100-01-01")
+    db.compress_audit_partitions(compress_after_months=0, now=datetime(2100, 1, 1))
+    db.restore_audit_partition(datetime.utcnow().strftime("%Y-%m"))
+    db.list_audit_partitions()
+    db.compressed_audit_partitions("2000-01-01", "2100-01-01")
+    rows, cursor = db.get_audit_logs_page(page_size=2)
+    db.get_audit_logs_page(page_size=2, cursor=cursor)
+    db.get_audit_log_rows_page(page_size=2, cursor=cursor, text="bulk")
+    db.count_audit_logs()
+    rows, cursor = db.get_requests_page_for_dept("Khoa A", page_size=1)
+    db.get_requests_page_for_dept("Khoa A", start_date="2025-01-01", end_date="2025-12-31",
+                                  page_size=1, cursor=cursor)
+    db.get_requests_page_rows("Khoa A", start_date="2025-01-01", end_date="2025-12-31", page_size=1, cursor=cursor)
+    db.count_requests_for_dept("Khoa A", status="approved")
+    list(db.iter_requests_for_dept("Khoa A", start_date="2025-01-01", end_date="2025-12-31", chunk_size=1))
+    db.get_data_version("Khoa A")
+    db.record_login_failure("user:emp", 1000.0, 5, 900, 900)
+    db.login_locked_for(["user:emp", "ip:10.0.0.1"], 1000.0)
+    db.clear_login_failures("user:emp")
+    db.update_password_hash(emp["id"], "x2")
+
+    import duty
+    duty.import_schedule_csv(duty.DEFAULT_CSV)
+    edited = Path(db.DB_PATH).parent / "duty_edit.csv"
+    edited.write_text("date,department,doctor,nurse\n"
+                      "2024-09-01,Khoa Cấp cứu,Bác sĩ Mới,Điều dưỡng Bình\n", encoding="utf-8")
+    duty.sync_csv(edited)
+    duty.sync_csv(edited)
+    duty.schedule_version()
+
+    import conflicts
+    db.create_user("bs_moi", "Bác sĩ Mới", "employee", "Khoa A", "x")
+    new_emp = db.get_user_by_username("bs_moi")
+    leave_id = db.create_leave_request(new_emp["id"], "2024-09-01", "2024-09-02", "Nghỉ")
+    conflicts.conflicts_for_leave(new_emp["id"], "2024-09-01", "2024-09-02")
+    db.approve_leave(leave_id, mgr["id"])
+    conflicts.list_conflicts("2024-09-01", "2024-09-30")
+    conflicts.list_conflicts("2024-09-01", "2024-09-30", department="Khoa Cấp cứu")
+    duty.departments()
+    duty.query_schedule("2024-09-01", department="Khoa CTCH", name="bác bình")
+    duty.query_schedule("2024-09-01", "2024-09-30", name="Điều dưỡng")
+
+
+def main():
+    statements = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_pool()
+        db.CACHE_ENABLED = False   # mọi lời gọi phải chạm tới SQLite
+        db.DATABASE_URL = None     # set_trace_callback chỉ có với SQLite cục bộ
+        db.DB_PATH = Path(tmp) / "plan_check.db"
+        db.init_db()
+        with db.connection() as conn:
+            conn.set_trace_callback(statements.append)
+        exercise_queries()
+
+        failures = []
+        seen = set()
+        with db.connection() as conn:
+            conn.set_trace_callback(None)
+            for sql in statements:
+                head = sql.lstrip().split(None, 1)[0].upper()
+                if head not in ("SELECT", "UPDATE", "DELETE", "WITH") or sql in seen:
+                    continue
+                if ATTACHED_SCHEMAS.search(sql):
+                    continue
+                seen.add(sql)
+                plan = [r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+                scans = [d for d in plan
+                         if (m := FULL_SCAN.match(d)) and m.group(1) not in ALLOWED_SCANS]
+                status = "FULL SCAN" if scans else "ok"
+                print(f"[{status}] {' '.join(sql.split())[:110]}")
+                for detail in plan:
+                    print(f"      {detail}")
+                if scans:
+                    failures.append(sql)
+        db.close_pool()
+
+    if failures:
+        print(f"\n❌ {len(failures)} truy vấn quét toàn bảng.")
+        sys.exit(1)
+    print(f"\n✅ {len(seen)} truy vấn đều dùng index.")
+
+
+if __name__ == "__main__":
+    main()
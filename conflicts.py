@@ -0,0 +1,154 @@
+# conflicts.py
+# Đối chiếu lịch trực (duty_schedule) với các đơn nghỉ phép đã duyệt: người có
+# tên trong lịch trực vào đúng ngày đang nghỉ phép là một xung đột.
+# So khớp bằng pandas: "dàn" lịch trực thành (ngày, khoa, vai trò, người), nối
+# với đơn nghỉ theo tên đã chuẩn hóa rồi lọc ngày nằm trong [start, end] của
+# đơn — không lặp lồng nhau theo từng ngày / từng đơn. pandas chỉ import khi
+# thật sự đối chiếu (trang đăng nhập, manage.py không phải tải pandas).
+# Kết quả lưu ở bảng duty_conflicts; duyệt / hủy đơn hay đồng bộ lịch trực chỉ
+# đánh dấu khoảng ngày bị ảnh hưởng (duty_conflict_dirty) và refresh() kiểm
+# tra lại đúng các khoảng đó.
+import re
+from datetime import date
+
+from db import connection, transaction
+from utils import fold_text
+
+CONFLICT_COLUMNS = ["schedule_id", "request_id", "role", "date", "department", "person"]
+
+# chức danh đứng đầu tên trong lịch trực ("Bác sĩ An", "ĐD. Bình")
+_TITLES = re.compile(r"^(?:bac si|dieu duong|bs|dd|ths|ts|ck[12i]+)\.?\s+")
+
+
+def person_key(name):
+    """Khóa so khớp tên: bỏ dấu, chữ thường, bỏ chức danh ở đầu."""
+    key = " ".join(fold_text(name).split())
+    while True:
+        stripped = _TITLES.sub("", key)
+        if stripped == key:
+            return key
+        key = stripped
+
+
+def _keyed(df, column):
+    # tính khóa trên các tên khác nhau rồi map lại (ít tên, nhiều dòng)
+    names = df[column].unique()
+    return df[column].map(dict(zip(names, map(person_key, names))))
+
+
+def find_conflicts(roster, leaves):
+    """
+    roster: DataFrame (schedule_id, date, department, doctor, nurse).
+    leaves: DataFrame (request_id, name, start_date, end_date) — ngày dạng
+    'YYYY-MM-DD' nên so sánh chuỗi là đủ.
+    Trả về DataFrame theo CONFLICT_COLUMNS.
+    """
+    import pandas as pd
+    if roster.empty or leaves.empty:
+        return pd.DataFrame(columns=CONFLICT_COLUMNS)
+    people = roster.melt(id_vars=["schedule_id", "date", "department"], value_vars=["doctor", "nurse"],
+                         var_name="role", value_name="person")
+    people = people[people["person"] != ""]
+    people["key"] = _keyed(people, "person")
+    leaves = leaves.assign(key=_keyed(leaves, "name"))
+    leaves = leaves[leaves["key"] != ""]
+    joined = people.merge(leaves[["request_id", "key", "start_date", "end_date"]], on="key")
+    hit = joined[(joined["date"] >= joined["start_date"]) & (joined["date"] <= joined["end_date"])]
+    return hit[CONFLICT_COLUMNS].reset_index(drop=True)
+
+
+def _load_roster(conn, start_date, end_date):
+    import pandas as pd
+    rows = conn.execute("""
+      SELECT id, date, department, doctor, nurse FROM duty_schedule WHERE date BETWEEN ? AND ?
+    """, (start_date, end_date)).fetchall()
+    return pd.DataFrame.from_records([tuple(r) for r in rows],
+                                     columns=["schedule_id", "date", "department", "doctor", "nurse"])
+
+
+def _load_leaves(conn, start_date, end_date):
+    import pandas as pd
+    rows = conn.execute("""
+      SELECT lr.id, u.name, lr.start_date, lr.end_date
+      FROM leave_requests lr JOIN users u ON u.id = lr.employee_id
+      WHERE lr.status = 'approved' AND lr.start_date <= ? AND lr.end_date >= ?
+    """, (end_date, start_date)).fetchall()
+    return pd.DataFrame.from_records([tuple(r) for r in rows],
+                                     columns=["request_id", "name", "start_date", "end_date"])
+
+
+def _merge_ranges(ranges):
+    """Gộp các khoảng ngày chồng nhau / liền nhau."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and (date.fromisoformat(start) - date.fromisoformat(merged[-1][1])).days <= 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def refresh():
+    """
+    Kiểm tra lại xung đột trong các khoảng ngày đã bị đánh dấu. Trả về số
+    khoảng đã xử lý (0 nếu không có gì thay đổi — trường hợp thường gặp, chỉ
+    tốn một truy vấn đọc).
+    """
+    with connection() as conn:
+        if conn.execute("SELECT 1 FROM duty_conflict_dirty LIMIT 1").fetchone() is None:
+            return 0
+    with transaction() as conn:
+        dirty = conn.execute("SELECT id, start_date, end_date FROM duty_conflict_dirty").fetchall()
+        if not dirty:
+            return 0
+        ranges = _merge_ranges((r["start_date"], r["end_date"]) for r in dirty)
+        for start, end in ranges:
+            found = find_conflicts(_load_roster(conn, start, end), _load_leaves(conn, start, end))
+            conn.execute("DELETE FROM duty_conflicts WHERE date BETWEEN ? AND ?", (start, end))
+            conn.executemany(f"INSERT INTO duty_conflicts({','.join(CONFLICT_COLUMNS)}) VALUES(?,?,?,?,?,?)",
+                             found.itertuples(index=False, name=None))
+        conn.execute("DELETE FROM duty_conflict_dirty WHERE id <= ?", (max(r["id"] for r in dirty),))
+    return len(ranges)
+
+
+def list_conflicts(start_date, end_date, department=None):
+    """
+    Xung đột trong [start_date, end_date], lọc theo khoa trực. Trả về danh
+    sách dict kèm thông tin đơn nghỉ (request_id, start_date/end_date của đơn,
+    employee_name, employee_dept), sắp theo ngày, khoa.
+    """
+    refresh()
+    sql = """
+      SELECT c.date, c.department, c.role, c.person, c.request_id, c.schedule_id,
+             lr.start_date AS leave_start, lr.end_date AS leave_end,
+             u.name AS employee_name, u.dept AS employee_dept
+      FROM duty_conflicts c
+      JOIN leave_requests lr ON lr.id = c.request_id
+      LEFT JOIN users u ON u.id = lr.employee_id
+      WHERE c.date BETWEEN ? AND ?
+    """
+    params = [start_date, end_date]
+    if department:
+        sql += " AND c.department = ?"
+        params.append(department)
+    sql += " ORDER BY c.date, c.department, c.role"
+    with connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [dict(r) for r in rows]
+
+
+def conflicts_for_leave(employee_id, start_date, end_date):
+    """
+    Các ca trực của nhân viên trong [start_date, end_date] — dùng để cảnh báo
+    trước khi duyệt một đơn chưa được duyệt. Trả về DataFrame theo CONFLICT_COLUMNS
+    (request_id để trống).
+    """
+    import pandas as pd
+    with connection() as conn:
+        user = conn.execute("SELECT name FROM users WHERE id = ?", (employee_id,)).fetchone()
+        if user is None:
+            return pd.DataFrame(columns=CONFLICT_COLUMNS)
+        roster = _load_roster(conn, start_date, end_date)
+    leave = pd.DataFrame([(None, user["name"], start_date, end_date)],
+                         columns=["request_id", "name", "start_date", "end_date"])
+    return find_conflicts(roster, leave)
@@ -1,18 +1,201 @@
 # db.py
+import atexit
+import functools
+import gzip
+import logging
+import os
+import queue
+import re
 import sqlite3
+import shutil
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timedelta
+
+import backends
+import instrument
+
+log = logging.getLogger(__name__)
 
 DB_PATH = Path(__file__).parent / "data" / "hr.db"
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
+# Backend (xem backends.py): không đặt thì SQLite tại DB_PATH; đặt
+# sqlite+tcp://host:port để nhiều replica app dùng chung một db_server.py.
+DATABASE_URL = os.environ.get("HR_DATABASE_URL") or None
+_backend = (None, None)
+
+
+def backend():
+    """Backend đang dùng (đổi DATABASE_URL / DB_PATH thì gọi close_pool() trước)."""
+    global _backend
+    key = DATABASE_URL or DB_PATH
+    if _backend[0] != key:
+        _backend = (key, backends.from_url(DATABASE_URL) if DATABASE_URL else backends.SQLiteBackend(DB_PATH))
+    return _backend[1]
+
+# ----- connection pool -----
+# Mỗi lần rerun Streamlit gọi nhiều helper bên dưới; thay vì mở/đóng kết nối
+# cho từng lần gọi, các kết nối được giữ lại trong pool và dùng chung giữa các
+# session (mỗi kết nối chỉ được một thread mượn tại một thời điểm).
+POOL_SIZE = int(os.environ.get("HR_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("HR_DB_POOL_TIMEOUT", "30"))  # giây
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_pool_lock = threading.Lock()
+_pool_created = 0
+_pool_stats = {"hits": 0, "misses": 0, "waits": 0, "wait_seconds": 0.0}
+
+
+def _open_conn():
+    return backend().connect(timeout=POOL_TIMEOUT)
+
+
 def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    """
+    Mở một kết nối riêng, không qua pool (dùng cho script chạy tay).
+    Người gọi tự đóng kết nối.
+    """
+    return _open_conn()
+
+
+def _acquire():
+    global _pool_created
+    try:
+        conn = _pool.get_nowait()
+        with _pool_lock:
+            _pool_stats["hits"] += 1
+        return conn
+    except queue.Empty:
+        pass
+
+    with _pool_lock:
+        can_create = _pool_created < POOL_SIZE
+        if can_create:
+            _pool_created += 1
+    if can_create:
+        try:
+            conn = _open_conn()
+        except Exception:
+            with _pool_lock:
+                _pool_created -= 1
+            raise
+        with _pool_lock:
+            _pool_stats["misses"] += 1
+        return conn
+
+    # pool đã cạn: chờ một kết nối được trả về
+    t0 = time.perf_counter()
+    try:
+        conn = _pool.get(timeout=POOL_TIMEOUT)
+    except queue.Empty:
+        raise TimeoutError(f"Không lấy được kết nối DB sau {POOL_TIMEOUT}s (pool={POOL_SIZE}).")
+    with _pool_lock:
+        _pool_stats["waits"] += 1
+        _pool_stats["wait_seconds"] += time.perf_counter() - t0
     return conn
 
+
+def _release(conn):
+    global _pool_created
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put_nowait(conn)
+    except (sqlite3.Error, queue.Full):
+        # kết nối hỏng hoặc pool đã được reset: bỏ kết nối này
+        conn.close()
+        with _pool_lock:
+            _pool_created = max(0, _pool_created - 1)
+
+
+@contextmanager
+def connection():
+    """
+    Mượn một kết nối từ pool, trả lại khi ra khỏi khối `with`.
+    Dùng để gom nhiều truy vấn đọc vào cùng một kết nối:
+
+        with connection() as conn:
+            user = conn.execute("SELECT ...").fetchone()
+            ...
+    """
+    conn = _acquire()
+    try:
+        yield conn
+    finally:
+        _release(conn)
+
+
+@contextmanager
+def transaction():
+    """
+    Unit of work: mượn một kết nối và mở BEGIN IMMEDIATE (giữ write lock ngay
+    từ đầu). Commit khi khối `with` kết thúc bình thường, rollback nếu có lỗi,
+    nên thay đổi dữ liệu và dòng audit tương ứng luôn được ghi cùng nhau.
+    """
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def pool_stats():
+    """Số liệu pool: hits/misses, số lần phải chờ và tổng thời gian chờ."""
+    with _pool_lock:
+        stats = dict(_pool_stats)
+        stats["size"] = POOL_SIZE
+        stats["open"] = _pool_created
+    stats["idle"] = _pool.qsize()
+    stats["in_use"] = stats["open"] - stats["idle"]
+    return stats
+
+
+def close_pool():
+    """Đóng các kết nối đang rảnh trong pool (vd. trước khi đổi DB_PATH)."""
+    global _pool_created, _schema_ready
+    _schema_ready = None
+    _audit_writer.flush()
+    clear_cache()
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        conn.close()
+        with _pool_lock:
+            _pool_created = max(0, _pool_created - 1)
+
+
+# DB (DATABASE_URL hoặc DB_PATH) đã được init_db() đưa lên schema mới nhất trong process này
+_schema_ready = None
+
+
 def init_db():
-    conn = get_conn()
+    """
+    Tạo bảng và chạy các migration còn thiếu. app.py gọi ở mỗi lần rerun nên
+    chỉ làm một lần mỗi process (mỗi DB): lần đầu đọc PRAGMA user_version,
+    schema đã mới nhất thì không chạy CREATE TABLE / commit nào; các lần sau
+    trả về ngay.
+    """
+    global _schema_ready
+    key = DATABASE_URL or DB_PATH
+    if _schema_ready == key:
+        return
+    with connection() as conn:
+        if schema_version(conn) < SCHEMA_VERSION:
+            _create_tables(conn)
+            _migrate(conn)
+    _schema_ready = key
+
+
+def _create_tables(conn):
     cur = conn.cursor()
     # users
     cur.execute("""
@@ -54,51 +237,427 @@ def init_db():
       )
     """)
     conn.commit()
-    conn.close()
+
+# ----- schema migrations -----
+# khoảng ngày bao mọi dữ liệu (dùng khi cần kiểm tra lại toàn bộ)
+ALL_DATES = ("0001-01-01", "9999-12-31")
+
+# Mỗi phần tử là một bước nâng cấp schema (tuple câu lệnh SQL hoặc hàm nhận
+# conn). PRAGMA user_version lưu số bước đã chạy nên mỗi bước chỉ chạy 1 lần.
+MIGRATIONS = [
+    # 1: index cho các truy vấn theo nhân viên / khoa / trạng thái / thời gian
+    (
+        "CREATE INDEX IF NOT EXISTS idx_leave_emp_status_dates"
+        " ON leave_requests(employee_id, status, start_date, end_date)",
+        "CREATE INDEX IF NOT EXISTS idx_users_dept ON users(dept)",
+        "CREATE INDEX IF NOT EXISTS idx_leave_status_created ON leave_requests(status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_logs(timestamp)",
+    ),
+    # 2: hàng đợi email (outbox), ghi cùng transaction với thao tác duyệt
+    (
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          to_email TEXT NOT NULL,
+          subject TEXT,
+          body TEXT,
+          status TEXT DEFAULT 'queued',
+          attempts INTEGER DEFAULT 0,
+          next_attempt_at TEXT DEFAULT (datetime('now')),
+          last_error TEXT,
+          created_at TEXT DEFAULT (datetime('now')),
+          sent_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON email_outbox(status, next_attempt_at)",
+    ),
+    # 3: sổ phép theo nhân viên / năm, cập nhật dần khi đơn đổi trạng thái
+    lambda conn: _migrate_leave_balances(conn),
+    # 4: số người nghỉ theo (khoa, ngày) cho kiểm tra sức chứa
+    lambda conn: _migrate_dept_occupancy(conn),
+    # 5: số phiên bản dữ liệu theo khoa, tăng mỗi lần đơn của khoa thay đổi
+    (
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+          scope TEXT PRIMARY KEY,
+          version INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ),
+    # 6: đếm số lần đăng nhập sai theo username / IP (chặn brute-force)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS login_attempts (
+          key TEXT PRIMARY KEY,
+          failures INTEGER NOT NULL DEFAULT 0,
+          window_start REAL NOT NULL,
+          locked_until REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+    ),
+    # 7: lịch trực (duty.py) + chỉ mục tên bác sĩ / điều dưỡng đã bỏ dấu
+    (
+        """
+        CREATE TABLE IF NOT EXISTS duty_schedule (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          date TEXT NOT NULL,
+          department TEXT NOT NULL,
+          doctor TEXT,
+          nurse TEXT,
+          UNIQUE (date, department)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_duty_dept_date ON duty_schedule(department, date)",
+        """
+        CREATE TABLE IF NOT EXISTS duty_name_tokens (
+          token TEXT NOT NULL,
+          schedule_id INTEGER NOT NULL,
+          PRIMARY KEY (token, schedule_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_duty_tokens_schedule ON duty_name_tokens(schedule_id)",
+    ),
+    # 8: dấu vết file nguồn lịch trực đã nạp (mtime / kích thước / sha256)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS duty_sources (
+          path TEXT PRIMARY KEY,
+          mtime REAL NOT NULL,
+          size INTEGER NOT NULL,
+          sha256 TEXT NOT NULL,
+          loaded_at TEXT DEFAULT (datetime('now'))
+        ) WITHOUT ROWID
+        """,
+    ),
+    # 9: xung đột lịch trực / nghỉ phép đã duyệt (conflicts.py) + các khoảng
+    # ngày cần kiểm tra lại; lần đầu kiểm tra toàn bộ
+    (
+        """
+        CREATE TABLE IF NOT EXISTS duty_conflicts (
+          schedule_id INTEGER NOT NULL,
+          request_id INTEGER NOT NULL,
+          role TEXT NOT NULL,
+          date TEXT NOT NULL,
+          department TEXT NOT NULL,
+          person TEXT NOT NULL,
+          PRIMARY KEY (schedule_id, request_id, role)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_conflicts_date ON duty_conflicts(date)",
+        "CREATE INDEX IF NOT EXISTS idx_conflicts_dept_date ON duty_conflicts(department, date)",
+        """
+        CREATE TABLE IF NOT EXISTS duty_conflict_dirty (
+          id INTEGER PRIMARY KEY,
+          start_date TEXT NOT NULL,
+          end_date TEXT NOT NULL
+        )
+        """,
+        f"INSERT INTO duty_conflict_dirty(start_date, end_date) VALUES('{ALL_DATES[0]}', '{ALL_DATES[1]}')",
+    ),
+    # 10: số đơn tham chiếu tới mỗi tệp đính kèm (utils.save_uploaded_file)
+    lambda conn: _migrate_attachments(conn),
+    # 11: danh mục các phân vùng audit theo tháng đã chuyển ra file archive
+    (
+        """
+        CREATE TABLE IF NOT EXISTS audit_partitions (
+          month TEXT PRIMARY KEY,
+          file TEXT NOT NULL,
+          state TEXT NOT NULL,
+          row_count INTEGER NOT NULL,
+          min_ts TEXT,
+          max_ts TEXT,
+          bytes INTEGER,
+          archived_at TEXT DEFAULT (datetime('now'))
+        ) WITHOUT ROWID
+        """,
+    ),
+    # 12: tìm kiếm audit: index theo action / user / obj_type + FTS5 trên note
+    lambda conn: _migrate_audit_search(conn),
+    # 13: bảng tổng hợp cho trang thống kê (theo khoa / tháng, thời gian duyệt)
+    lambda conn: _migrate_rollups(conn),
+    # 14: nội dung tệp đính kèm lưu trong DB (HR_BLOB_STORE=db, khi chạy nhiều máy)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+          key TEXT PRIMARY KEY,
+          size INTEGER NOT NULL,
+          data BLOB NOT NULL,
+          created_at TEXT DEFAULT (datetime('now'))
+        )
+        """,
+    ),
+    # 15: thế hệ session token của mỗi user (đăng xuất thì tăng để thu hồi token cũ)
+    ("ALTER TABLE users ADD COLUMN session_gen INTEGER NOT NULL DEFAULT 0",),
+    # 16: tên gốc của tệp đính kèm (blob lưu theo sha256, tải về vẫn đúng tên)
+    ("ALTER TABLE leave_requests ADD COLUMN attachment_name TEXT",),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _migrate_leave_balances(conn):
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS leave_balances (
+        employee_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        entitlement INTEGER NOT NULL,
+        days_used INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (employee_id, year)
+      ) WITHOUT ROWID
+    """)
+    _rebuild_leave_balances(conn)
+
+
+def _migrate_dept_occupancy(conn):
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS dept_occupancy (
+        dept TEXT NOT NULL,
+        day TEXT NOT NULL,
+        absent INTEGER NOT NULL,
+        PRIMARY KEY (dept, day)
+      ) WITHOUT ROWID
+    """)
+    _rebuild_dept_occupancy(conn)
+
+
+def _migrate_rollups(conn):
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS dept_month_usage (
+        dept TEXT NOT NULL,
+        month TEXT NOT NULL,
+        submitted INTEGER NOT NULL DEFAULT 0,
+        days_used INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dept, month)
+      ) WITHOUT ROWID
+    """)
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS dept_decisions (
+        dept TEXT NOT NULL,
+        month TEXT NOT NULL,
+        status TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (dept, month, status, bucket)
+      ) WITHOUT ROWID
+    """)
+    _rebuild_rollups(conn)
+
+
+def _migrate_attachments(conn):
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS attachments (
+        path TEXT PRIMARY KEY,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT DEFAULT (datetime('now'))
+      ) WITHOUT ROWID
+    """)
+    conn.execute("""
+      INSERT OR IGNORE INTO attachments(path, refcount)
+      SELECT attachment_path, COUNT(*) FROM leave_requests
+      WHERE attachment_path IS NOT NULL GROUP BY attachment_path
+    """)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _migrate(conn):
+    for n in range(schema_version(conn) + 1, SCHEMA_VERSION + 1):
+        step = MIGRATIONS[n - 1]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # một process khác có thể vừa chạy xong bước này
+            if schema_version(conn) >= n:
+                conn.rollback()
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                for stmt in step:
+                    conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version = {n}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+# ----- read-through cache -----
+# Cache dùng chung cho cả process, khóa theo (hàm, tham số). Mỗi mục lưu kèm
+# số phiên bản (data_versions) của scope tương ứng — khoa, hoặc USERS_SCOPE
+# cho bảng users; khi có ghi làm tăng phiên bản, mục cũ tự hết hiệu lực.
+# Phiên bản được đọc lại từ DB chỉ khi PRAGMA data_version báo có commit mới
+# (kể cả từ process khác dùng chung hr.db).
+CACHE_ENABLED = os.environ.get("HR_DB_CACHE", "1") != "0"
+CACHE_MAX_ENTRIES = int(os.environ.get("HR_DB_CACHE_SIZE", "2048"))
+USERS_SCOPE = "__users__"
+
+
+class _VersionTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._seen = None
+        self._versions = {}
+
+    def get(self, scope):
+        with self._lock:
+            if self._conn is None:
+                self._conn = _open_conn()
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._seen:
+                self._versions = dict(self._conn.execute("SELECT scope, version FROM data_versions").fetchall())
+                self._seen = data_version
+            return self._versions.get(scope, 0)
+
+    def reset(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._seen = None
+            self._versions = {}
+
+
+class _LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] == version:
+                self._data.move_to_end(key)
+                self.stats["hits"] += 1
+                return True, entry[1]
+            self.stats["stale" if entry is not None else "misses"] += 1
+            return False, None
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._data[key] = (version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_versions = _VersionTracker()
+_cache = _LRUCache(CACHE_MAX_ENTRIES)
+
+
+def _copy_result(value):
+    # trả bản sao nông để người gọi sửa dict/list không làm hỏng cache
+    if isinstance(value, list):
+        return [_copy_result(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_copy_result(v) for v in value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def cached(scope_of):
+    """Decorator: cache kết quả hàm đọc theo scope_of(*args) -> tên scope."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED:
+                return fn(*args, **kwargs)
+            version = _versions.get(scope_of(*args, **kwargs))
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            found, value = _cache.get(key, version)
+            if not found:
+                value = fn(*args, **kwargs)
+                _cache.put(key, version, value)
+            return _copy_result(value)
+        return wrapper
+    return decorator
+
+
+def dept_scope(dept, *args, **kwargs):
+    return dept
+
+
+def _users_scope(*args, **kwargs):
+    return USERS_SCOPE
+
+
+def cache_stats():
+    stats = dict(_cache.stats)
+    lookups = stats["hits"] + stats["misses"] + stats["stale"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["size"] = len(_cache)
+    stats["max_entries"] = _cache.max_entries
+    return stats
+
+
+def clear_cache():
+    _cache.clear()
+    _versions.reset()
 
 # ----- helper DB API used by app -----
 def create_user(username, name, role, dept, password_hash, email=None):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""INSERT OR IGNORE INTO users (username,name,role,dept,email,password_hash)
-                   VALUES(?,?,?,?,?,?)""",
-                (username, name, role, dept, email, password_hash))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("""INSERT OR IGNORE INTO users (username,name,role,dept,email,password_hash)
+                       VALUES(?,?,?,?,?,?)""",
+                    (username, name, role, dept, email, password_hash))
+        bump_data_versions(conn, {USERS_SCOPE})
 
+@cached(_users_scope)
 def get_user_by_username(username):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM users WHERE username = ?", (username,))
+        row = cur.fetchone()
     return dict(row) if row else None
 
+_PENDING_REQUESTS_SQL = """
+  SELECT lr.id, lr.employee_id, u.name as employee_name, u.username, u.dept, u.email,
+         lr.start_date, lr.end_date, lr.reason, lr.status, lr.attachment_path, lr.created_at
+  FROM leave_requests lr
+  JOIN users u ON lr.employee_id = u.id
+  WHERE u.dept = ? AND lr.status = 'pending'
+  ORDER BY lr.created_at DESC
+"""
+
+# thứ tự cột của _PENDING_REQUESTS_SQL
+PENDING_REQUEST_COLUMNS = ("id", "employee_id", "employee_name", "username", "dept", "email", "start_date",
+                           "end_date", "reason", "status", "attachment_path", "created_at")
+
+@cached(dept_scope)
 def get_pending_requests_for_dept(dept):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-      SELECT lr.id, lr.employee_id, u.name as employee_name, u.username, u.dept,
-             lr.start_date, lr.end_date, lr.reason, lr.status, lr.attachment_path, lr.created_at
-      FROM leave_requests lr
-      JOIN users u ON lr.employee_id = u.id
-      WHERE u.dept = ? AND lr.status = 'pending'
-      ORDER BY lr.created_at DESC
-    """, (dept,))
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(_PENDING_REQUESTS_SQL, (dept,))
+        rows = cur.fetchall()
     return [dict(r) for r in rows]
 
-def get_requests_for_dept(dept, status=None, start_date=None, end_date=None):
-    conn = get_conn()
-    cur = conn.cursor()
-    sql = """
-      SELECT lr.id, lr.employee_id, u.name as employee_name, u.username, u.dept,
-             lr.start_date, lr.end_date, lr.reason, lr.status, lr.attachment_path, lr.created_at
-      FROM leave_requests lr
-      JOIN users u ON lr.employee_id = u.id
-      WHERE u.dept = ?
-    """
+def get_pending_request_rows(dept):
+    """Như get_pending_requests_for_dept nhưng trả tuple theo PENDING_REQUEST_COLUMNS (không dựng dict)."""
+    with connection() as conn:
+        return [tuple(r) for r in conn.execute(_PENDING_REQUESTS_SQL, (dept,))]
+
+_DEPT_REQUESTS_SQL = """
+  SELECT lr.id, lr.employee_id, u.name as employee_name, u.username, u.dept,
+         lr.start_date, lr.end_date, lr.reason, lr.status, lr.attachment_path, lr.created_at
+  FROM leave_requests lr
+  JOIN users u ON lr.employee_id = u.id
+"""
+
+def _dept_requests_filter(dept, status=None, start_date=None, end_date=None):
+    sql = " WHERE u.dept = ?"
     params = [dept]
     if status:
         sql += " AND lr.status = ?"
@@ -106,116 +665,1196 @@ def get_requests_for_dept(dept, status=None, start_date=None, end_date=None):
     if start_date and end_date:
         sql += " AND NOT (lr.end_date < ? OR lr.start_date > ?)"
         params.extend([start_date, end_date])
-    sql += " ORDER BY lr.created_at DESC"
-    cur.execute(sql, tuple(params))
-    rows = cur.fetchall()
-    conn.close()
+    return sql, params
+
+@cached(dept_scope)
+def get_requests_for_dept(dept, status=None, start_date=None, end_date=None):
+    where, params = _dept_requests_filter(dept, status, start_date, end_date)
+    sql = _DEPT_REQUESTS_SQL + where + " ORDER BY lr.created_at DESC"
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, tuple(params))
+        rows = cur.fetchall()
     return [dict(r) for r in rows]
 
+@cached(dept_scope)
+def get_requests_page_for_dept(dept, status=None, start_date=None, end_date=None, page_size=50, cursor=None):
+    """
+    Một trang đơn của khoa (mới nhất trước), phân trang theo keyset.
+    cursor: (created_at, id) của dòng cuối trang trước, None = trang đầu.
+    Trả về (rows, next_cursor); next_cursor = None khi đã hết dữ liệu.
+    """
+    return _requests_page(dept, status, start_date, end_date, page_size, cursor, dict)
+
+def get_requests_page_rows(dept, status=None, start_date=None, end_date=None, page_size=50, cursor=None):
+    """Như get_requests_page_for_dept nhưng trả tuple theo DEPT_REQUEST_COLUMNS (không dựng dict)."""
+    return _requests_page(dept, status, start_date, end_date, page_size, cursor, tuple)
+
+def _requests_page(dept, status, start_date, end_date, page_size, cursor, row):
+    where, params = _dept_requests_filter(dept, status, start_date, end_date)
+    if cursor:
+        where += " AND (lr.created_at, lr.id) < (?, ?)"
+        params.extend(cursor)
+    sql = _DEPT_REQUESTS_SQL + where + " ORDER BY lr.created_at DESC, lr.id DESC LIMIT ?"
+    params.append(page_size + 1)
+    with connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return _page(rows, page_size, ('created_at', 'id'), row)
+
+# thứ tự cột của _DEPT_REQUESTS_SQL
+DEPT_REQUEST_COLUMNS = ("id", "employee_id", "employee_name", "username", "dept", "start_date",
+                        "end_date", "reason", "status", "attachment_path", "created_at")
+
+def iter_requests_for_dept(dept, status=None, start_date=None, end_date=None, chunk_size=1000):
+    """
+    Đọc đơn của khoa theo từng lô `chunk_size` dòng (tuple theo
+    DEPT_REQUEST_COLUMNS) thay vì dựng toàn bộ list dict trong bộ nhớ.
+    """
+    where, params = _dept_requests_filter(dept, status, start_date, end_date)
+    sql = _DEPT_REQUESTS_SQL + where + " ORDER BY lr.created_at DESC, lr.id DESC"
+    with connection() as conn:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [tuple(r) for r in rows]
+
+@cached(dept_scope)
+def count_requests_for_dept(dept, status=None, start_date=None, end_date=None):
+    where, params = _dept_requests_filter(dept, status, start_date, end_date)
+    sql = "SELECT COUNT(*) FROM leave_requests lr JOIN users u ON lr.employee_id = u.id" + where
+    with connection() as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+def _page(rows, page_size, cursor_cols, row=dict):
+    # row: dict hoặc tuple (theo thứ tự cột của câu SELECT)
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = tuple(rows[-1][c] for c in cursor_cols)
+    return [row(r) for r in rows], next_cursor
+
 def get_leave_request_by_id(request_id):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM leave_requests WHERE id = ?", (request_id,))
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM leave_requests WHERE id = ?", (request_id,))
+        row = cur.fetchone()
     return dict(row) if row else None
 
-def approve_leave(request_id, approver_id, approved=True, note=None):
+def approve_leave(request_id, approver_id, approved=True, note=None, notify=False):
     status = 'approved' if approved else 'rejected'
-    approved_at = datetime.utcnow().isoformat()
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE leave_requests SET status=?, approver_id=?, approved_at=? WHERE id=?",
-                (status, approver_id, approved_at, request_id))
-    conn.commit()
-    log_audit(action=('approve' if approved else 'reject'),
-              user_id=approver_id, obj_type='leave_request', obj_id=request_id, note=note)
-    conn.close()
+    with transaction() as conn:
+        _set_leave_status(conn, [request_id], status, approver_id, note=note, notify=notify)
 
-def log_audit(action, user_id, obj_type, obj_id, note=None):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO audit_logs(action,user_id,obj_type,obj_id,note,timestamp) VALUES(?,?,?,?,?,?)",
-                (action, user_id, obj_type, obj_id, note, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
+def decide_leave_requests(request_ids, approver_id, approved=True, note=None, notify=False):
+    """
+    Duyệt / từ chối nhiều đơn cùng lúc trong một transaction.
+    Chỉ các đơn còn 'pending' được cập nhật; trả về danh sách id đã đổi trạng thái.
+    notify=True: xếp email thông báo vào email_outbox trong cùng transaction.
+    """
+    status = 'approved' if approved else 'rejected'
+    with transaction() as conn:
+        return _set_leave_status(conn, request_ids, status, approver_id,
+                                 note=note, from_statuses=('pending',), notify=notify)
+
+def cancel_leave_request(request_id, user_id, note=None):
+    """Hủy đơn pending/approved (status = 'cancelled'). Trả về True nếu đã hủy."""
+    with transaction() as conn:
+        return bool(_set_leave_status(conn, [request_id], 'cancelled', user_id,
+                                      note=note, from_statuses=('pending', 'approved')))
+
+_STATUS_ACTIONS = {'approved': 'approve', 'rejected': 'reject', 'cancelled': 'cancel'}
+
+def _set_leave_status(conn, request_ids, status, actor_id, note=None, from_statuses=None, notify=False):
+    """
+    Đổi trạng thái các đơn và ghi audit trên cùng kết nối `conn` (đang trong
+    transaction), đồng thời cập nhật các bảng dẫn xuất (leave_balances,
+    dept_occupancy, dept_month_usage, dept_decisions).
+    Trả về danh sách id đã được cập nhật.
+    """
+    ids = list(dict.fromkeys(request_ids))
+    if not ids:
+        return []
+    marks = ",".join("?" * len(ids))
+    rows = conn.execute(f"""
+      SELECT lr.id, lr.employee_id, lr.status, lr.start_date, lr.end_date, lr.created_at, lr.approved_at,
+             u.name, u.email, u.dept
+      FROM leave_requests lr
+      LEFT JOIN users u ON lr.employee_id = u.id
+      WHERE lr.id IN ({marks})
+    """, ids).fetchall()
+    changed = [r for r in rows if from_statuses is None or r['status'] in from_statuses]
+    approved_at = None
+    if status in ('approved', 'rejected'):
+        approved_at = _utcnow()
+        conn.executemany("UPDATE leave_requests SET status=?, approver_id=?, approved_at=? WHERE id=?",
+                         [(status, actor_id, approved_at, r['id']) for r in changed])
+    else:
+        conn.executemany("UPDATE leave_requests SET status=? WHERE id=?",
+                         [(status, r['id']) for r in changed])
+    insert_audit(conn, [(_STATUS_ACTIONS.get(status, status), actor_id, 'leave_request', r['id'], note)
+                         for r in changed])
+
+    # chỉ đơn chuyển vào / ra khỏi 'approved' mới ảnh hưởng tới số ngày phép
+    entered = [r for r in changed if status == 'approved' and r['status'] != 'approved']
+    left = [r for r in changed if status != 'approved' and r['status'] == 'approved']
+    _apply_leave_days(conn, entered, +1)
+    _apply_leave_days(conn, left, -1)
+    _apply_occupancy(conn, entered, +1)
+    _apply_occupancy(conn, left, -1)
+    _apply_month_usage(conn, entered, +1)
+    _apply_month_usage(conn, left, -1)
+    _apply_decisions(conn, changed, status, approved_at)
+    bump_data_versions(conn, {r['dept'] for r in changed})
+    mark_conflicts_dirty(conn, [(r['start_date'], r['end_date']) for r in entered + left])
+
+    if notify and status in DECISION_EMAILS:
+        subject, body = DECISION_EMAILS[status]
+        _enqueue_emails(conn, [
+            (r['email'], subject.format(id=r['id']), body.format(name=r['name'], note=note or ""))
+            for r in changed if r['email']
+        ])
+    return [r['id'] for r in changed]
+
+def log_audit(action, user_id, obj_type, obj_id, note=None, durable=False):
+    """
+    Ghi một sự kiện audit không gắn với thay đổi dữ liệu nào (đăng nhập, xuất
+    báo cáo...). Mặc định đi qua AuditWriter (gom nhiều dòng vào một commit,
+    chậm tối đa AUDIT_FLUSH_SECONDS); durable=True thì ghi và commit ngay.
+    Audit của thao tác đổi dữ liệu luôn ghi bằng insert_audit trong chính
+    transaction đó, không qua bộ đệm.
+    """
+    event = (action, user_id, obj_type, obj_id, None if note is None else str(note), _utcnow())
+    if durable:
+        with transaction() as conn:
+            conn.execute(_AUDIT_INSERT_SQL, event)
+    else:
+        _audit_writer.log(event)
+
+_AUDIT_INSERT_SQL = "INSERT INTO audit_logs(action,user_id,obj_type,obj_id,note,timestamp) VALUES(?,?,?,?,?,?)"
 
-def get_audit_logs(limit=200):
+def insert_audit(conn, events):
+    """events: danh sách (action, user_id, obj_type, obj_id, note)."""
+    ts = _utcnow()
+    conn.executemany(_AUDIT_INSERT_SQL,
+                     [(*e, ts) for e in events])
+
+def _utcnow():
+    return datetime.utcnow().isoformat()
+
+def get_audit_logs(limit=200, start=None, end=None, **filters):
+    """
+    Audit log mới nhất trước (kèm username / user_name), giới hạn `limit`
+    dòng, lọc theo khoảng thời gian [start, end) (chuỗi ngày / ISO, UTC) và
+    các bộ lọc của search_audit_logs. Chỉ mở các phân vùng archive giao với
+    khoảng thời gian.
+    """
+    return [dict(r) for r in _read_audit(limit, start, end, None, filters)]
+
+def get_audit_logs_page(page_size=100, cursor=None, start=None, end=None, **filters):
+    """
+    Một trang audit log (mới nhất trước). cursor: (timestamp, id) của dòng
+    cuối trang trước. Trả về (rows, next_cursor).
+    """
+    rows = _read_audit(page_size + 1, start, end, cursor, filters)
+    return _page(rows, page_size, ('timestamp', 'id'))
+
+def get_audit_log_rows_page(page_size=100, cursor=None, start=None, end=None, **filters):
+    """Như get_audit_logs_page nhưng trả tuple theo AUDIT_LOG_COLUMNS (không dựng dict)."""
+    rows = _read_audit(page_size + 1, start, end, cursor, filters)
+    return _page(rows, page_size, ('timestamp', 'id'), tuple)
+
+# thứ tự cột của các dòng audit đọc qua _read_audit
+AUDIT_LOG_COLUMNS = ("id", "action", "user_id", "obj_type", "obj_id", "note", "timestamp", "username", "user_name")
+
+def search_audit_logs(text=None, action=None, user_id=None, obj_type=None, start=None, end=None,
+                      page_size=100, cursor=None):
+    """
+    Tìm audit log: `text` tìm trong ghi chú qua chỉ mục FTS5 (không phân biệt
+    dấu, mỗi từ khớp theo tiền tố: 'ốm' khớp 'Ốm', 'om dau'), cùng các bộ lọc
+    action / user_id / obj_type / [start, end). Trả về (rows, next_cursor).
+    """
+    return get_audit_logs_page(page_size, cursor, start, end,
+                               text=text, action=action, user_id=user_id, obj_type=obj_type)
+
+def count_audit_logs(start=None, end=None, **filters):
+    """Số dòng audit đọc được (không tính các tháng đã nén, xem compressed_audit_partitions)."""
+    _audit_writer.flush_for_read()
+    filtered = any(v is not None and v != "" for v in filters.values())
+    with connection() as conn:
+        total = conn.execute(*_audit_sql(conn, "main", "COUNT(*)", start, end, None, filters)).fetchone()[0]
+        for part in _audit_partitions(conn, start, end):
+            # phân vùng nằm trọn trong khoảng: dùng số dòng trong danh mục
+            if not filtered and (not start or part["min_ts"] >= start) and (not end or part["max_ts"] < end):
+                total += part["row_count"]
+            else:
+                with _attached(conn, part["file"]) as schema:
+                    total += conn.execute(*_audit_sql(conn, schema, "COUNT(*)", start, end, None,
+                                                      filters)).fetchone()[0]
+    return total
+
+# ---- audit writer (group commit) ----
+# log_audit() không mở transaction cho từng dòng: sự kiện được xếp vào bộ đệm
+# và một thread nền ghi cả lô bằng executemany trong một commit khi đủ
+# AUDIT_FLUSH_ROWS dòng hoặc dòng cũ nhất đã chờ AUDIT_FLUSH_SECONDS giây.
+# Bộ đệm được xả khi thoát process (atexit), trước khi đọc audit và trước
+# close_pool().
+AUDIT_FLUSH_ROWS = int(os.environ.get("HR_AUDIT_FLUSH_ROWS", "200"))
+AUDIT_FLUSH_SECONDS = float(os.environ.get("HR_AUDIT_FLUSH_SECONDS", "1.0"))
+AUDIT_MAX_PENDING = 10000     # quá mức này người gọi tự flush (chặn lại) thay vì chờ thread
+
+class AuditWriter:
+    def __init__(self, flush_rows=AUDIT_FLUSH_ROWS, flush_seconds=AUDIT_FLUSH_SECONDS):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._buf = []
+        self._oldest = 0.0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.stats = {"events": 0, "flushes": 0, "rows": 0, "max_batch": 0, "errors": 0, "last_error": None}
+        self.flush_latencies = deque(maxlen=1000)   # giây cho mỗi lần commit
+        self.batch_sizes = deque(maxlen=1000)
+
+    def log(self, event):
+        """event: (action, user_id, obj_type, obj_id, note, timestamp)."""
+        with self._cond:
+            if not self._buf:
+                self._oldest = time.monotonic()
+            self._buf.append(event)
+            self.stats["events"] += 1
+            pending = len(self._buf)
+            if self._closed:
+                pending = AUDIT_MAX_PENDING    # đã dừng thread: ghi luôn
+            elif self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+            if pending >= self.flush_rows:
+                self._cond.notify()
+        if pending >= AUDIT_MAX_PENDING:
+            self.flush()
+
+    def flush(self):
+        """Ghi mọi sự kiện đang chờ trong một transaction; trả về số dòng đã ghi."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buf = self._buf, []
+            if not batch:
+                return 0
+            t0 = time.perf_counter()
+            try:
+                with transaction() as conn:
+                    conn.executemany(_AUDIT_INSERT_SQL, batch)
+            except sqlite3.OperationalError as e:
+                # DB bận / khóa: trả lô về đầu bộ đệm để lần sau ghi lại, giữ thứ tự
+                with self._cond:
+                    self._buf[:0] = batch
+                    self.stats["errors"] += 1
+                    self.stats["last_error"] = str(e)
+                raise
+            except sqlite3.Error:
+                # dữ liệu hỏng ở vài dòng: ghi từng dòng, bỏ các dòng lỗi
+                with transaction() as conn:
+                    for event in batch:
+                        try:
+                            conn.execute(_AUDIT_INSERT_SQL, event)
+                        except sqlite3.Error as e:
+                            self.stats["errors"] += 1
+                            self.stats["last_error"] = str(e)
+            self.flush_latencies.append(time.perf_counter() - t0)
+            self.batch_sizes.append(len(batch))
+            self.stats["flushes"] += 1
+            self.stats["rows"] += len(batch)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            return len(batch)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buf and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # chờ đủ lô hoặc hết hạn của dòng cũ nhất
+                while len(self._buf) < self.flush_rows and not self._closed:
+                    remaining = self._oldest + self.flush_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                # lỗi đã ghi vào stats["last_error"]; lô vẫn nằm trong bộ đệm, thử lại sau
+                log.exception("audit writer: ghi lô audit thất bại")
+                time.sleep(self.flush_seconds)
+
+    def flush_for_read(self):
+        """
+        Ghi bộ đệm trước khi đọc audit để kết quả gồm cả sự kiện vừa log. DB
+        bận thì bỏ qua (lô vẫn nằm trong bộ đệm, thread nền ghi lại sau):
+        trang lịch sử không lỗi, chỉ có thể thiếu vài sự kiện vừa xảy ra.
+        """
+        try:
+            return self.flush()
+        except sqlite3.OperationalError as e:
+            log.warning("audit writer: chưa ghi được bộ đệm trước khi đọc: %s", e)
+            return 0
+
+    def close(self):
+        """Dừng thread nền và ghi nốt phần còn lại (gọi khi tắt process)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.flush()
+
+    def pending(self):
+        with self._cond:
+            return len(self._buf)
+
+_audit_writer = AuditWriter()
+atexit.register(_audit_writer.close)
+
+def flush_audit_logs():
+    return _audit_writer.flush()
+
+def audit_writer_stats():
+    """Số liệu của AuditWriter: số lần commit, cỡ lô, độ trễ commit (p50/p99)."""
+    w = _audit_writer
+    stats = dict(w.stats, pending=w.pending())
+    sizes = list(w.batch_sizes)
+    if sizes:
+        stats["avg_batch"] = sum(sizes) / len(sizes)
+    lat = sorted(w.flush_latencies)
+    if lat:
+        stats["flush_p50"] = lat[len(lat) // 2]
+        stats["flush_p99"] = lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+    return stats
+
+# ---- audit partitions ----
+# Bảng audit_logs trong hr.db chỉ giữ AUDIT_HOT_MONTHS tháng gần nhất; các
+# tháng cũ hơn được chuyển sang data/audit_archive/audit_YYYY_MM.db (mỗi tháng
+# một file, ghi trong audit_partitions) và ATTACH khi cần đọc. Quá
+# AUDIT_COMPRESS_AFTER_MONTHS tháng thì file được nén gzip, không còn đọc trực
+# tiếp được (restore_audit_partition để giải nén lại).
+AUDIT_HOT_MONTHS = int(os.environ.get("HR_AUDIT_HOT_MONTHS", "3"))
+AUDIT_COMPRESS_AFTER_MONTHS = int(os.environ.get("HR_AUDIT_COMPRESS_MONTHS", "24"))
+AUDIT_COLUMNS = "id, action, user_id, obj_type, obj_id, note, timestamp"
+
+def _audit_archive_dir():
+    # với sqlite+tcp là thư mục trên máy chủ DB (ATTACH chạy ở đó)
+    return Path(backend().db_path).parent / "audit_archive"
+
+def _require_local_db(task):
+    if not backend().local:
+        raise RuntimeError(f"{task} đọc / ghi file cạnh hr.db: chạy trên máy giữ hr.db, không đặt HR_DATABASE_URL.")
+
+def _month_shift(month, n):
+    """'YYYY-MM' cộng n tháng."""
+    y, m = map(int, month.split("-"))
+    y, m = divmod(y * 12 + m - 1 + n, 12)
+    return f"{y:04d}-{m + 1:02d}"
+
+AUDIT_FTS_TOKENIZE = "unicode61 remove_diacritics 2"
+
+def _audit_sql(conn, schema, select, start=None, end=None, cursor=None, filters=None):
+    sql = (f"SELECT {select} FROM {schema}.audit_logs a"
+           " LEFT JOIN main.users u ON u.id = a.user_id WHERE 1=1")
+    params = []
+    filters = filters or {}
+    for col in ("action", "user_id", "obj_type"):
+        if filters.get(col) is not None:
+            sql += f" AND a.{col} = ?"
+            params.append(filters[col])
+    words = re.findall(r"\w+", filters.get("text") or "")
+    if words and _has_audit_fts(conn, schema):
+        sql += f" AND a.id IN (SELECT rowid FROM {schema}.audit_fts WHERE audit_fts MATCH ?)"
+        params.append(" ".join(f'"{w}"*' for w in words))
+    elif words:
+        # không có FTS5 (SQLite cũ / file archive cũ): so khớp thô
+        for w in words:
+            sql += " AND a.note LIKE ?"
+            params.append(f"%{w}%")
+    if start:
+        sql += " AND a.timestamp >= ?"
+        params.append(start)
+    if end:
+        sql += " AND a.timestamp < ?"
+        params.append(end)
+    if cursor:
+        sql += " AND (a.timestamp, a.id) < (?, ?)"
+        params.extend(cursor)
+    return sql, params
+
+def _has_audit_fts(conn, schema):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'audit_fts'"
+                        ).fetchone() is not None
+
+def _create_audit_search(conn, schema="main"):
+    """Index lọc + bảng FTS5 trên note cho audit_logs của `schema`. False nếu SQLite không có FTS5."""
+    for col in ("action", "user_id", "obj_type"):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_audit_{col}_ts ON audit_logs({col}, timestamp)")
+    try:
+        conn.execute(f"""
+          CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.audit_fts USING fts5(
+            note, content='audit_logs', content_rowid='id', tokenize='{AUDIT_FTS_TOKENIZE}')
+        """)
+    except sqlite3.OperationalError:
+        return False
+    conn.execute(f"INSERT INTO {schema}.audit_fts(audit_fts) VALUES('rebuild')")
+    return True
+
+def _migrate_audit_search(conn):
+    if not _create_audit_search(conn):
+        return
+    # giữ audit_fts khớp với audit_logs (ghi mới, xóa khi chuyển sang archive)
+    conn.execute("""
+      CREATE TRIGGER IF NOT EXISTS audit_fts_ai AFTER INSERT ON audit_logs BEGIN
+        INSERT INTO audit_fts(rowid, note) VALUES (new.id, new.note);
+      END
+    """)
+    conn.execute("""
+      CREATE TRIGGER IF NOT EXISTS audit_fts_ad AFTER DELETE ON audit_logs BEGIN
+        INSERT INTO audit_fts(audit_fts, rowid, note) VALUES ('delete', old.id, old.note);
+      END
+    """)
+    conn.execute("""
+      CREATE TRIGGER IF NOT EXISTS audit_fts_au AFTER UPDATE OF note ON audit_logs BEGIN
+        INSERT INTO audit_fts(audit_fts, rowid, note) VALUES ('delete', old.id, old.note);
+        INSERT INTO audit_fts(rowid, note) VALUES (new.id, new.note);
+      END
+    """)
+
+def _audit_partitions(conn, start=None, end=None, cursor=None, state="archived"):
+    """Các phân vùng ở trạng thái `state` (mặc định: đọc được, chưa nén) giao với khoảng thời gian, mới trước."""
+    sql = "SELECT month, file, row_count, min_ts, max_ts FROM audit_partitions WHERE state = ?"
+    params = [state]
+    if start:
+        sql += " AND max_ts >= ?"
+        params.append(start)
+    if end:
+        sql += " AND min_ts < ?"
+        params.append(end)
+    if cursor:
+        sql += " AND min_ts <= ?"
+        params.append(cursor[0])
+    sql += " ORDER BY month DESC"
+    return conn.execute(sql, params).fetchall()
+
+@contextmanager
+def _attached(conn, file, alias="audit_part"):
+    conn.execute("ATTACH DATABASE ? AS " + alias, (str(_audit_archive_dir() / file),))
+    try:
+        yield alias
+    finally:
+        conn.execute("DETACH DATABASE " + alias)
+
+def _read_audit(limit, start=None, end=None, cursor=None, filters=None):
+    # bảng nóng chứa các tháng mới nhất; chỉ mở archive khi trang chưa đủ dòng
+    _audit_writer.flush_for_read()
+    select = "a.id, a.action, a.user_id, a.obj_type, a.obj_id, a.note, a.timestamp, u.username, u.name AS user_name"
+    order = " ORDER BY a.timestamp DESC, a.id DESC LIMIT ?"
+    with connection() as conn:
+        sql, params = _audit_sql(conn, "main", select, start, end, cursor, filters)
+        rows = conn.execute(sql + order, params + [limit]).fetchall()
+        if len(rows) < limit:
+            for part in _audit_partitions(conn, start, end, cursor):
+                with _attached(conn, part["file"]) as schema:
+                    sql, params = _audit_sql(conn, schema, select, start, end, cursor, filters)
+                    rows += conn.execute(sql + order, params + [limit - len(rows)]).fetchall()
+                if len(rows) >= limit:
+                    break
+    return rows
+
+def _partition_file(month):
+    return f"audit_{month.replace('-', '_')}.db"
+
+def archive_audit_logs(hot_months=None, now=None):
+    """
+    Chuyển audit của các tháng cũ hơn `hot_months` tháng sang file archive
+    theo tháng. Chạy lại an toàn (chép bằng INSERT OR IGNORE rồi mới xóa).
+    Trả về danh sách (month, số dòng đã chuyển).
+    """
+    _require_local_db("archive_audit_logs")
+    hot = AUDIT_HOT_MONTHS if hot_months is None else hot_months
+    cutoff = _month_shift((now or datetime.utcnow()).strftime("%Y-%m"), -hot) + "-01"
+    moved = []
+    while True:
+        with connection() as conn:
+            oldest = conn.execute("SELECT MIN(timestamp) FROM audit_logs").fetchone()[0]
+        if not oldest or oldest >= cutoff:
+            return moved
+        month = oldest[:7]
+        moved.append((month, _archive_month(month)))
+
+def _archive_month(month):
+    lo, hi = f"{month}-01", f"{_month_shift(month, 1)}-01"
+    with connection() as conn:
+        part = conn.execute("SELECT file, state FROM audit_partitions WHERE month = ?", (month,)).fetchone()
+    if part and part["state"] == "compressed":
+        restore_audit_partition(month)
+    file = _partition_file(month)
+    _audit_archive_dir().mkdir(parents=True, exist_ok=True)
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM audit_logs ORDER BY timestamp DESC LIMIT ?", (limit,))
-    rows = cur.fetchall()
-    conn.close()
+    try:
+        conn.execute("ATTACH DATABASE ? AS arch", (str(_audit_archive_dir() / file),))
+        conn.execute(f"""
+          CREATE TABLE IF NOT EXISTS arch.audit_logs (
+            id INTEGER PRIMARY KEY, action TEXT, user_id INTEGER, obj_type TEXT,
+            obj_id INTEGER, note TEXT, timestamp TEXT
+          )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS arch.idx_audit_timestamp ON audit_logs(timestamp, id)")
+        # bước 1: chép sang file archive (commit riêng: WAL không commit nguyên
+        # tử qua nhiều file, nên chép trước rồi mới xóa khỏi bảng nóng)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"""
+          INSERT OR IGNORE INTO arch.audit_logs({AUDIT_COLUMNS})
+          SELECT {AUDIT_COLUMNS} FROM main.audit_logs WHERE timestamp >= ? AND timestamp < ?
+        """, (lo, hi))
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        _create_audit_search(conn, "arch")
+        conn.commit()
+        # bước 2: xóa khỏi bảng nóng + ghi danh mục
+        conn.execute("BEGIN IMMEDIATE")
+        count, min_ts, max_ts = conn.execute(
+            "SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM arch.audit_logs").fetchone()
+        moved = conn.execute("DELETE FROM main.audit_logs WHERE timestamp >= ? AND timestamp < ?",
+                             (lo, hi)).rowcount
+        conn.execute("""
+          INSERT INTO audit_partitions(month, file, state, row_count, min_ts, max_ts, archived_at)
+          VALUES(?, ?, 'archived', ?, ?, ?, datetime('now'))
+          ON CONFLICT(month) DO UPDATE SET file = excluded.file, state = excluded.state,
+            row_count = excluded.row_count, min_ts = excluded.min_ts, max_ts = excluded.max_ts,
+            archived_at = excluded.archived_at
+        """, (month, file, count, min_ts, max_ts))
+        conn.commit()
+        conn.execute("VACUUM arch")
+        conn.execute("DETACH DATABASE arch")
+    finally:
+        conn.close()
+    _record_partition_size(month, _audit_archive_dir() / file)
+    return moved
+
+def _record_partition_size(month, path):
+    with transaction() as conn:
+        conn.execute("UPDATE audit_partitions SET bytes = ? WHERE month = ?", (path.stat().st_size, month))
+
+def compress_audit_partitions(compress_after_months=None, now=None):
+    """Nén gzip các phân vùng cũ hơn `compress_after_months` tháng. Trả về các tháng đã nén."""
+    _require_local_db("compress_audit_partitions")
+    after = AUDIT_COMPRESS_AFTER_MONTHS if compress_after_months is None else compress_after_months
+    cutoff = _month_shift((now or datetime.utcnow()).strftime("%Y-%m"), -after)
+    with connection() as conn:
+        months = [tuple(r) for r in conn.execute(
+            "SELECT month, file FROM audit_partitions WHERE state = 'archived' AND month < ? ORDER BY month",
+            (cutoff,))]
+    done = []
+    for month, file in months:
+        src = _audit_archive_dir() / file
+        dst = src.with_name(file + ".gz")
+        tmp = dst.with_name(dst.name + ".tmp")
+        with open(src, "rb") as f_in, gzip.open(tmp, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        os.replace(tmp, dst)
+        with transaction() as conn:
+            conn.execute("UPDATE audit_partitions SET state = 'compressed', file = ?, bytes = ? WHERE month = ?",
+                         (dst.name, dst.stat().st_size, month))
+        src.unlink()
+        done.append(month)
+    return done
+
+def restore_audit_partition(month):
+    """Giải nén lại một phân vùng đã nén để đọc được trên trang lịch sử."""
+    _require_local_db("restore_audit_partition")
+    with connection() as conn:
+        part = conn.execute("SELECT file, state FROM audit_partitions WHERE month = ?", (month,)).fetchone()
+    if part is None or part["state"] != "compressed":
+        return False
+    src = _audit_archive_dir() / part["file"]
+    dst = src.with_name(_partition_file(month))
+    tmp = dst.with_name(dst.name + ".tmp")
+    with gzip.open(src, "rb") as f_in, open(tmp, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    os.replace(tmp, dst)
+    with transaction() as conn:
+        conn.execute("UPDATE audit_partitions SET state = 'archived', file = ?, bytes = ? WHERE month = ?",
+                     (dst.name, dst.stat().st_size, month))
+    src.unlink()
+    return True
+
+def compressed_audit_partitions(start=None, end=None):
+    """
+    Các tháng đã nén giao với [start, end) (month, row_count), mới trước. Dòng
+    trong các tháng này không có trong kết quả đọc / đếm audit cho tới khi
+    được giải nén (restore_audit_partition).
+    """
+    with connection() as conn:
+        return [{"month": r["month"], "row_count": r["row_count"]}
+                for r in _audit_partitions(conn, start, end, state="compressed")]
+
+def list_audit_partitions():
+    with connection() as conn:
+        return [dict(r) for r in conn.execute("SELECT * FROM audit_partitions ORDER BY month")]
+
+# ---- data versions ----
+# Mỗi khoa có một số phiên bản tăng dần, được tăng trong cùng transaction với
+# mọi thay đổi đơn của khoa. Dùng làm khóa cache cho báo cáo / truy vấn đọc.
+def bump_data_versions(conn, scopes):
+    conn.executemany("""
+      INSERT INTO data_versions(scope, version) VALUES(?, 1)
+      ON CONFLICT(scope) DO UPDATE SET version = version + 1
+    """, [(sc,) for sc in scopes if sc is not None])
+
+def get_data_version(scope):
+    return _versions.get(scope)
+
+# ---- xung đột lịch trực ----
+# Đổi trạng thái đơn / lịch trực chỉ ghi lại khoảng ngày bị ảnh hưởng (cùng
+# transaction); conflicts.refresh() kiểm tra lại đúng các khoảng đó.
+def mark_conflicts_dirty(conn, ranges):
+    conn.executemany("INSERT INTO duty_conflict_dirty(start_date, end_date) VALUES(?,?)",
+                     list(dict.fromkeys(ranges)))
+
+# ---- email outbox ----
+# Email thông báo được ghi vào email_outbox trong cùng transaction với thao
+# tác nghiệp vụ; notify.OutboxWorker gửi dần ở nền.
+DECISION_EMAILS = {
+    'approved': ("[Thông báo] Đơn #{id} đã được duyệt",
+                 "Xin chào {name}, đơn nghỉ phép của bạn đã được duyệt."),
+    'rejected': ("[Thông báo] Đơn #{id} bị từ chối",
+                 "Xin chào {name}, đơn nghỉ phép của bạn đã bị từ chối.\nLý do: {note}"),
+}
+OUTBOX_LEASE_SECONDS = 300  # email đang gửi bị "treo" quá thời gian này sẽ được gửi lại
+
+def _enqueue_emails(conn, messages):
+    """messages: danh sách (to_email, subject, body)."""
+    conn.executemany("INSERT INTO email_outbox(to_email, subject, body) VALUES(?,?,?)", messages)
+
+def enqueue_emails(messages):
+    with transaction() as conn:
+        _enqueue_emails(conn, list(messages))
+
+def claim_outbox_batch(limit=50):
+    """
+    Lấy tối đa `limit` email đến hạn gửi và đánh dấu 'sending' (kèm thời hạn
+    lease, để worker khác không lấy trùng). Trả về list dict.
+    """
+    with transaction() as conn:
+        rows = conn.execute("""
+          SELECT id, to_email, subject, body, attempts, created_at FROM email_outbox
+          WHERE status IN ('queued','sending') AND next_attempt_at <= datetime('now')
+          ORDER BY next_attempt_at, id
+          LIMIT ?
+        """, (limit,)).fetchall()
+        conn.executemany(f"""
+          UPDATE email_outbox SET status='sending',
+                 next_attempt_at=datetime('now', '+{OUTBOX_LEASE_SECONDS} seconds')
+          WHERE id=?
+        """, [(r['id'],) for r in rows])
     return [dict(r) for r in rows]
 
+def mark_emails_sent(outbox_ids):
+    with transaction() as conn:
+        conn.executemany("UPDATE email_outbox SET status='sent', sent_at=datetime('now'), last_error=NULL WHERE id=?",
+                         [(i,) for i in outbox_ids])
+
+def mark_email_failed(outbox_id, error, retry_in=None):
+    """retry_in: số giây trước lần thử lại; None = bỏ hẳn (status 'failed')."""
+    with transaction() as conn:
+        conn.execute("""
+          UPDATE email_outbox
+          SET attempts = attempts + 1, last_error = ?,
+              status = CASE WHEN ? IS NULL THEN 'failed' ELSE 'queued' END,
+              next_attempt_at = datetime('now', '+' || COALESCE(?, 0) || ' seconds')
+          WHERE id = ?
+        """, (str(error)[:500], retry_in, retry_in, outbox_id))
+
+def release_emails(outbox_ids, error, retry_in):
+    """Trả email đã lấy về hàng đợi sau retry_in giây, không tính một lần thử (lỗi kết nối SMTP)."""
+    with transaction() as conn:
+        conn.executemany("""
+          UPDATE email_outbox
+          SET status = 'queued', last_error = ?, next_attempt_at = datetime('now', '+' || ? || ' seconds')
+          WHERE id = ?
+        """, [(str(error)[:500], retry_in, i) for i in outbox_ids])
+
+def outbox_depth():
+    """Số email theo trạng thái, vd. {'queued': 3, 'sent': 120}."""
+    with connection() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status").fetchall()
+    return {r[0]: r[1] for r in rows}
+
+# ---- sổ phép (leave_balances) ----
+# Số ngày đã nghỉ được tính vào năm của start_date, mỗi đơn = end - start + 1 ngày.
+DEFAULT_LEAVE_ENTITLEMENT = 12
+
+def _leave_days(start_date, end_date):
+    return (date.fromisoformat(end_date) - date.fromisoformat(start_date)).days + 1
+
+def _apply_leave_days(conn, rows, sign):
+    conn.executemany("""
+      INSERT INTO leave_balances(employee_id, year, entitlement, days_used) VALUES(?,?,?,?)
+      ON CONFLICT(employee_id, year) DO UPDATE SET days_used = days_used + excluded.days_used
+    """, [(r['employee_id'], int(r['start_date'][:4]), DEFAULT_LEAVE_ENTITLEMENT,
+           sign * _leave_days(r['start_date'], r['end_date'])) for r in rows])
+
+_EXPECTED_BALANCES_SQL = """
+  SELECT employee_id, CAST(substr(start_date, 1, 4) AS INTEGER) AS year,
+         CAST(SUM(julianday(end_date) - julianday(start_date) + 1) AS INTEGER) AS days_used
+  FROM leave_requests
+  WHERE status = 'approved'
+  GROUP BY employee_id, year
+"""
+
+def _rebuild_leave_balances(conn):
+    conn.execute("UPDATE leave_balances SET days_used = 0")
+    conn.execute(f"""
+      INSERT INTO leave_balances(employee_id, year, entitlement, days_used)
+      SELECT employee_id, year, {DEFAULT_LEAVE_ENTITLEMENT}, days_used FROM ({_EXPECTED_BALANCES_SQL})
+      WHERE true
+      ON CONFLICT(employee_id, year) DO UPDATE SET days_used = excluded.days_used
+    """)
+
+def get_leave_balance(employee_id, year):
+    """Trả về dict entitlement / days_used / remaining của nhân viên trong năm."""
+    with connection() as conn:
+        row = conn.execute("SELECT entitlement, days_used FROM leave_balances WHERE employee_id = ? AND year = ?",
+                           (employee_id, year)).fetchone()
+    entitlement, used = (row['entitlement'], row['days_used']) if row else (DEFAULT_LEAVE_ENTITLEMENT, 0)
+    return {"entitlement": entitlement, "days_used": used, "remaining": entitlement - used}
+
+def verify_leave_balances():
+    """
+    So sánh leave_balances với số liệu tính lại từ leave_requests.
+    Trả về danh sách (employee_id, year, stored, expected) bị lệch.
+    """
+    with connection() as conn:
+        expected = {(r[0], r[1]): r[2] for r in conn.execute(_EXPECTED_BALANCES_SQL)}
+        stored = {(r[0], r[1]): r[2] for r in conn.execute("SELECT employee_id, year, days_used FROM leave_balances")}
+    keys = sorted(set(expected) | set(stored))
+    return [(emp, year, stored.get((emp, year), 0), expected.get((emp, year), 0))
+            for emp, year in keys if stored.get((emp, year), 0) != expected.get((emp, year), 0)]
+
+def rebuild_leave_balances():
+    """Tính lại toàn bộ leave_balances từ leave_requests (giữ nguyên entitlement)."""
+    with transaction() as conn:
+        _rebuild_leave_balances(conn)
+
 # ---- overlap checks (business validation) ----
 def check_employee_overlap(employee_id, start_date, end_date):
     """
     Trả về True nếu có đơn pending/approved trùng khoảng thời gian (same employee).
     start_date & end_date format: 'YYYY-MM-DD'
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-      SELECT id FROM leave_requests
-      WHERE employee_id = ? AND status IN ('approved','pending')
-        AND NOT (end_date < ? OR start_date > ?)
-    """, (employee_id, start_date, end_date))
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+          SELECT id FROM leave_requests
+          WHERE employee_id = ? AND status IN ('approved','pending')
+            AND NOT (end_date < ? OR start_date > ?)
+        """, (employee_id, start_date, end_date))
+        rows = cur.fetchall()
     return len(rows) > 0
 
+@cached(dept_scope)
 def dept_overlap_count(dept, start_date, end_date):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-      SELECT COUNT(*) FROM leave_requests lr
-      JOIN users u ON lr.employee_id = u.id
-      WHERE u.dept = ? AND lr.status = 'approved'
-        AND NOT (lr.end_date < ? OR lr.start_date > ?)
-    """, (dept, start_date, end_date))
-    count = cur.fetchone()[0]
-    conn.close()
+    """
+    Số người nghỉ (đơn approved) cao nhất trong một ngày bất kỳ của khoảng
+    [start_date, end_date] — đọc từ dept_occupancy, chi phí tỉ lệ với số ngày.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+          SELECT COALESCE(MAX(absent), 0) FROM dept_occupancy
+          WHERE dept = ? AND day BETWEEN ? AND ?
+        """, (dept, start_date, end_date))
+        count = cur.fetchone()[0]
     return count
+
+def dept_peak_absences(dept, ranges):
+    """
+    Như dept_overlap_count nhưng cho nhiều khoảng (start_date, end_date) cùng
+    lúc, chỉ với một truy vấn. Trả về list số người nghỉ cao nhất theo thứ tự.
+    """
+    ranges = list(ranges)
+    if not ranges:
+        return []
+    counts = _occupancy_between(dept, min(r[0] for r in ranges), max(r[1] for r in ranges))
+    return [max((counts.get(d, 0) for d in _days(sd, ed)), default=0) for sd, ed in ranges]
+
+def check_dept_capacity(dept, ranges, max_allowed):
+    """
+    Kiểm tra lần lượt các khoảng (start_date, end_date) như thể lần lượt được
+    duyệt: khoảng được nhận sẽ cộng vào số người nghỉ của các khoảng sau.
+    Trả về list bool — True nếu khoảng đó vẫn dưới ngưỡng max_allowed.
+    """
+    ranges = list(ranges)
+    if not ranges:
+        return []
+    counts = _occupancy_between(dept, min(r[0] for r in ranges), max(r[1] for r in ranges))
+    result = []
+    for sd, ed in ranges:
+        days = _days(sd, ed)
+        fits = max((counts.get(d, 0) for d in days), default=0) < max_allowed
+        if fits:
+            for d in days:
+                counts[d] = counts.get(d, 0) + 1
+        result.append(fits)
+    return result
+
+def _occupancy_between(dept, start_date, end_date):
+    with connection() as conn:
+        rows = conn.execute("SELECT day, absent FROM dept_occupancy WHERE dept = ? AND day BETWEEN ? AND ?",
+                            (dept, start_date, end_date)).fetchall()
+    return {r[0]: r[1] for r in rows}
+
+def _days(start_date, end_date):
+    first = date.fromisoformat(start_date)
+    return [(first + timedelta(days=i)).isoformat() for i in range(_leave_days(start_date, end_date))]
+
+def _apply_occupancy(conn, rows, sign):
+    # nhân viên chưa có khoa không tính vào sức chứa khoa nào
+    rows = [r for r in rows if r['dept'] is not None]
+    conn.executemany("""
+      INSERT INTO dept_occupancy(dept, day, absent) VALUES(?,?,?)
+      ON CONFLICT(dept, day) DO UPDATE SET absent = absent + excluded.absent
+    """, [(r['dept'], d, sign) for r in rows for d in _days(r['start_date'], r['end_date'])])
+    if sign < 0:
+        conn.executemany("DELETE FROM dept_occupancy WHERE dept = ? AND day BETWEEN ? AND ? AND absent <= 0",
+                         [(r['dept'], r['start_date'], r['end_date']) for r in rows])
+
+_EXPECTED_OCCUPANCY_SQL = """
+  WITH RECURSIVE days(dept, day, end_date) AS (
+    SELECT u.dept, lr.start_date, lr.end_date
+    FROM leave_requests lr JOIN users u ON lr.employee_id = u.id
+    WHERE lr.status = 'approved' AND lr.start_date <= lr.end_date AND u.dept IS NOT NULL
+    UNION ALL
+    SELECT dept, date(day, '+1 day'), end_date FROM days WHERE day < end_date
+  )
+  SELECT dept, day, COUNT(*) AS absent FROM days GROUP BY dept, day
+"""
+
+def _rebuild_dept_occupancy(conn):
+    conn.execute("DELETE FROM dept_occupancy")
+    conn.execute(f"INSERT INTO dept_occupancy(dept, day, absent) {_EXPECTED_OCCUPANCY_SQL}")
+
+def verify_dept_occupancy():
+    """Trả về danh sách (dept, day, stored, expected) bị lệch so với leave_requests."""
+    with connection() as conn:
+        expected = {(r[0], r[1]): r[2] for r in conn.execute(_EXPECTED_OCCUPANCY_SQL)}
+        stored = {(r[0], r[1]): r[2] for r in conn.execute("SELECT dept, day, absent FROM dept_occupancy")}
+    keys = sorted(set(expected) | set(stored))
+    return [(dept, day, stored.get((dept, day), 0), expected.get((dept, day), 0))
+            for dept, day in keys if stored.get((dept, day), 0) != expected.get((dept, day), 0)]
+
+def rebuild_dept_occupancy():
+    """Tính lại dept_occupancy (vd. sau khi nhân viên chuyển khoa)."""
+    with transaction() as conn:
+        _rebuild_dept_occupancy(conn)
+
+# ---- bảng tổng hợp cho trang thống kê ----
+# dept_month_usage: theo khoa / tháng — số đơn nộp (tháng tạo đơn) và số ngày
+#   nghỉ đã duyệt (tháng của từng ngày nghỉ, cùng nguồn với dept_occupancy).
+# dept_decisions: các đơn đang ở trạng thái approved / rejected theo khoa,
+#   tháng ra quyết định và nhóm thời gian chờ duyệt (created_at -> approved_at).
+# Cập nhật tăng dần trong create_leave_request / _set_leave_status nên trang
+# thống kê chỉ đọc vài chục dòng, không phụ thuộc số đơn đã có.
+
+# cận trên (giờ) của các nhóm thời gian chờ duyệt; nhóm cuối là "lâu hơn"
+LATENCY_BUCKET_HOURS = (1, 4, 24, 72, 168)
+LATENCY_BUCKET_LABELS = ("< 1 giờ", "1-4 giờ", "4-24 giờ", "1-3 ngày", "3-7 ngày", "> 7 ngày")
+
+def _latency_bucket(created_at, approved_at):
+    hours = (datetime.fromisoformat(approved_at) - datetime.fromisoformat(created_at)).total_seconds() / 3600
+    return next((i for i, bound in enumerate(LATENCY_BUCKET_HOURS) if hours < bound), len(LATENCY_BUCKET_HOURS))
+
+def _apply_month_usage(conn, rows, sign):
+    # như _EXPECTED_MONTH_USAGE_SQL: nhân viên chưa có khoa không vào thống kê
+    days = {}
+    for r in rows:
+        if r['dept'] is None:
+            continue
+        for d in _days(r['start_date'], r['end_date']):
+            days[(r['dept'], d[:7])] = days.get((r['dept'], d[:7]), 0) + sign
+    conn.executemany("""
+      INSERT INTO dept_month_usage(dept, month, days_used) VALUES(?,?,?)
+      ON CONFLICT(dept, month) DO UPDATE SET days_used = days_used + excluded.days_used
+    """, [(dept, month, n) for (dept, month), n in days.items()])
+
+def _apply_decisions(conn, rows, status, approved_at):
+    # đơn rời trạng thái approved / rejected (hủy, quyết định lại) bị trừ ở
+    # nhóm cũ; đơn vừa được quyết định cộng vào nhóm mới
+    deltas = {}
+    for r in rows:
+        if r['dept'] is None:
+            continue  # như _EXPECTED_DECISIONS_SQL
+        if r['status'] in ('approved', 'rejected') and r['approved_at'] and r['created_at']:
+            key = (r['dept'], r['approved_at'][:7], r['status'], _latency_bucket(r['created_at'], r['approved_at']))
+            deltas[key] = deltas.get(key, 0) - 1
+        if approved_at and r['created_at']:
+            key = (r['dept'], approved_at[:7], status, _latency_bucket(r['created_at'], approved_at))
+            deltas[key] = deltas.get(key, 0) + 1
+    conn.executemany("""
+      INSERT INTO dept_decisions(dept, month, status, bucket, n) VALUES(?,?,?,?,?)
+      ON CONFLICT(dept, month, status, bucket) DO UPDATE SET n = n + excluded.n
+    """, [(*key, n) for key, n in deltas.items() if n])
+
+_EXPECTED_MONTH_USAGE_SQL = f"""
+  SELECT dept, month, SUM(submitted) AS submitted, SUM(days_used) AS days_used FROM (
+    SELECT u.dept AS dept, substr(lr.created_at, 1, 7) AS month, 1 AS submitted, 0 AS days_used
+    FROM leave_requests lr JOIN users u ON lr.employee_id = u.id
+    WHERE lr.created_at IS NOT NULL
+    UNION ALL
+    SELECT dept, substr(day, 1, 7), 0, absent FROM ({_EXPECTED_OCCUPANCY_SQL})
+  )
+  WHERE dept IS NOT NULL
+  GROUP BY dept, month
+"""
+
+_LATENCY_HOURS_SQL = "(julianday(lr.approved_at) - julianday(lr.created_at)) * 24"
+_EXPECTED_DECISIONS_SQL = f"""
+  SELECT u.dept, substr(lr.approved_at, 1, 7) AS month, lr.status,
+         CASE {' '.join(f'WHEN {_LATENCY_HOURS_SQL} < {b} THEN {i}' for i, b in enumerate(LATENCY_BUCKET_HOURS))}
+              ELSE {len(LATENCY_BUCKET_HOURS)} END AS bucket,
+         COUNT(*) AS n
+  FROM leave_requests lr JOIN users u ON lr.employee_id = u.id
+  WHERE lr.status IN ('approved', 'rejected') AND lr.approved_at IS NOT NULL AND lr.created_at IS NOT NULL
+    AND u.dept IS NOT NULL
+  GROUP BY u.dept, month, lr.status, bucket
+"""
+
+def _rebuild_rollups(conn):
+    conn.execute("DELETE FROM dept_month_usage")
+    conn.execute(f"INSERT INTO dept_month_usage(dept, month, submitted, days_used) {_EXPECTED_MONTH_USAGE_SQL}")
+    conn.execute("DELETE FROM dept_decisions")
+    conn.execute(f"INSERT INTO dept_decisions(dept, month, status, bucket, n) {_EXPECTED_DECISIONS_SQL}")
+
+def verify_rollups():
+    """
+    So sánh dept_month_usage / dept_decisions với số liệu tính lại từ
+    leave_requests. Trả về danh sách (bảng, khóa, stored, expected) bị lệch.
+    """
+    checks = (
+        ("dept_month_usage", _EXPECTED_MONTH_USAGE_SQL,
+         "SELECT dept, month, submitted, days_used FROM dept_month_usage", 2, (0, 0)),
+        ("dept_decisions", _EXPECTED_DECISIONS_SQL,
+         "SELECT dept, month, status, bucket, n FROM dept_decisions", 4, (0,)),
+    )
+    mismatches = []
+    with connection() as conn:
+        for table, expected_sql, stored_sql, width, zero in checks:
+            expected = {tuple(r[:width]): tuple(r[width:]) for r in conn.execute(expected_sql)}
+            stored = {tuple(r[:width]): tuple(r[width:]) for r in conn.execute(stored_sql)}
+            mismatches += [(table, key, stored.get(key, zero), expected.get(key, zero))
+                           for key in sorted(set(expected) | set(stored))
+                           if stored.get(key, zero) != expected.get(key, zero)]
+    return mismatches
+
+def rebuild_rollups():
+    """Tính lại các bảng tổng hợp thống kê từ leave_requests."""
+    with transaction() as conn:
+        _rebuild_rollups(conn)
+
+def rebuild_summaries(conn, balances=True):
+    """
+    Tính lại dept_occupancy, bảng thống kê và (nếu balances) sổ phép trong
+    transaction `conn` của người gọi — dùng sau khi ghi thẳng hàng loạt
+    (bulk_import) không đi qua các hàm nghiệp vụ.
+    """
+    if balances:
+        _rebuild_leave_balances(conn)
+    _rebuild_dept_occupancy(conn)
+    _rebuild_rollups(conn)
+
+@cached(dept_scope)
+def dept_weekly_absences(dept, start_date, end_date):
+    """
+    Số người-ngày nghỉ và số người nghỉ cao nhất trong ngày theo tuần (tuần bắt
+    đầu thứ Hai) của khoa trong [start_date, end_date], từ dept_occupancy.
+    Trả về list dict week / person_days / peak, đủ mọi tuần trong khoảng.
+    """
+    counts = _occupancy_between(dept, start_date, end_date)
+    weeks = {}
+    for d in _days(start_date, end_date):
+        day = date.fromisoformat(d)
+        week = (day - timedelta(days=day.weekday())).isoformat()
+        w = weeks.setdefault(week, {'week': week, 'person_days': 0, 'peak': 0})
+        w['person_days'] += counts.get(d, 0)
+        w['peak'] = max(w['peak'], counts.get(d, 0))
+    return [weeks[k] for k in sorted(weeks)]
+
+@cached(dept_scope)
+def dept_monthly_usage(dept, start_month, end_month):
+    """
+    Theo tháng ('YYYY-MM') trong [start_month, end_month]: số đơn nộp, số ngày
+    nghỉ đã duyệt, số đơn đang approved / rejected (theo tháng quyết định).
+    """
+    with connection() as conn:
+        usage = {r['month']: dict(r) for r in conn.execute("""
+          SELECT month, submitted, days_used FROM dept_month_usage
+          WHERE dept = ? AND month BETWEEN ? AND ?
+        """, (dept, start_month, end_month))}
+        decided = conn.execute("""
+          SELECT month, status, SUM(n) AS n FROM dept_decisions
+          WHERE dept = ? AND month BETWEEN ? AND ?
+          GROUP BY month, status
+        """, (dept, start_month, end_month)).fetchall()
+    result = []
+    month = start_month
+    while month <= end_month:
+        row = {'month': month, 'submitted': 0, 'days_used': 0, 'approved': 0, 'rejected': 0}
+        row.update(usage.get(month, {}))
+        result.append(row)
+        month = _month_shift(month, 1)
+    by_month = {r['month']: r for r in result}
+    for r in decided:
+        by_month[r['month']][r['status']] = r['n']
+    return result
+
+@cached(dept_scope)
+def dept_approval_latency(dept, start_month, end_month):
+    """
+    Phân bố thời gian chờ duyệt của khoa (đơn đang approved / rejected, ra quyết
+    định trong [start_month, end_month]). Trả về list dict bucket / label /
+    approved / rejected theo thứ tự LATENCY_BUCKET_LABELS.
+    """
+    result = [{'bucket': i, 'label': label, 'approved': 0, 'rejected': 0}
+              for i, label in enumerate(LATENCY_BUCKET_LABELS)]
+    with connection() as conn:
+        for r in conn.execute("""
+          SELECT bucket, status, SUM(n) AS n FROM dept_decisions
+          WHERE dept = ? AND month BETWEEN ? AND ?
+          GROUP BY bucket, status
+        """, (dept, start_month, end_month)):
+            result[r['bucket']][r['status']] = r['n']
+    return result
+
 # Thêm vào db.py
 
+@cached(_users_scope)
 def get_user_by_id(user_id):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+        row = cur.fetchone()
     return dict(row) if row else None
 
-def create_leave_request(employee_id, start_date, end_date, reason, attachment_path=None):
+def update_password_hash(user_id, password_hash):
+    with transaction() as conn:
+        conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id))
+        bump_data_versions(conn, {USERS_SCOPE})
+
+def revoke_sessions(user_id):
+    """Thu hồi mọi session token đã cấp cho user (auth.verify_session_token so session_gen)."""
+    with transaction() as conn:
+        conn.execute("UPDATE users SET session_gen = session_gen + 1 WHERE id = ?", (user_id,))
+        bump_data_versions(conn, {USERS_SCOPE})
+
+# ---- login throttling ----
+# key: 'user:<username>' hoặc 'ip:<địa chỉ>'; thời gian lưu dạng epoch (giây).
+def login_locked_for(keys, now):
+    """Số giây còn bị khóa (0 nếu không key nào đang bị khóa)."""
+    keys = list(keys)
+    if not keys:
+        return 0
+    marks = ",".join("?" * len(keys))
+    with connection() as conn:
+        row = conn.execute(f"SELECT MAX(locked_until) FROM login_attempts WHERE key IN ({marks})", keys).fetchone()
+    return max(0, (row[0] or 0) - now)
+
+def record_login_failure(key, now, max_failures, window_seconds, lockout_seconds):
+    """Ghi một lần đăng nhập sai; khóa key khi đủ max_failures lần trong cửa sổ."""
+    with transaction() as conn:
+        conn.execute("""
+          INSERT INTO login_attempts(key, failures, window_start) VALUES(?, 1, ?)
+          ON CONFLICT(key) DO UPDATE SET
+            failures = CASE WHEN window_start < ? THEN 1 ELSE failures + 1 END,
+            window_start = CASE WHEN window_start < ? THEN excluded.window_start ELSE window_start END
+        """, (key, now, now - window_seconds, now - window_seconds))
+        conn.execute("UPDATE login_attempts SET locked_until = ?, failures = 0 WHERE key = ? AND failures >= ?",
+                     (now + lockout_seconds, key, max_failures))
+
+def clear_login_failures(key):
+    with connection() as conn:
+        if conn.execute("SELECT 1 FROM login_attempts WHERE key = ?", (key,)).fetchone() is None:
+            return  # tránh mở transaction ghi cho mỗi lần đăng nhập đúng
+    with transaction() as conn:
+        conn.execute("DELETE FROM login_attempts WHERE key = ?", (key,))
+
+def create_leave_request(employee_id, start_date, end_date, reason, attachment_path=None, attachment_name=None):
     """
     Tạo đơn mới (status = 'pending'), trả về request_id.
     start_date, end_date: 'YYYY-MM-DD' (string)
+    attachment_name: tên file gốc người dùng tải lên (dùng khi tải về)
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-      INSERT INTO leave_requests (employee_id, start_date, end_date, reason, attachment_path, status, created_at)
-      VALUES (?, ?, ?, ?, ?, 'pending', datetime('now'))
-    """, (employee_id, start_date, end_date, reason, attachment_path))
-    conn.commit()
-    req_id = cur.lastrowid
-    conn.close()
-    # Ghi audit
-    log_audit(action='create_leave', user_id=employee_id, obj_type='leave_request', obj_id=req_id, note="Created by employee")
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+          INSERT INTO leave_requests (employee_id, start_date, end_date, reason, attachment_path, attachment_name,
+                                      status, created_at)
+          VALUES (?, ?, ?, ?, ?, ?, 'pending', datetime('now'))
+        """, (employee_id, start_date, end_date, reason, attachment_path, attachment_name))
+        req_id = cur.lastrowid
+        if attachment_path:
+            _add_attachment_refs(conn, [attachment_path])
+        # Ghi audit (cùng transaction)
+        insert_audit(conn, [('create_leave', employee_id, 'leave_request', req_id, "Created by employee")])
+        dept = conn.execute("SELECT dept FROM users WHERE id = ?", (employee_id,)).fetchone()
+        if dept and dept[0]:
+            conn.execute("""
+              INSERT INTO dept_month_usage(dept, month, submitted) VALUES(?, strftime('%Y-%m', 'now'), 1)
+              ON CONFLICT(dept, month) DO UPDATE SET submitted = submitted + 1
+            """, (dept[0],))
+            bump_data_versions(conn, {dept[0]})
     return req_id
 
+# ---- tệp đính kèm ----
+# Một blob (utils.BLOB_DIR hoặc bảng blobs) có thể được nhiều đơn dùng chung;
+# refcount tăng trong cùng transaction tạo đơn.
+def _add_attachment_refs(conn, paths):
+    conn.executemany("""
+      INSERT INTO attachments(path, refcount) VALUES(?, 1)
+      ON CONFLICT(path) DO UPDATE SET refcount = refcount + 1
+    """, [(p,) for p in paths])
 
-import bcrypt
-import sqlite3
+def referenced_attachments():
+    """Tập đường dẫn tệp đính kèm còn được ít nhất một đơn tham chiếu."""
+    with connection() as conn:
+        return {r[0] for r in conn.execute("SELECT path FROM attachments WHERE refcount > 0")}
 
-def create_user(name, username, password, role, dept, email=None):
-    hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    conn = sqlite3.connect("data/hr.db")
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO users (name, username, password, role, dept, email)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (name, username, hashed_pw, role, dept, email))
-    conn.commit()
-    conn.close()
+def put_blob(key, data):
+    """Lưu nội dung blob (utils.DatabaseBlobStore); đã có thì chỉ làm mới created_at để gc không xóa nhầm."""
+    with transaction() as conn:
+        conn.execute("""
+          INSERT INTO blobs(key, size, data) VALUES(?,?,?)
+          ON CONFLICT(key) DO UPDATE SET created_at = datetime('now')
+        """, (key, len(data), data))
+
+def get_blob(key):
+    with connection() as conn:
+        row = conn.execute("SELECT data FROM blobs WHERE key = ?", (key,)).fetchone()
+    return bytes(row[0]) if row else None
+
+def blob_exists(key):
+    with connection() as conn:
+        return conn.execute("SELECT 1 FROM blobs WHERE key = ?", (key,)).fetchone() is not None
+
+def list_blobs(created_before):
+    """(key, size) các blob tạo trước thời điểm UTC `created_before` (cho gc-uploads)."""
+    with connection() as conn:
+        return [tuple(r) for r in conn.execute("SELECT key, size FROM blobs WHERE created_at < ?",
+                                               (created_before,))]
+
+def delete_blobs(keys):
+    with transaction() as conn:
+        conn.executemany("DELETE FROM blobs WHERE key = ?", [(k,) for k in keys])
+
+# ---- đo đạc (HR_INSTRUMENT=1, xem instrument.py) ----
+if instrument.ENABLED:
+    instrument.wrap_functions(globals(), prefix="db.")
@@ -0,0 +1,186 @@
+# db_server.py
+# Máy chủ SQLite cho chế độ nhiều máy (HR_DATABASE_URL=sqlite+tcp://host:port,
+# xem backends.py). Chạy trên máy giữ file hr.db:
+#
+#     HR_DATABASE_KEY=<khóa chung> python db_server.py --listen 0.0.0.0:7433
+#
+# Mỗi kết nối của app (pool trong db.py) được phục vụ bởi một thread với một
+# kết nối SQLite riêng; ghi vẫn tuần tự theo khóa ghi của SQLite như khi chạy
+# một máy. Kết quả đọc gửi theo lô PREFETCH_ROWS dòng.
+import argparse
+import os
+import socket
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from multiprocessing.connection import Listener, AuthenticationError, answer_challenge, deliver_challenge
+from pathlib import Path
+
+import backends
+import db
+
+MAX_OPEN_CURSORS = 16      # cursor đọc dở mỗi kết nối; quá thì đóng cursor cũ nhất
+HANDSHAKE_TIMEOUT = 10     # giây để client hoàn tất xác thực HR_DATABASE_KEY
+
+
+def _result(cursor, cursors, next_id):
+    reply = {"cursor": None, "description": None, "rows": [], "done": True,
+             "rowcount": cursor.rowcount, "lastrowid": cursor.lastrowid}
+    if cursor.description:
+        reply["description"] = [(d[0],) + (None,) * 6 for d in cursor.description]
+        reply["rows"] = cursor.fetchmany(backends.PREFETCH_ROWS)
+        if len(reply["rows"]) == backends.PREFETCH_ROWS:
+            reply["cursor"], reply["done"] = next_id, False
+            cursors[next_id] = cursor
+            while len(cursors) > MAX_OPEN_CURSORS:
+                cursors.popitem(last=False)[1].close()
+    return reply
+
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def authenticate(channel, authkey, timeout=HANDSHAKE_TIMEOUT):
+    """
+    Bắt tay HMAC của multiprocessing.connection (như Listener.accept khi có
+    authkey), chạy trên thread của kết nối. Client không trả lời trong
+    `timeout` giây thì socket bị shutdown để recv đang chờ kết thúc.
+    """
+    sock = socket.socket(fileno=os.dup(channel.fileno()))
+    timer = threading.Timer(timeout, _shutdown, args=(sock,))
+    timer.start()
+    try:
+        deliver_challenge(channel, authkey)
+        answer_challenge(channel, authkey)
+    finally:
+        timer.cancel()
+        sock.close()
+
+
+def serve_client(channel, backend):
+    """Phục vụ một kết nối tới khi client đóng (hoặc mất kết nối)."""
+    conn = None
+    cursors = OrderedDict()
+    next_id = 0
+    try:
+        while True:
+            try:
+                request = channel.recv()
+            except (EOFError, OSError):
+                return
+            for cursor_id in request.get("close", ()):
+                cursor = cursors.pop(cursor_id, None)
+                if cursor is not None:
+                    cursor.close()
+            op = request["op"]
+            if op == "close":
+                return
+            try:
+                if op == "hello":
+                    conn = backend.connect(timeout=request.get("timeout", 30), row_factory=None)
+                    reply = {"db_path": str(backend.db_path.resolve()), "sqlite_version": sqlite3.sqlite_version}
+                elif op == "execute":
+                    next_id += 1
+                    reply = _result(conn.execute(request["sql"], request["params"]), cursors, next_id)
+                elif op == "executemany":
+                    reply = _result(conn.executemany(request["sql"], request["params"]), cursors, None)
+                elif op == "fetch":
+                    cursor = cursors.get(request["cursor"])
+                    if cursor is None:
+                        raise sqlite3.ProgrammingError("Cursor đã bị đóng trên db_server.")
+                    rows = cursor.fetchmany(request["size"])
+                    reply = {"rows": rows, "done": len(rows) < request["size"]}
+                    if reply["done"]:
+                        cursors.pop(request["cursor"]).close()
+                elif op == "commit":
+                    conn.commit()
+                    reply = {}
+                elif op == "rollback":
+                    conn.rollback()
+                    reply = {}
+                else:
+                    raise sqlite3.NotSupportedError(f"Thao tác không hỗ trợ: {op}")
+            except Exception as e:
+                reply = {"error": (type(e).__name__, tuple(str(a) for a in e.args))}
+            reply["in_transaction"] = conn.in_transaction if conn is not None else False
+            try:
+                channel.send(reply)
+            except OSError:
+                return
+    finally:
+        for cursor in cursors.values():
+            cursor.close()
+        if conn is not None:
+            conn.close()    # transaction dở dang (client mất kết nối) bị rollback
+        channel.close()
+
+
+def serve(path, address, authkey, max_clients=64, ready=None):
+    """
+    Nhận kết nối tới khi bị ngắt. ready(address) được gọi khi đã mở cổng
+    (address thật, kể cả khi port=0).
+    """
+    db.close_pool()
+    db.DATABASE_URL = None
+    db.DB_PATH = Path(path)
+    db.init_db()
+    db.close_pool()
+    backend = backends.SQLiteBackend(path)
+    slots = threading.BoundedSemaphore(max_clients)
+
+    def run(channel):
+        try:
+            try:
+                authenticate(channel, authkey)
+            except (AuthenticationError, OSError, EOFError) as e:
+                print("db_server: từ chối kết nối:", str(e) or "client ngắt hoặc hết thời gian xác thực", file=sys.stderr)
+                channel.close()
+                return
+            serve_client(channel, backend)
+        finally:
+            slots.release()
+
+    # Listener không có authkey: accept() chỉ nhận kết nối TCP, việc xác thực
+    # (có thể chậm / bị treo) chạy trên thread riêng của kết nối
+    with Listener(address) as listener:
+        if ready:
+            ready(listener.address)
+        while True:
+            slots.acquire()
+            try:
+                channel = listener.accept()
+            except OSError as e:
+                slots.release()
+                print("db_server: lỗi accept:", e, file=sys.stderr)
+                continue
+            threading.Thread(target=run, args=(channel,), name="db-client", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Máy chủ SQLite cho HR_DATABASE_URL=sqlite+tcp://")
+    parser.add_argument("--db", default=str(db.DB_PATH), help="file SQLite (mặc định data/hr.db)")
+    parser.add_argument("--listen", default=f"127.0.0.1:{backends.DEFAULT_PORT}", help="host:port")
+    parser.add_argument("--max-clients", type=int, default=64, help="số kết nối đồng thời tối đa")
+    args = parser.parse_args()
+
+    key = os.environ.get("HR_DATABASE_KEY")
+    if not key:
+        parser.error("cần đặt HR_DATABASE_KEY (khóa chung với các máy chạy app).")
+    host, _, port = args.listen.rpartition(":")
+
+    def ready(address):
+        print(f"db_server đang nghe {address[0]}:{address[1]} ({Path(args.db).resolve()})", flush=True)
+
+    try:
+        serve(args.db, (host or "127.0.0.1", int(port)), key.encode(), args.max_clients, ready)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# duty.py
+# Lưu lịch trực trong hr.db (bảng duty_schedule) thay vì đọc lại cả file CSV:
+# index theo ngày / khoa, và bảng duty_name_tokens chứa từng từ (đã bỏ dấu)
+# trong tên bác sĩ / điều dưỡng để tìm theo tiền tố.
+# File CSV được theo dõi qua bảng duty_sources (mtime / kích thước / sha256):
+# thay file thì sync_csv() chỉ ghi các dòng thay đổi, không nạp lại toàn bộ.
+# pandas chỉ import trong các hàm trả về DataFrame (sync_csv không cần).
+import csv
+import hashlib
+import os
+from pathlib import Path
+
+from db import (connection, transaction, get_data_version, ALL_DATES,
+                bump_data_versions, mark_conflicts_dirty)
+from utils import fold_text
+
+DEFAULT_CSV = Path(__file__).parent / "duty_schedule.csv"
+
+SCHEDULE_COLUMNS = ["date", "department", "doctor", "nurse"]
+
+# scope trong data_versions, tăng mỗi khi lịch trực thay đổi
+DUTY_SCOPE = "__duty__"
+
+
+def _name_tokens(*names):
+    return {tok for name in names for tok in fold_text(name).split()}
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            yield (row["date"].strip(), row["department"].strip(),
+                   (row.get("doctor") or "").strip(), (row.get("nurse") or "").strip())
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _source_key(path):
+    return str(Path(path).resolve())
+
+
+def _record_source(conn, path, stat, sha):
+    conn.execute("""
+      INSERT INTO duty_sources(path, mtime, size, sha256, loaded_at) VALUES(?,?,?,?,datetime('now'))
+      ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime, size = excluded.size,
+        sha256 = excluded.sha256, loaded_at = excluded.loaded_at
+    """, (_source_key(path), stat.st_mtime, stat.st_size, sha))
+
+
+def import_schedule_csv(path=DEFAULT_CSV):
+    """Nạp lại toàn bộ lịch trực từ file CSV (date,department,doctor,nurse)."""
+    stat = os.stat(path)
+    sha = _file_sha256(path)
+    rows = list(_read_csv(path))
+    with transaction() as conn:
+        conn.execute("DELETE FROM duty_name_tokens")
+        conn.execute("DELETE FROM duty_schedule")
+        upsert_rows(conn, rows)
+        _record_source(conn, path, stat, sha)
+        bump_data_versions(conn, [DUTY_SCOPE])
+        mark_conflicts_dirty(conn, [ALL_DATES])
+    return len(rows)
+
+
+def sync_csv(path=DEFAULT_CSV):
+    """
+    Đồng bộ lịch trực với file CSV nếu file đã đổi kể từ lần nạp trước.
+    mtime + kích thước giống lần trước thì không đọc file; khác thì so sha256,
+    rồi chỉ ghi các dòng (date, department) mới / đổi người trực và xóa các
+    dòng không còn trong file nhưng nằm trong khoảng ngày file bao phủ (lịch
+    các tháng không có trong file mới được giữ nguyên).
+    Trả về dict số dòng inserted / updated / deleted, hoặc None nếu không đổi.
+    """
+    if not Path(path).exists():
+        return None
+    stat = os.stat(path)
+    with connection() as conn:
+        src = conn.execute("SELECT mtime, size, sha256 FROM duty_sources WHERE path = ?",
+                           (_source_key(path),)).fetchone()
+    if src and src["mtime"] == stat.st_mtime and src["size"] == stat.st_size:
+        return None
+    sha = _file_sha256(path)
+    if src and src["sha256"] == sha:
+        # chỉ đổi mtime (copy đè cùng nội dung): ghi nhận để lần sau khỏi băm lại
+        with transaction() as conn:
+            _record_source(conn, path, stat, sha)
+        return None
+
+    rows = {(r[0], r[1]): r for r in _read_csv(path)}
+    stats = {"inserted": 0, "updated": 0, "deleted": 0}
+    with transaction() as conn:
+        # process khác có thể vừa đồng bộ xong cùng nội dung
+        cur = conn.execute("SELECT sha256 FROM duty_sources WHERE path = ?", (_source_key(path),)).fetchone()
+        if cur and cur["sha256"] == sha:
+            return None
+        existing = {}
+        if rows:
+            dates = [k[0] for k in rows]
+            existing = {(r["date"], r["department"]): r for r in conn.execute(
+                "SELECT id, date, department, doctor, nurse FROM duty_schedule WHERE date BETWEEN ? AND ?",
+                (min(dates), max(dates)))}
+        changed = []
+        for key, row in rows.items():
+            old = existing.pop(key, None)
+            if old is None:
+                stats["inserted"] += 1
+                changed.append(row)
+            elif (old["doctor"], old["nurse"]) != row[2:]:
+                stats["updated"] += 1
+                changed.append(row)
+        upsert_rows(conn, changed)
+        stale = [(r["id"],) for r in existing.values()]
+        conn.executemany("DELETE FROM duty_name_tokens WHERE schedule_id = ?", stale)
+        conn.executemany("DELETE FROM duty_schedule WHERE id = ?", stale)
+        stats["deleted"] = len(stale)
+        _record_source(conn, path, stat, sha)
+        if changed or stale:
+            bump_data_versions(conn, [DUTY_SCOPE])
+            mark_conflicts_dirty(conn, [(r[0], r[0]) for r in changed] +
+                                 [(r["date"], r["date"]) for r in existing.values()])
+    return stats
+
+
+def upsert_rows(conn, rows):
+    """Thêm / cập nhật các ca (date, department, doctor, nurse) trong transaction `conn`."""
+    if not rows:
+        return
+    conn.executemany("""
+      INSERT INTO duty_schedule(date, department, doctor, nurse) VALUES(?,?,?,?)
+      ON CONFLICT(date, department) DO UPDATE SET doctor = excluded.doctor, nurse = excluded.nurse
+    """, rows)
+    wanted = {(r[0], r[1]) for r in rows}
+    ids = {(r["date"], r["department"]): r["id"] for r in conn.execute(
+        "SELECT id, date, department FROM duty_schedule WHERE date BETWEEN ? AND ?",
+        (min(r[0] for r in rows), max(r[0] for r in rows))) if (r["date"], r["department"]) in wanted}
+    conn.executemany("DELETE FROM duty_name_tokens WHERE schedule_id = ?", [(i,) for i in ids.values()])
+    conn.executemany("INSERT INTO duty_name_tokens(token, schedule_id) VALUES(?,?)",
+                     [(tok, ids[(r[0], r[1])]) for r in rows for tok in _name_tokens(r[2], r[3])])
+
+
+def ensure_loaded(path=DEFAULT_CSV):
+    """Đồng bộ CSV vào DB nếu file đã đổi; gọi ở mỗi lần rerun được (thường chỉ stat file)."""
+    return sync_csv(path)
+
+
+def schedule_version():
+    """Phiên bản dữ liệu lịch trực, dùng làm khóa cache phía giao diện."""
+    return get_data_version(DUTY_SCOPE)
+
+
+def departments():
+    with connection() as conn:
+        return [r[0] for r in conn.execute("SELECT DISTINCT department FROM duty_schedule ORDER BY department")]
+
+
+def _prefix_range(prefix):
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def query_schedule(start_date, end_date=None, department=None, name=None):
+    """
+    Lịch trực trong [start_date, end_date] (chuỗi 'YYYY-MM-DD'), lọc theo khoa
+    và theo tên: mỗi từ trong `name` phải là tiền tố của một từ trong tên bác
+    sĩ hoặc điều dưỡng (không phân biệt hoa thường / dấu).
+    Trả về DataFrame chỉ chứa các dòng khớp, sắp theo ngày.
+    """
+    import pandas as pd
+    sql = "SELECT date, department, doctor, nurse FROM duty_schedule s WHERE date BETWEEN ? AND ?"
+    params = [start_date, end_date or start_date]
+    if department:
+        sql += " AND department = ?"
+        params.append(department)
+    for word in fold_text(name).split():
+        sql += " AND id IN (SELECT schedule_id FROM duty_name_tokens WHERE token >= ? AND token < ?)"
+        params.extend(_prefix_range(word))
+    sql += " ORDER BY date, department"
+    with connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    df = pd.DataFrame.from_records([tuple(r) for r in rows], columns=SCHEDULE_COLUMNS)
+    df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+def roster_matrix(df):
+    """
+    Bảng phân công theo người từ kết quả query_schedule: mỗi dòng là một bác sĩ
+    / điều dưỡng, mỗi cột là một ngày, ô ghi khoa trực; cột cuối là số ca.
+    """
+    import pandas as pd
+    people = df.melt(id_vars=["date", "department"], value_vars=["doctor", "nurse"],
+                     var_name="role", value_name="person")
+    people = people[people["person"] != ""]
+    if people.empty:
+        return pd.DataFrame()
+    grid = people.pivot_table(index=["person", "role"], columns="date", values="department",
+                              aggfunc=", ".join)
+    grid.columns = [d.strftime("%d/%m") for d in grid.columns]
+    counts = people.groupby(["person", "role"]).size().rename("Số ca")
+    return grid.join(counts).fillna("").sort_index()
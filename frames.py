@@ -0,0 +1,62 @@
+# frames.py
+# DataFrame cho các bảng trên giao diện (đơn chờ duyệt, trang đơn của khoa,
+# lịch sử thao tác). Dựng thẳng từ tuple của cursor (cột theo db.*_COLUMNS,
+# các hàm db.*_rows) thay vì list dict; cột thời gian UTC lưu trong DB được
+# đổi sang giờ VN một lần, vectorized, bằng localize(). Các bảng đơn nghỉ được
+# cache theo phiên bản dữ liệu của khoa (cùng cache với db.py, chỉ lưu
+# DataFrame — hàm db.*_rows không cache): rerun khi dữ liệu chưa đổi không
+# phải đọc DB hay dựng lại DataFrame.
+# Module này import pandas nên chỉ import từ các trang cần bảng.
+import pandas as pd
+
+import db
+import instrument
+from utils import LOCAL_TZ
+
+
+def localize(values):
+    """Chuỗi thời gian UTC ('YYYY-MM-DD HH:MM:SS' / ISO) -> Series datetime giờ VN; rỗng -> NaT."""
+    with instrument.span("pandas.tz_convert"):
+        return pd.to_datetime(pd.Series(values), format="ISO8601", utc=True).dt.tz_convert(LOCAL_TZ.zone)
+
+
+def frame(rows, columns=None, timestamps=("created_at",)):
+    """
+    DataFrame từ các dòng (tuple theo `columns`, hoặc dict); các cột trong
+    `timestamps` được đổi sang giờ VN.
+    """
+    df = pd.DataFrame.from_records(rows, columns=list(columns) if columns else None)
+    for col in timestamps:
+        if col in df.columns:
+            df[col] = localize(df[col])
+    return df
+
+
+@db.cached(db.dept_scope)
+def _pending_requests(dept):
+    return frame(db.get_pending_request_rows(dept), db.PENDING_REQUEST_COLUMNS)
+
+
+@db.cached(db.dept_scope)
+def _requests_page(dept, start_date, end_date, page_size, cursor):
+    rows, next_cursor = db.get_requests_page_rows(dept, start_date=start_date, end_date=end_date,
+                                                  page_size=page_size, cursor=cursor)
+    return frame(rows, db.DEPT_REQUEST_COLUMNS), next_cursor
+
+
+def pending_requests(dept):
+    """Đơn chờ duyệt của khoa (cột PENDING_REQUEST_COLUMNS, created_at giờ VN)."""
+    # bản sao nông (copy-on-write): người gọi thêm / sửa cột không làm hỏng cache
+    return _pending_requests(dept).copy(deep=False)
+
+
+def requests_page(dept, start_date, end_date, page_size=50, cursor=None):
+    """Như db.get_requests_page_for_dept nhưng trả (DataFrame, next_cursor)."""
+    df, next_cursor = _requests_page(dept, start_date, end_date, page_size, cursor)
+    return df.copy(deep=False), next_cursor
+
+
+def audit_page(page_size=100, cursor=None, **filters):
+    """Như db.search_audit_logs nhưng trả (DataFrame cột AUDIT_LOG_COLUMNS, timestamp giờ VN, next_cursor)."""
+    rows, next_cursor = db.get_audit_log_rows_page(page_size, cursor, **filters)
+    return frame(rows, db.AUDIT_LOG_COLUMNS, timestamps=("timestamp",)), next_cursor
@@ -0,0 +1,516 @@
+# instrument.py
+# Đo đạc tùy chọn (HR_INSTRUMENT=1) để biết một lần rerun của app.py tốn thời
+# gian ở đâu: SQLite, pandas, bcrypt hay SMTP.
+#   - Mỗi câu SQL qua pool của db.py: thời gian (execute + fetch), số dòng,
+#     gom theo "dấu vân tay" (câu SQL đã thay hằng số bằng ?; tham số chỉ lưu
+#     dạng băm, không lưu giá trị).
+#   - Span: mỗi hàm công khai của db.py, các hàm gắn @timed (send_email,
+#     save_uploaded_file, bcrypt...) và các đoạn trang của app.py (section()).
+#   - Tóm tắt mỗi lần rerun (thread Streamlit của phiên đó): tổng thời gian,
+#     thời gian SQL, các đoạn và câu SQL tốn nhất.
+# Xuất dạng JSON lines (HR_INSTRUMENT_LOG=đường dẫn, mỗi rerun một dòng) hoặc
+# văn bản Prometheus (prometheus_text(); HR_METRICS_PORT để mở endpoint
+# /metrics). Khi tắt: kết nối SQLite là sqlite3.Connection thường, hàm db.py
+# không bị bọc, @timed / section() chỉ kiểm tra một biến bool.
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get("HR_INSTRUMENT", "") not in ("", "0")
+LOG_PATH = os.environ.get("HR_INSTRUMENT_LOG") or None
+RERUN_HISTORY = 100          # số lần rerun gần nhất giữ trong bộ nhớ
+TOP_STATEMENTS = 10          # số câu SQL tốn nhất trong tóm tắt mỗi rerun
+
+# cận trên (giây) của histogram Prometheus
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_lock = threading.Lock()
+_spans = {}                  # tên -> số liệu gộp
+_statements = {}             # fingerprint -> số liệu gộp
+_reruns = deque(maxlen=RERUN_HISTORY)
+_open_reruns = {}            # khóa phiên -> lần rerun đang đo (xem begin_rerun)
+_local = threading.local()
+
+
+def enable(flag=True):
+    """
+    Bật / tắt lúc chạy. Kết nối SQLite mở trước đó không được đo (gọi
+    db.close_pool() để mở lại); hàm db.py chỉ được bọc khi bật từ lúc khởi động.
+    """
+    global ENABLED
+    ENABLED = bool(flag)
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _statements.clear()
+        _reruns.clear()
+
+
+# ---- gộp số liệu ----
+def _new_stat():
+    return {"count": 0, "seconds": 0.0, "max": 0.0, "rows": 0, "buckets": [0] * len(BUCKETS)}
+
+
+def _add(table, key, seconds, rows=0, **info):
+    with _lock:
+        stat = table.get(key)
+        if stat is None:
+            stat = table[key] = dict(_new_stat(), **info)
+        stat["count"] += 1
+        stat["seconds"] += seconds
+        stat["rows"] += rows
+        stat["max"] = max(stat["max"], seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                stat["buckets"][i] += 1
+                break
+
+
+def _add_rows(key, seconds, rows):
+    # thời gian fetch cộng vào câu SQL đã execute, không tính thêm một lần gọi
+    with _lock:
+        stat = _statements.get(key)
+        if stat is not None:
+            stat["seconds"] += seconds
+            stat["rows"] += rows
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        rerun["sql_seconds"] += seconds
+        rerun["last"] = time.perf_counter()
+        entry = rerun["statements"].get(key)
+        if entry is not None:
+            entry["seconds"] += seconds
+            entry["rows"] += rows
+
+
+# ---- dấu vân tay SQL ----
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.I)
+_SPACES = re.compile(r"\s+")
+_fingerprints = {}
+
+
+def fingerprint(sql):
+    """Trả về (id 12 ký tự, câu SQL chuẩn hóa): hằng số -> ?, IN (?,?,...) -> IN (?+)."""
+    cached = _fingerprints.get(sql)
+    if cached is None:
+        text = _SPACES.sub(" ", sql).strip()
+        text = _NUMBER.sub("?", _STRING.sub("?", text))
+        text = _IN_LIST.sub("IN (?+)", text)
+        cached = (hashlib.sha1(text.encode()).hexdigest()[:12], text)
+        if len(_fingerprints) < 10_000:
+            _fingerprints[sql] = cached
+    return cached
+
+
+def params_fingerprint(params):
+    """Băm tham số (để nhận ra lời gọi lặp lại cùng giá trị mà không lưu giá trị)."""
+    if not params:
+        return None
+    return hashlib.sha1(repr(params).encode()).hexdigest()[:8]
+
+
+def _record_sql(sql, params, seconds, rows, many=False):
+    key, text = fingerprint(sql)
+    _add(_statements, key, seconds, rows, sql=text)
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        rerun["sql_calls"] += 1
+        rerun["sql_seconds"] += seconds
+        rerun["last"] = time.perf_counter()
+        entry = rerun["statements"].setdefault(key, {"sql": text, "count": 0, "seconds": 0.0, "rows": 0,
+                                                     "params": set()})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+        entry["rows"] += rows
+        if not many and len(entry["params"]) < 50:
+            entry["params"].add(params_fingerprint(params))
+    return key
+
+
+def record_sql(sql, params, seconds, rows, many=False):
+    """Ghi một câu SQL chạy qua kết nối không phải sqlite3 (backends.RemoteConnection); trả về fingerprint."""
+    return _record_sql(sql, params, seconds, rows, many)
+
+
+def record_fetch(key, seconds, rows):
+    """Cộng thời gian / số dòng đọc thêm vào câu SQL `key` (từ record_sql)."""
+    _add_rows(key, seconds, rows)
+
+
+class TimingCursor(sqlite3.Cursor):
+    """Cursor đo thời gian execute / fetch và số dòng của từng câu SQL."""
+
+    _key = None
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._key = _record_sql(sql, parameters, time.perf_counter() - t0, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._key = _record_sql(sql, None, time.perf_counter() - t0, max(self.rowcount, 0), many=True)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        _add_rows(self._key, time.perf_counter() - t0, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _add_rows(self._key, time.perf_counter() - t0, len(rows))
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        _add_rows(self._key, time.perf_counter() - t0, len(rows))
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            _add_rows(self._key, time.perf_counter() - t0, 0)
+            raise
+        _add_rows(self._key, time.perf_counter() - t0, 1)
+        return row
+
+
+class TimingConnection(sqlite3.Connection):
+    """Kết nối SQLite mà mọi cursor (kể cả conn.execute) là TimingCursor."""
+
+    def cursor(self, factory=TimingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record_span("sqlite.commit", time.perf_counter() - t0)
+
+
+def connection_factory():
+    """factory cho sqlite3.connect: TimingConnection khi đang bật, không thì Connection thường."""
+    return TimingConnection if ENABLED else sqlite3.Connection
+
+
+# ---- span ----
+def record_span(name, seconds, rows=0):
+    _record_span(name, seconds, rows)
+
+
+def _record_span(name, seconds, rows=0):
+    _add(_spans, name, seconds, rows)
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        rerun["last"] = time.perf_counter()
+        entry = rerun["spans"].setdefault(name, {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record_span(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """with span("reports.xlsx"): ... — đo một khối lệnh (không làm gì khi tắt)."""
+    return _Span(name) if ENABLED else _NO_SPAN
+
+
+def timed(name=None):
+    """Decorator: đo mỗi lần gọi hàm như một span (mặc định tên module.hàm)."""
+    def decorator(fn):
+        label = name or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - t0
+            _record_span(label, seconds, len(result) if isinstance(result, (list, tuple)) else 0)
+            return result
+        return wrapper
+    return decorator
+
+
+# hàm trả về context manager / iterator: thời gian gọi không có ý nghĩa
+_SKIP_WRAP = {"connection", "transaction", "get_conn", "iter_requests_for_dept"}
+
+
+def wrap_functions(namespace, prefix):
+    """
+    Bọc mọi hàm công khai định nghĩa trong module (namespace = globals() của
+    module) bằng @timed; gọi ở cuối module khi ENABLED lúc khởi động.
+    """
+    import inspect
+    module = namespace["__name__"]
+    for attr, value in list(namespace.items()):
+        if (attr.startswith("_") or attr in _SKIP_WRAP or not inspect.isfunction(value)
+                or value.__module__ != module or inspect.isgeneratorfunction(inspect.unwrap(value))):
+            continue
+        namespace[attr] = timed(prefix + attr)(value)
+
+
+# ---- tóm tắt mỗi lần rerun ----
+def begin_rerun(key=None, **info):
+    """
+    Bắt đầu đo một lần rerun trên thread hiện tại (kết thúc lần trước nếu còn
+    mở). key: khóa phiên Streamlit. Lần rerun trước của cùng phiên dừng giữa
+    chừng bằng st.stop() / st.rerun() (chạy trên thread khác, không tới được
+    end_rerun()) được kết thúc tại đây, tính tới lúc nó còn chạy SQL / span
+    cuối cùng, và đánh dấu "stopped".
+    """
+    if not ENABLED:
+        return
+    end_rerun()
+    if key is not None:
+        with _lock:
+            previous = _open_reruns.pop(key, None)
+        if previous is not None:
+            _finish(previous, previous["last"], stopped=True)
+    now = time.perf_counter()
+    _local.rerun = {"info": info, "key": key, "started": now, "last": now, "at": time.time(), "sql_calls": 0,
+                    "sql_seconds": 0.0, "statements": {}, "spans": {}, "sections": [], "section": None,
+                    "section_t0": now}
+    if key is not None:
+        with _lock:
+            _open_reruns[key] = _local.rerun
+            if len(_open_reruns) > 1000:    # phiên đã đóng (đăng xuất, tắt tab)
+                del _open_reruns[next(iter(_open_reruns))]
+
+
+def annotate(**info):
+    """Gắn thêm thông tin (user, page...) vào lần rerun đang đo."""
+    rerun = getattr(_local, "rerun", None) if ENABLED else None
+    if rerun is not None:
+        rerun["info"].update(info)
+
+
+def section(name):
+    """
+    Đánh dấu bắt đầu một đoạn của trang: thời gian từ đây tới section() kế
+    tiếp / end_rerun() được ghi thành span "app.<name>".
+    """
+    rerun = getattr(_local, "rerun", None) if ENABLED else None
+    if rerun is None:
+        return
+    _close_section(rerun)
+    rerun["section"] = name
+
+
+def _close_section(rerun, now=None):
+    now = time.perf_counter() if now is None else now
+    rerun["last"] = now
+    if rerun["section"] is not None:
+        seconds = now - rerun["section_t0"]
+        rerun["sections"].append((rerun["section"], seconds))
+        _record_span("app." + rerun["section"], seconds)
+    rerun["section"], rerun["section_t0"] = None, now
+
+
+def end_rerun(**info):
+    """Kết thúc lần rerun đang mở (nếu có), lưu và trả về bản tóm tắt."""
+    rerun = getattr(_local, "rerun", None)
+    if rerun is None:
+        return None
+    _local.rerun = None
+    if rerun["key"] is not None:
+        with _lock:
+            if _open_reruns.get(rerun["key"]) is rerun:
+                del _open_reruns[rerun["key"]]
+    return _finish(rerun, time.perf_counter(), **info)
+
+
+def _finish(rerun, now, **info):
+    _close_section(rerun, now)
+    seconds = now - rerun["started"]
+    top = sorted(rerun["statements"].items(), key=lambda kv: kv[1]["seconds"], reverse=True)[:TOP_STATEMENTS]
+    summary = {
+        "at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(rerun["at"])),
+        **rerun["info"], **info,
+        "seconds": seconds,
+        "sql_calls": rerun["sql_calls"],
+        "sql_seconds": rerun["sql_seconds"],
+        "sections": [{"name": n, "seconds": s} for n, s in rerun["sections"]],
+        "spans": rerun["spans"],
+        "top_sql": [{"fingerprint": k, "sql": v["sql"][:300], "count": v["count"], "seconds": v["seconds"],
+                     "rows": v["rows"], "distinct_params": len(v["params"])} for k, v in top],
+    }
+    _add(_spans, "app.rerun", seconds)
+    with _lock:
+        _reruns.append(summary)
+    if LOG_PATH:
+        with _lock, open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"type": "rerun", **summary}, ensure_ascii=False, default=str) + "\n")
+    return summary
+
+
+# ---- đọc / xuất ----
+def recent_reruns():
+    with _lock:
+        return list(_reruns)
+
+
+def statement_stats():
+    """Số liệu gộp theo câu SQL, tốn thời gian nhất trước."""
+    with _lock:
+        rows = [dict(v, fingerprint=k) for k, v in _statements.items()]
+    return sorted(rows, key=lambda r: r["seconds"], reverse=True)
+
+
+def span_stats():
+    with _lock:
+        rows = [dict(v, name=k) for k, v in _spans.items()]
+    return sorted(rows, key=lambda r: r["seconds"], reverse=True)
+
+
+def jsonl_text(gauges=None):
+    """Số liệu gộp (span, câu SQL, gauges) dạng JSON lines."""
+    lines = [{"type": "span", **s} for s in span_stats()] + [{"type": "sql", **s} for s in statement_stats()]
+    lines += [{"type": "rerun", **r} for r in recent_reruns()]
+    if gauges:
+        lines += [{"type": "gauge", "group": g, **values} for g, values in gauges.items()]
+    return "".join(json.dumps(line, ensure_ascii=False, default=str) + "\n" for line in lines)
+
+
+def export_jsonl(path, gauges=None):
+    """Ghi jsonl_text() vào cuối file path."""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(jsonl_text(gauges))
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _histogram(out, metric, label, stat):
+    cumulative = 0
+    for bound, count in zip(BUCKETS, stat["buckets"]):
+        cumulative += count
+        out.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+    out.append(f'{metric}_bucket{{{label},le="+Inf"}} {stat["count"]}')
+    out.append(f"{metric}_sum{{{label}}} {stat['seconds']:.6f}")
+    out.append(f"{metric}_count{{{label}}} {stat['count']}")
+
+
+def prometheus_text(gauges=None):
+    """
+    Số liệu dạng text exposition của Prometheus. gauges: {nhóm: {tên: số}}
+    (vd. {"pool": db.pool_stats()}) xuất thành hr_<nhóm>_<tên>; giá trị là
+    dict (vd. outbox depth theo trạng thái) xuất thành hr_<nhóm>_<tên>{key="..."}.
+    """
+    out = ["# TYPE hr_span_seconds histogram"]
+    for s in span_stats():
+        _histogram(out, "hr_span_seconds", f'name="{_label(s["name"])}"', s)
+    out.append("# TYPE hr_sql_seconds histogram")
+    for s in statement_stats():
+        _histogram(out, "hr_sql_seconds", f'fingerprint="{s["fingerprint"]}"', s)
+    out.append("# TYPE hr_sql_rows_total counter")
+    for s in statement_stats():
+        out.append(f'hr_sql_rows_total{{fingerprint="{s["fingerprint"]}",sql="{_label(s["sql"][:200])}"}} {s["rows"]}')
+    for group, values in (gauges or {}).items():
+        for name, value in values.items():
+            metric = f"hr_{group}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+            if isinstance(value, dict):
+                out.append(f"# TYPE {metric} gauge")
+                for key, v in value.items():
+                    if _number(v):
+                        out.append(f'{metric}{{key="{_label(key)}"}} {v}')
+            elif _number(value):
+                out.append(f"{metric} {value}")
+    return "\n".join(out) + "\n"
+
+
+_server = None
+
+
+def serve_metrics(port, gauges=None):
+    """
+    Mở endpoint GET /metrics (Prometheus) trên thread nền, một lần mỗi
+    process. gauges: hàm không đối số trả về dict như của prometheus_text.
+    """
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text(gauges() if gauges else None).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
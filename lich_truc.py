@@ -1,6 +1,8 @@
 import streamlit as st
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import duty
+from db import init_db
 
 # Cấu hình trang
 st.set_page_config(page_title="Lịch trực", layout="wide")
@@ -10,32 +12,47 @@ st.title("📅 Lịch trực")
 now = datetime.now().date()
 st.write(f"Hôm nay: {now.strftime('%d/%m/%Y')}")
 
-# Đọc dữ liệu lịch trực
-@st.cache_data
-def load_data():
-    df = pd.read_csv('duty_schedule.csv', parse_dates=['date'])
-    return df
+# Lịch trực lưu trong hr.db (duty.py). init_db chỉ chạy thật một lần mỗi
+# process; đồng bộ CSV chạy mỗi lần rerun nhưng chỉ stat file, đọc lại khi file đổi.
+init_db()
+duty.ensure_loaded()
+version = duty.schedule_version()
 
-data = load_data()
+@st.cache_data(max_entries=64)
+def load_schedule(start, end, department, name, version):
+    # version đổi khi lịch trực được đồng bộ lại -> tự bỏ cache cũ
+    return duty.query_schedule(start, end, department=department, name=name)
 
 # Danh sách khoa
-departments = sorted(data['department'].unique().tolist())
+departments = duty.departments()
 
 # Form tìm kiếm
 with st.sidebar:
     st.header("🔍 Tìm kiếm")
-    selected_date = st.date_input("Ngày", value=now)
+    view = st.radio("Xem theo", ["Ngày", "Tuần", "Tháng", "Theo người trực"])
+    selected_date = st.date_input("Ngày", value=now) or now
     dept = st.selectbox("Khoa", options=["Tất cả"] + departments)
-    doctor = st.text_input("Bác sĩ")
+    doctor = st.text_input("Bác sĩ / điều dưỡng")
+
+# Khoảng ngày cần xem
+if view == "Ngày":
+    start = end = selected_date
+elif view == "Tuần":
+    start = selected_date - timedelta(days=selected_date.weekday())
+    end = start + timedelta(days=6)
+else:
+    start = selected_date.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+if start != end:
+    st.caption(f"Từ {start.strftime('%d/%m/%Y')} đến {end.strftime('%d/%m/%Y')}")
 
-# Lọc dữ liệu
-filtered = data.copy()
-if selected_date:
-    filtered = filtered[filtered['date'] == pd.Timestamp(selected_date)]
-if dept != "Tất cả":
-    filtered = filtered[filtered['department'] == dept]
-if doctor:
-    filtered = filtered[filtered['doctor'].str.contains(doctor, case=False, na=False)]
+# Lọc dữ liệu: truy vấn chỉ lấy các dòng khớp (index theo ngày, khoa, tên)
+filtered = load_schedule(
+    start.isoformat(), end.isoformat(),
+    None if dept == "Tất cả" else dept,
+    doctor,
+    version,
+)
 
 # Thêm cột thứ và ngày
 weekday_map = {
@@ -47,14 +64,19 @@ weekday_map = {
     5: "Thứ bảy",
     6: "Chủ nhật",
 }
-filtered['Thứ'] = filtered['date'].dt.weekday.map(weekday_map)
-filtered['Ngày'] = filtered['date'].dt.strftime('%d/%m/%Y')
 
 # Hiển thị kết quả
 if filtered.empty:
     st.info("Không tìm thấy lịch trực phù hợp.")
+elif view == "Theo người trực":
+    roster = duty.roster_matrix(filtered).rename(index={'doctor': 'Bác sĩ', 'nurse': 'Điều dưỡng'})
+    roster.index.names = ['Người trực', 'Vai trò']
+    st.dataframe(roster, use_container_width=True)
 else:
+    filtered = filtered.copy()
+    filtered['Thứ'] = filtered['date'].dt.weekday.map(weekday_map)
+    filtered['Ngày'] = filtered['date'].dt.strftime('%d/%m/%Y')
     show = filtered[['Thứ', 'Ngày', 'department', 'doctor', 'nurse']].rename(
         columns={'department': 'Khoa trực', 'doctor': 'Bác sĩ trực', 'nurse': 'Điều dưỡng trực'}
     )
-    st.dataframe(show, use_container_width=True)
+    st.dataframe(show, use_container_width=True, hide_index=True)
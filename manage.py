@@ -0,0 +1,242 @@
+# manage.py
+# Các lệnh bảo trì chạy tay:
+#
+#     python manage.py rebuild-balances [--verify]
+#     python manage.py rebuild-occupancy [--verify]
+#     python manage.py rebuild-rollups [--verify]
+#     python manage.py import-duty [duty_schedule.csv] [--full]
+#     python manage.py import {users,leaves,duty} FILE.csv|FILE.xlsx [--workers N] [--batch N]
+#     python manage.py check-conflicts [--full] [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+#     python manage.py gc-uploads [--dry-run] [--grace-hours 1]
+#     python manage.py audit-archive [--hot-months 3] [--compress-after 24] [--vacuum]
+#     python manage.py audit-restore YYYY-MM
+import argparse
+import os
+import sys
+import time
+
+import db
+
+
+def cmd_rebuild_balances(args):
+    db.init_db()
+    if not args.verify:
+        db.rebuild_leave_balances()
+    mismatches = db.verify_leave_balances()
+    for emp, year, stored, expected in mismatches:
+        print(f"employee_id={emp} year={year}: sổ phép={stored}, tính lại={expected}")
+    if mismatches:
+        print(f"❌ {len(mismatches)} dòng leave_balances bị lệch.")
+        return 1
+    print("✅ leave_balances khớp với leave_requests.")
+    return 0
+
+
+def cmd_rebuild_occupancy(args):
+    db.init_db()
+    if not args.verify:
+        db.rebuild_dept_occupancy()
+    mismatches = db.verify_dept_occupancy()
+    for dept, day, stored, expected in mismatches[:50]:
+        print(f"{dept} {day}: dept_occupancy={stored}, tính lại={expected}")
+    if mismatches:
+        print(f"❌ {len(mismatches)} dòng dept_occupancy bị lệch.")
+        return 1
+    print("✅ dept_occupancy khớp với leave_requests.")
+    return 0
+
+
+def cmd_rebuild_rollups(args):
+    db.init_db()
+    if not args.verify:
+        db.rebuild_rollups()
+    mismatches = db.verify_rollups()
+    for table, key, stored, expected in mismatches[:50]:
+        print(f"{table} {' '.join(map(str, key))}: lưu={stored}, tính lại={expected}")
+    if mismatches:
+        print(f"❌ {len(mismatches)} dòng tổng hợp thống kê bị lệch.")
+        return 1
+    print("✅ dept_month_usage / dept_decisions khớp với leave_requests.")
+    return 0
+
+
+def cmd_import_duty(args):
+    import duty
+
+    db.init_db()
+    if args.full:
+        count = duty.import_schedule_csv(args.path)
+        print(f"✅ Đã nạp {count} dòng lịch trực từ {args.path}.")
+        return 0
+    stats = duty.sync_csv(args.path)
+    if stats is None:
+        print(f"✅ {args.path} không đổi kể từ lần nạp trước.")
+    else:
+        print(f"✅ Đồng bộ {args.path}: thêm {stats['inserted']}, sửa {stats['updated']}, "
+              f"xóa {stats['deleted']} dòng.")
+    return 0
+
+
+def cmd_import(args):
+    import bulk_import
+
+    db.init_db()
+    options = {"batch_size": args.batch} if args.batch else {}
+    if args.kind == "users":
+        options.update(workers=args.workers or bulk_import.HASH_WORKERS, reset_passwords=args.reset_passwords)
+    elif args.kind == "leaves":
+        options["defer_indexes"] = not args.keep_indexes
+    importer = bulk_import.IMPORTERS[args.kind]
+    stats = importer(bulk_import.read_rows(args.path), **options)
+    for line, error in stats["errors"][:50]:
+        print(f"  dòng {line}: {error}")
+    counts = ", ".join(f"{k} {stats[k]}" for k in ("inserted", "updated") if k in stats)
+    print(f"{'⚠️' if stats['errors'] else '✅'} {args.path}: {stats['rows']:,} dòng trong {stats['seconds']:.1f}s "
+          f"({stats['rows_per_sec']:,.0f} dòng/s){', ' + counts if counts else ''}, "
+          f"{len(stats['errors'])} dòng lỗi bị bỏ qua.")
+    return 1 if stats["errors"] else 0
+
+
+def cmd_check_conflicts(args):
+    import conflicts
+
+    db.init_db()
+    if args.full:
+        with db.transaction() as conn:
+            db.mark_conflicts_dirty(conn, [db.ALL_DATES])
+    rows = conflicts.list_conflicts(args.date_from, args.date_to)
+    for r in rows:
+        print(f"{r['date']} {r['department']}: {r['person']} trực nhưng nghỉ phép (đơn #{r['request_id']})")
+    if rows:
+        print(f"⚠️ {len(rows)} ca trực trùng ngày nghỉ phép đã duyệt.")
+        return 1
+    print("✅ Không có ca trực nào trùng ngày nghỉ phép.")
+    return 0
+
+
+def cmd_gc_uploads(args):
+    import utils
+
+    db.init_db()
+    attachments = db.referenced_attachments()
+    referenced = {os.path.realpath(p) for p in attachments}
+    # blob vừa tải lên có thể chưa kịp gắn vào đơn: chừa thời gian ân hạn
+    cutoff = time.time() - args.grace_hours * 3600
+    orphans = [p for p in utils.iter_blobs()
+               if os.path.realpath(p) not in referenced and p.stat().st_mtime < cutoff]
+    tmp_dir = utils.BLOB_DIR / "tmp"
+    if tmp_dir.exists():
+        orphans += [p for p in tmp_dir.iterdir() if p.is_file() and p.stat().st_mtime < cutoff]
+    freed = 0
+    for path in orphans:
+        freed += path.stat().st_size
+        print(("(thử) " if args.dry_run else "") + f"xóa {path}")
+        if not args.dry_run:
+            path.unlink(missing_ok=True)
+
+    # blob lưu trong DB (HR_BLOB_STORE=db)
+    created_before = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(cutoff))
+    db_orphans = [(key, size) for key, size in db.list_blobs(created_before)
+                  if utils.DB_BLOB_PREFIX + key not in attachments]
+    for key, size in db_orphans:
+        freed += size
+        print(("(thử) " if args.dry_run else "") + f"xóa {utils.DB_BLOB_PREFIX}{key}")
+    if db_orphans and not args.dry_run:
+        db.delete_blobs([key for key, _ in db_orphans])
+    orphans += db_orphans
+    print(f"✅ {len(orphans)} file không còn được dùng, {freed / (1024 * 1024):.1f} MB.")
+    return 0
+
+
+def cmd_audit_archive(args):
+    db.init_db()
+    for month, rows in db.archive_audit_logs(args.hot_months):
+        print(f"{month}: chuyển {rows} dòng audit sang file archive")
+    for month in db.compress_audit_partitions(args.compress_after):
+        print(f"{month}: đã nén gzip")
+    if args.vacuum:
+        # trả lại dung lượng các dòng đã chuyển đi (khóa DB trong lúc chạy)
+        conn = db.get_conn()
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    for p in db.list_audit_partitions():
+        print(f"  {p['month']}  {p['state']:<10} {p['row_count']:>8} dòng  {(p['bytes'] or 0) / 1024:,.0f} KB")
+    with db.connection() as conn:
+        hot = conn.execute("SELECT COUNT(*) FROM audit_logs").fetchone()[0]
+    print(f"✅ Bảng audit_logs trong hr.db còn {hot} dòng.")
+    return 0
+
+
+def cmd_audit_restore(args):
+    db.init_db()
+    if not db.restore_audit_partition(args.month):
+        print(f"❌ Không có phân vùng nén cho tháng {args.month}.")
+        return 1
+    print(f"✅ Đã giải nén audit tháng {args.month}.")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lệnh bảo trì Hospital HR")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("rebuild-balances", help="Tính lại sổ phép từ leave_requests")
+    p.add_argument("--verify", action="store_true", help="Chỉ kiểm tra, không ghi")
+    p.set_defaults(func=cmd_rebuild_balances)
+
+    p = sub.add_parser("rebuild-occupancy", help="Tính lại số người nghỉ theo khoa / ngày")
+    p.add_argument("--verify", action="store_true", help="Chỉ kiểm tra, không ghi")
+    p.set_defaults(func=cmd_rebuild_occupancy)
+
+    p = sub.add_parser("rebuild-rollups", help="Tính lại các bảng tổng hợp của trang thống kê")
+    p.add_argument("--verify", action="store_true", help="Chỉ kiểm tra, không ghi")
+    p.set_defaults(func=cmd_rebuild_rollups)
+
+    p = sub.add_parser("import-duty", help="Đồng bộ lịch trực từ file CSV")
+    p.add_argument("path", nargs="?", default="duty_schedule.csv")
+    p.add_argument("--full", action="store_true", help="Xóa và nạp lại toàn bộ thay vì chỉ dòng thay đổi")
+    p.set_defaults(func=cmd_import_duty)
+
+    p = sub.add_parser("import", help="Nhập hàng loạt nhân viên / lịch sử nghỉ phép / lịch trực từ CSV hoặc XLSX")
+    p.add_argument("kind", choices=["users", "leaves", "duty"])
+    p.add_argument("path")
+    p.add_argument("--batch", type=int, default=None, help="Số dòng mỗi lô executemany")
+    p.add_argument("--workers", type=int, default=None, help="Số process băm mật khẩu (users)")
+    p.add_argument("--reset-passwords", action="store_true",
+                   help="Đặt lại mật khẩu cả tài khoản đã có theo cột password (users)")
+    p.add_argument("--keep-indexes", action="store_true",
+                   help="Không xóa / tạo lại index của leave_requests khi nhập (leaves)")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("check-conflicts", help="Liệt kê ca trực trùng ngày nghỉ phép đã duyệt")
+    p.add_argument("--full", action="store_true", help="Kiểm tra lại toàn bộ thay vì chỉ phần thay đổi")
+    p.add_argument("--from", dest="date_from", default=db.ALL_DATES[0])
+    p.add_argument("--to", dest="date_to", default=db.ALL_DATES[1])
+    p.set_defaults(func=cmd_check_conflicts)
+
+    p = sub.add_parser("gc-uploads", help="Xóa tệp đính kèm không còn đơn nào tham chiếu")
+    p.add_argument("--dry-run", action="store_true", help="Chỉ liệt kê, không xóa")
+    p.add_argument("--grace-hours", type=float, default=1.0,
+                   help="Bỏ qua file mới hơn số giờ này (đang chờ gắn vào đơn)")
+    p.set_defaults(func=cmd_gc_uploads)
+
+    p = sub.add_parser("audit-archive", help="Chuyển audit cũ sang file archive theo tháng, nén phân vùng cũ")
+    p.add_argument("--hot-months", type=int, default=None,
+                   help=f"Số tháng giữ trong hr.db (mặc định {db.AUDIT_HOT_MONTHS})")
+    p.add_argument("--compress-after", type=int, default=None,
+                   help=f"Nén gzip phân vùng cũ hơn số tháng này (mặc định {db.AUDIT_COMPRESS_AFTER_MONTHS})")
+    p.add_argument("--vacuum", action="store_true", help="VACUUM hr.db sau khi chuyển")
+    p.set_defaults(func=cmd_audit_archive)
+
+    p = sub.add_parser("audit-restore", help="Giải nén một phân vùng audit để xem lại")
+    p.add_argument("month", help="YYYY-MM")
+    p.set_defaults(func=cmd_audit_restore)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,245 @@
 # notify.py
-import smtplib
-from email.message import EmailMessage
-import streamlit as st
+# smtplib / email / streamlit chỉ import khi gửi email hoặc đọc cấu hình SMTP:
+# `python notify.py`, manage.py và trang không gửi email không phải tải chúng.
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import db
+import instrument
+
+# ----- cấu hình hàng đợi email -----
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_POLL_SECONDS = 2.0
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF_BASE = 30        # giây; lần thử thứ n chờ base * 2^(n-1)
+OUTBOX_BACKOFF_MAX = 3600
+SMTP_IDLE_SECONDS = 60          # đóng phiên SMTP nếu không dùng quá lâu
+
+def _smtp_config():
+    import streamlit as st
+    return st.secrets.get("smtp")
+
+def _build_message(smtp, to_email, subject, body):
+    from email.message import EmailMessage
+    msg = EmailMessage()
+    msg.set_content(body)
+    msg['Subject'] = subject
+    msg['From'] = smtp.get("from")
+    msg['To'] = to_email
+    return msg
+
+def _open_smtp(smtp):
+    host = smtp.get("host")
+    port = int(smtp.get("port", 587))
+    starttls = smtp.get("starttls", True)
+
+    import smtplib
+    s = smtplib.SMTP(host, port, timeout=10)
+    try:
+        if starttls:
+            s.starttls()
+        user = smtp.get("user")
+        pwd = smtp.get("pass")
+        if user:
+            s.login(user, pwd)
+    except Exception:
+        s.close()
+        raise
+    return s
 
 def send_email(to_email: str, subject: str, body: str) -> bool:
     """
     Trả về True nếu gửi thành công, False nếu thất bại.
     Cấu hình SMTP lấy từ st.secrets["smtp"].
     """
-    smtp = st.secrets.get("smtp")
+    return send_emails([(to_email, subject, body)]) == 1
+
+@instrument.timed()
+def send_emails(messages) -> int:
+    """
+    Gửi nhiều email qua cùng một phiên SMTP (một lần kết nối/STARTTLS/login).
+    messages: danh sách (to_email, subject, body). Trả về số email gửi thành công.
+    """
+    messages = list(messages)
+    if not messages:
+        return 0
+    smtp = _smtp_config()
     if not smtp:
         print("No SMTP configured in st.secrets. To test locally, run a debug SMTP server.")
-        return False
+        return 0
+    import smtplib
+    sent = 0
     try:
-        msg = EmailMessage()
-        msg.set_content(body)
-        msg['Subject'] = subject
-        msg['From'] = smtp.get("from")
-        msg['To'] = to_email
-
-        host = smtp.get("host")
-        port = int(smtp.get("port", 587))
-        starttls = smtp.get("starttls", True)
-
-        with smtplib.SMTP(host, port, timeout=10) as s:
-            if starttls:
-                s.starttls()
-            user = smtp.get("user")
-            pwd = smtp.get("pass")
-            if user:
-                s.login(user, pwd)
-            s.send_message(msg)
-        return True
+        with _open_smtp(smtp) as s:
+            for to_email, subject, body in messages:
+                try:
+                    s.send_message(_build_message(smtp, to_email, subject, body))
+                    sent += 1
+                except smtplib.SMTPRecipientsRefused as e:
+                    print("send_email error:", to_email, e)
     except Exception as e:
         print("send_email error:", e)
-        return False
+    return sent
+
+# ----- worker gửi email từ email_outbox -----
+class OutboxWorker(threading.Thread):
+    """
+    Thread nền lấy email từ bảng email_outbox theo lô và gửi qua một phiên
+    SMTP dùng lại giữa các lô. Email bị máy chủ từ chối được thử lại với
+    backoff lũy thừa, quá OUTBOX_MAX_ATTEMPTS lần thì đánh dấu 'failed'. Lỗi
+    kết nối không tính vào số lần thử của các email chưa gửi tới.
+    """
+
+    def __init__(self, batch_size=OUTBOX_BATCH_SIZE, poll_seconds=OUTBOX_POLL_SECONDS):
+        super().__init__(name="outbox-worker", daemon=True)
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._stop_event = threading.Event()
+        self._smtp = None
+        self._smtp_used_at = 0.0
+        self.stats = {"sent": 0, "retried": 0, "failed": 0, "requeued": 0, "batches": 0, "last_error": None}
+        self.latencies = deque(maxlen=1000)   # giây, từ lúc xếp hàng tới lúc gửi xong
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                sent = self.drain_once()
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                print("outbox worker error:", e)
+                sent = 0
+            if not sent:
+                if self._smtp and time.monotonic() - self._smtp_used_at > SMTP_IDLE_SECONDS:
+                    self._close_smtp()
+                self._stop_event.wait(self.poll_seconds)
+        self._close_smtp()
+
+    @instrument.timed("notify.drain_once")
+    def drain_once(self):
+        """Gửi một lô; trả về số email đã xử lý (0 nếu hàng đợi trống)."""
+        smtp = _smtp_config()
+        if not smtp:
+            return 0
+        batch = db.claim_outbox_batch(self.batch_size)
+        if not batch:
+            return 0
+        import smtplib
+        self.stats["batches"] += 1
+        sent_ids = []
+        for i, item in enumerate(batch):
+            try:
+                msg = _build_message(smtp, item['to_email'], item['subject'], item['body'])
+            except Exception as e:
+                self._fail(item, e)      # email hỏng (vd. header sai): chỉ email này bị tính lỗi
+                continue
+            try:
+                session = self._session(smtp)
+            except OSError as e:
+                # không kết nối / đăng nhập được SMTP: không phải lỗi của email nào
+                self._close_smtp()
+                self._release(batch[i:], e)
+                break
+            try:
+                session.send_message(msg)
+            except smtplib.SMTPServerDisconnected as e:
+                # mất kết nối giữa chừng: tính lỗi cho email đang gửi, trả phần còn lại về hàng đợi
+                self._close_smtp()
+                self._fail(item, e)
+                self._release(batch[i + 1:], e)
+                break
+            except smtplib.SMTPException as e:
+                # máy chủ từ chối riêng email này (SMTPResponseException, SMTPRecipientsRefused...)
+                self._fail(item, e)
+                continue
+            except OSError as e:
+                self._close_smtp()
+                self._fail(item, e)
+                self._release(batch[i + 1:], e)
+                break
+            self._smtp_used_at = time.monotonic()
+            sent_ids.append(item['id'])
+            self.latencies.append(_age_seconds(item['created_at']))
+        if sent_ids:
+            db.mark_emails_sent(sent_ids)
+            self.stats["sent"] += len(sent_ids)
+        return len(batch)
+
+    def _session(self, smtp):
+        if self._smtp is not None and time.monotonic() - self._smtp_used_at > SMTP_IDLE_SECONDS:
+            try:
+                self._smtp.noop()
+            except Exception:
+                self._close_smtp()
+        if self._smtp is None:
+            self._smtp = _open_smtp(smtp)
+            self._smtp_used_at = time.monotonic()
+        return self._smtp
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+    def _release(self, items, error):
+        if items:
+            db.release_emails([item['id'] for item in items], error, OUTBOX_BACKOFF_BASE)
+            self.stats["requeued"] += len(items)
+            self.stats["last_error"] = str(error)
+
+    def _fail(self, item, error):
+        attempts = item['attempts'] + 1
+        self.stats["last_error"] = str(error)
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            db.mark_email_failed(item['id'], error, retry_in=None)
+            self.stats["failed"] += 1
+        else:
+            delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+            db.mark_email_failed(item['id'], error, retry_in=delay)
+            self.stats["retried"] += 1
+
+def _age_seconds(created_at):
+    # created_at là datetime('now') của SQLite (UTC, 'YYYY-MM-DD HH:MM:SS')
+    return (datetime.utcnow() - datetime.fromisoformat(created_at)).total_seconds()
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_outbox_worker():
+    """Khởi động (một lần cho mỗi process) worker gửi email nền."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = OutboxWorker()
+            _worker.start()
+    return _worker
+
+def outbox_stats():
+    """Độ sâu hàng đợi + số liệu gửi của worker trong process này."""
+    stats = {"depth": db.outbox_depth()}
+    if _worker is not None:
+        stats.update(_worker.stats)
+        lat = sorted(_worker.latencies)
+        if lat:
+            stats["latency_p50"] = lat[len(lat) // 2]
+            stats["latency_p99"] = lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+    return stats
+
+if __name__ == "__main__":
+    # Chạy worker như một process riêng:  python notify.py
+    db.init_db()
+    worker = start_outbox_worker()
+    print("Outbox worker đang chạy (Ctrl+C để dừng).")
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
+        worker.join()
@@ -0,0 +1,59 @@
+# reports.py
+# Xuất báo cáo đơn nghỉ phép theo kiểu streaming: đọc từng lô dòng từ DB và
+# ghi dần vào file tạm (SpooledTemporaryFile chỉ ra đĩa khi vượt ngưỡng),
+# không dựng DataFrame / chuỗi CSV đầy đủ trong bộ nhớ.
+import csv
+import io
+import tempfile
+
+import instrument
+from db import DEPT_REQUEST_COLUMNS, iter_requests_for_dept
+from utils import to_local_time
+
+EXPORT_CHUNK_ROWS = 1000
+SPOOL_MAX_BYTES = 4 * 1024 * 1024
+
+_CREATED_AT = DEPT_REQUEST_COLUMNS.index("created_at")
+
+
+def _localized(rows, naive=False):
+    for row in rows:
+        row = list(row)
+        ts = to_local_time(row[_CREATED_AT])
+        row[_CREATED_AT] = ts.replace(tzinfo=None) if (ts and naive) else ts
+        yield row
+
+
+@instrument.timed()
+def export_requests_csv(dept, start_date, end_date):
+    """Trả về file tạm (đã seek về đầu) chứa báo cáo CSV UTF-8."""
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(DEPT_REQUEST_COLUMNS)
+    for chunk in iter_requests_for_dept(dept, start_date=start_date, end_date=end_date,
+                                        chunk_size=EXPORT_CHUNK_ROWS):
+        writer.writerows(_localized(chunk))
+    text.flush()
+    text.detach()
+    out.seek(0)
+    return out
+
+
+@instrument.timed()
+def export_requests_xlsx(dept, start_date, end_date):
+    """Trả về file tạm (đã seek về đầu) chứa báo cáo Excel (openpyxl write-only)."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("report")
+    ws.append(DEPT_REQUEST_COLUMNS)
+    for chunk in iter_requests_for_dept(dept, start_date=start_date, end_date=end_date,
+                                        chunk_size=EXPORT_CHUNK_ROWS):
+        # Excel không hỗ trợ datetime có múi giờ: ghi giờ VN dạng naive
+        for row in _localized(chunk, naive=True):
+            ws.append(row)
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    wb.save(out)
+    out.seek(0)
+    return out
@@ -1,22 +1,24 @@
 # seed_data.py
-from db import init_db, create_user, get_conn
-import bcrypt
+# Dữ liệu mẫu để chạy thử; chạy lại nhiều lần không tạo bản ghi trùng.
+# Danh sách thật (hàng nghìn nhân viên, lịch sử nghỉ phép, lịch trực) nhập bằng
+# python manage.py import users|leaves|duty FILE.
+from bulk_import import import_users, import_leaves
+from db import init_db
 
-init_db()
+if __name__ == "__main__":
+    init_db()
 
-def hash_pw(p):
-    return bcrypt.hashpw(p.encode(), bcrypt.gensalt()).decode()
+    # Tạo manager & employee
+    import_users([
+        {"username": "manager1", "name": "Trưởng khoa A", "role": "manager", "dept": "Khoa A",
+         "email": "managerA@bv.local", "password": "managerpass"},
+        {"username": "user1", "name": "Bác sĩ A", "role": "employee", "dept": "Khoa A",
+         "email": "userA@bv.local", "password": "userpass"},
+    ], workers=2, report=None)
 
-# Tạo manager & employee
-create_user("manager1", "Trưởng khoa A", "manager", "Khoa A", hash_pw("managerpass"), "managerA@bv.local")
-create_user("user1", "Bác sĩ A", "employee", "Khoa A", hash_pw("userpass"), "userA@bv.local")
-
-# Tạo 1 đơn mẫu (employee id will likely be 2)
-conn = get_conn()
-cur = conn.cursor()
-cur.execute("""INSERT INTO leave_requests (employee_id, start_date, end_date, reason, attachment_path, status)
-               VALUES (?,?,?,?,?,?)""",
-            (2, "2025-08-20", "2025-08-22", "Việc cá nhân", None, "pending"))
-conn.commit()
-conn.close()
-print("Seed xong. Manager: manager1/managerpass | Employee: user1/userpass")
+    # 1 đơn mẫu đang chờ duyệt
+    import_leaves([
+        {"username": "user1", "start_date": "2025-08-20", "end_date": "2025-08-22",
+         "reason": "Việc cá nhân", "status": "pending"},
+    ], report=None)
+    print("Seed xong. Manager: manager1/managerpass | Employee: user1/userpass")
@@ -1,13 +1,34 @@
-import sqlite3
+# show_audit.py
+# In audit log (mới nhất trước), gồm cả các tháng đã chuyển sang file archive:
+#
+#     python show_audit.py [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--limit 500]
+#                          [--text "ốm"] [--action reject] [--user manager1]
+import argparse
+
 import pandas as pd
 
-conn = sqlite3.connect('data/hr.db')
-df = pd.read_sql_query("SELECT * FROM audit_logs ORDER BY timestamp DESC", conn)
+import db
+
+parser = argparse.ArgumentParser(description="In audit log")
+parser.add_argument("--from", dest="start", default=None)
+parser.add_argument("--to", dest="end", default=None, help="không bao gồm ngày này")
+parser.add_argument("--limit", type=int, default=500)
+parser.add_argument("--text", default=None, help="tìm trong ghi chú (không phân biệt dấu)")
+parser.add_argument("--action", default=None)
+parser.add_argument("--user", default=None, help="tên đăng nhập người thao tác")
+args = parser.parse_args()
+
+db.init_db()
+user_id = None
+if args.user:
+    row = db.get_user_by_username(args.user)
+    if row is None:
+        raise SystemExit(f"Không có tài khoản '{args.user}'.")
+    user_id = row['id']
+df = pd.DataFrame(db.get_audit_logs(limit=args.limit, start=args.start, end=args.end,
+                                    text=args.text, action=args.action, user_id=user_id))
 print(df.to_string(index=False))
-conn.close()
-df = pd.read_sql_query("""
-SELECT a.id, a.action, a.user_id, u.username, u.name, a.obj_type, a.obj_id, a.note, a.timestamp
-FROM audit_logs a
-LEFT JOIN users u ON a.user_id = u.id
-ORDER BY a.timestamp DESC
-""", conn)
+compressed = db.compressed_audit_partitions(args.start, args.end)
+if compressed:
+    print(f"\nChưa gồm {len(compressed)} tháng đã nén ({', '.join(p['month'] for p in compressed)}); "
+          "giải nén bằng: python manage.py audit-restore YYYY-MM")
@@ -1,23 +1,175 @@
 # utils.py
+import hashlib
+import io
+import os
+import tempfile
+import unicodedata
 from pathlib import Path
 from datetime import datetime
+import pytz
 
-UPLOAD_DIR = Path(__file__).parent / "uploads"
+import instrument
+
+UPLOAD_DIR = Path(os.environ.get("HR_UPLOAD_DIR") or Path(__file__).parent / "uploads")
+BLOB_DIR = UPLOAD_DIR / "blobs"
+
+MAX_UPLOAD_BYTES = int(os.environ.get("HR_MAX_UPLOAD_MB", "10")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 
 ALLOWED = {".pdf",".png",".jpg",".jpeg"}
 
+LOCAL_TZ = pytz.timezone("Asia/Ho_Chi_Minh")
+
+def to_local_time(utc_text):
+    """Chuỗi thời gian UTC lưu trong DB ('YYYY-MM-DD HH:MM:SS' / ISO) -> datetime giờ VN."""
+    if not utc_text:
+        return None
+    return pytz.utc.localize(datetime.fromisoformat(utc_text)).astimezone(LOCAL_TZ)
+
+def local_date_to_utc(d):
+    """Ngày theo giờ VN (0h) -> chuỗi ISO UTC, để so với timestamp lưu trong DB."""
+    if d is None:
+        return None
+    local = LOCAL_TZ.localize(datetime.combine(d, datetime.min.time()))
+    return local.astimezone(pytz.utc).replace(tzinfo=None).isoformat()
+
+def fold_text(text):
+    """Chữ thường, bỏ dấu tiếng Việt ('Bác sĩ Đức' -> 'bac si duc') để so khớp tên."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFD", str(text).lower().replace("đ", "d"))
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+# ----- tệp đính kèm -----
+# Lưu theo nội dung (tên blob là <sha256><đuôi>): cùng một file tải lên nhiều
+# lần chỉ lưu một bản; số đơn tham chiếu nằm ở bảng attachments (db.py),
+# `python manage.py gc-uploads` xóa blob không còn ai dùng.
+# Hai nơi lưu, chọn bằng HR_BLOB_STORE (đơn cũ vẫn đọc được khi đổi):
+#   local (mặc định)  uploads/blobs/<2 ký tự đầu>/<blob> trên đĩa; nhiều máy thì
+#                     đặt HR_UPLOAD_DIR là thư mục dùng chung (NFS...).
+#   db                bảng blobs trong DB (đi theo HR_DATABASE_URL), tham chiếu
+#                     dạng "db:<blob>".
+BLOB_STORE = os.environ.get("HR_BLOB_STORE", "local")
+DB_BLOB_PREFIX = "db:"
+
+
+class LocalBlobStore:
+    def put(self, tmp_path, name):
+        target = BLOB_DIR / name[:2] / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists():
+            # đã có bản giống hệt: bỏ file tạm, làm mới mtime để gc không xóa nhầm
+            os.unlink(tmp_path)
+            os.utime(target)
+        else:
+            os.replace(tmp_path, target)
+        return str(target)
+
+    def exists(self, ref):
+        return Path(ref).exists()
+
+    def open(self, ref):
+        return open(ref, "rb")
+
+
+class DatabaseBlobStore:
+    def put(self, tmp_path, name):
+        import db
+        try:
+            db.put_blob(name, Path(tmp_path).read_bytes())
+        finally:
+            os.unlink(tmp_path)
+        return DB_BLOB_PREFIX + name
+
+    def exists(self, ref):
+        import db
+        return db.blob_exists(ref[len(DB_BLOB_PREFIX):])
+
+    def open(self, ref):
+        import db
+        data = db.get_blob(ref[len(DB_BLOB_PREFIX):])
+        if data is None:
+            raise FileNotFoundError(ref)
+        return io.BytesIO(data)
+
+
+def blob_store(ref=None):
+    """Nơi lưu của tham chiếu `ref`, hoặc nơi lưu blob mới (HR_BLOB_STORE) nếu ref=None."""
+    kind = BLOB_STORE if ref is None else ("db" if ref.startswith(DB_BLOB_PREFIX) else "local")
+    if kind == "db":
+        return DatabaseBlobStore()
+    if kind == "local":
+        return LocalBlobStore()
+    raise ValueError(f"HR_BLOB_STORE={kind!r} không hợp lệ (local / db).")
+
+
+@instrument.timed()
 def save_uploaded_file(uploaded_file, username):
+    """
+    Ghi file tải lên theo từng khối vào file tạm (tính sha256 trong lúc ghi)
+    rồi chuyển vào nơi lưu blob. Vượt MAX_UPLOAD_BYTES thì dừng ngay và báo
+    lỗi. Trả về tham chiếu blob (lưu vào leave_requests.attachment_path).
+    """
     if uploaded_file is None:
         return None
     ext = Path(uploaded_file.name).suffix.lower()
     if ext not in ALLOWED:
         raise ValueError("File không được phép.")
-    safe_dir = UPLOAD_DIR / username
-    safe_dir.mkdir(parents=True, exist_ok=True)
-    ts = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"{ts}_{Path(uploaded_file.name).name}"
-    target = safe_dir / filename
-    # viết xuống đĩa
-    with open(target, "wb") as f:
-        f.write(uploaded_file.read())
-    return str(target)
+    tmp_dir = BLOB_DIR / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix=f"{username}_", suffix=ext)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_BYTES), b""):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise ValueError(f"File vượt quá {MAX_UPLOAD_BYTES / (1024 * 1024):g} MB.")
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        return blob_store().put(tmp_path, f"{digest.hexdigest()}{ext}")
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def iter_blobs():
+    """Mọi blob đang có trên đĩa (không tính file tạm)."""
+    if not BLOB_DIR.exists():
+        return
+    for path in BLOB_DIR.glob("??/*"):
+        if path.is_file():
+            yield path
+
+def attachment_exists(ref):
+    return bool(ref) and blob_store(ref).exists(ref)
+
+def attachment_name(ref, original_name=None):
+    """
+    Tên file khi tải về: tên gốc lúc tải lên (leave_requests.attachment_name)
+    nếu có, không thì tên blob / tên file trên đĩa.
+    """
+    if original_name:
+        return Path(original_name).name
+    return Path(ref[len(DB_BLOB_PREFIX):] if ref.startswith(DB_BLOB_PREFIX) else ref).name
+
+@instrument.timed()
+def open_attachment(ref):
+    """
+    File object (nhị phân) của tệp đính kèm; blob lưu trên đĩa được đọc dần
+    theo khối tùy người đọc, blob ở bảng blobs (HR_BLOB_STORE=db) thì đã nằm
+    trong bộ nhớ khi lấy từ DB. Dùng làm callable cho st.download_button để
+    chỉ mở khi người dùng bấm tải — lưu ý st.download_button vẫn đọc hết file
+    vào bộ nhớ (media file của Streamlit) trước khi gửi.
+    """
+    return blob_store(ref).open(ref)
+
+def read_attachment(ref):
+    """Toàn bộ nội dung tệp đính kèm (bytes)."""
+    with open_attachment(ref) as f:
+        return f.read()